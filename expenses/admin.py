@@ -1,6 +1,21 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Expense
+from .models import Expense, ExpenseMonthlyRollup, MonthlyReportFailure, MonthlyReportRun, Receipt
 
-admin.site.register(Expense)
\ No newline at end of file
+
+@admin.register(Expense)
+class ExpenseAdmin(admin.ModelAdmin):
+    # __str__ reads the username, load users with the page instead of per row
+    list_select_related = ('user',)
+
+
+admin.site.register(ExpenseMonthlyRollup)
+admin.site.register(MonthlyReportRun)
+admin.site.register(MonthlyReportFailure)
+
+
+@admin.register(Receipt)
+class ReceiptAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'content_type', 'size', 'processed_at', 'created_at')
+    readonly_fields = ('sha256', 'size', 'content_type', 'metadata', 'processed_at', 'created_at')
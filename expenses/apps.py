@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        # Connect the rollup, search index and response cache receivers
+        from . import checks, signals  # noqa: F401
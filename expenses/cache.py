@@ -0,0 +1,93 @@
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from travel_expense_management.metrics import CACHE_REQUESTS
+
+# Bumped on every expense write; part of every cache key, so a bump
+# invalidates all cached responses at once without deleting keys
+GENERATION_KEY = 'expenses:generation'
+
+
+def get_cache():
+    return caches[getattr(settings, 'EXPENSE_RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_generation(cache=None):
+    cache = cache or get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def bump_generation():
+    """
+    Invalidate every cached expense response.
+    """
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Not set yet (or evicted): any new value differs from what was used
+        cache.add(GENERATION_KEY, 2, timeout=None)
+
+
+def invalidate_on_commit():
+    """
+    Bump the generation once the current transaction commits, so a
+    response computed before the commit is never cached as current.
+    """
+    transaction.on_commit(bump_generation)
+
+
+def response_cache_key(request, view_name, generation):
+    """
+    Build the cache key and ETag for a request from the user, the view and
+    the normalized query parameters.
+    """
+    params = sorted(
+        (key, sorted(request.query_params.getlist(key)))
+        for key in request.query_params
+    )
+    user_id = request.user.pk if request.user and request.user.is_authenticated else 'anonymous'
+    # Totals are converted into the user's base currency, which can change
+    currency = getattr(request.user, 'base_currency', '')
+    raw = f'{generation}|{user_id}|{currency}|{request.get_host()}|{view_name}|{params}'
+    digest = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    return f'expenses:response:{digest}', f'"{digest[:32]}"'
+
+
+def cached_response(view_method):
+    """
+    Cache successful responses of a read-only viewset method per user and
+    query, and answer If-None-Match with 304 while nothing has changed.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        cache = get_cache()
+        key, etag = response_cache_key(request, view_method.__name__, get_generation(cache))
+
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            CACHE_REQUESTS.inc(view=view_method.__name__, result='not_modified')
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = cache.get(key)
+        CACHE_REQUESTS.inc(view=view_method.__name__, result='miss' if data is None else 'hit')
+        if data is None:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, getattr(settings, 'EXPENSE_RESPONSE_CACHE_TIMEOUT', 300))
+        else:
+            response = Response(data)
+
+        response['ETag'] = etag
+        return response
+
+    return wrapper
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Cache backends whose entries only exist in the process that wrote them
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(deploy=True)
+def check_response_cache(app_configs, **kwargs):
+    """
+    The response cache generation and the FX rates generation are bumped
+    in EXPENSE_RESPONSE_CACHE_ALIAS; with a per-process backend a write
+    handled by one worker leaves the other workers serving stale responses.
+    """
+    alias = getattr(settings, 'EXPENSE_RESPONSE_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Warning(
+            f"The expense response cache '{alias}' uses {backend}, which is not shared between processes.",
+            hint='Use a shared backend (Redis, Memcached or the database cache) when running more than one process.',
+            id='expenses.W001',
+        )]
+    return []
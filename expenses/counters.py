@@ -0,0 +1,58 @@
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from .models import STATE_FIELDS
+
+CENTS = Decimal('0.01')
+
+
+def expense_state(expense):
+    """
+    Return the fields of an expense that the monthly rollups and trip
+    counters depend on, in STATE_FIELDS order.
+    """
+    return tuple(getattr(expense, field) for field in STATE_FIELDS)
+
+
+def add_to_counter(model, lookup, **deltas):
+    """
+    Add deltas to the fields of the `model` row matching lookup with one
+    UPDATE of F() expressions, creating the row with the deltas as its
+    values if there is none. Returns a queryset of the row.
+    """
+    rows = model.objects.filter(**lookup)
+    increments = {field: F(field) + delta for field, delta in deltas.items()}
+    if not rows.update(**increments):
+        try:
+            with transaction.atomic():
+                model.objects.create(**lookup, **deltas)
+        except IntegrityError:
+            # Created concurrently, fall back to updating it
+            rows.update(**increments)
+    return rows
+
+
+def aggregate_counters(queryset, *fields):
+    """
+    Group an expense queryset by `fields` in one query and return
+    {(field values): (count, total amount)}.
+    """
+    rows = queryset.order_by().values_list(*fields).annotate(count=Count('id'), total_amount=Sum('amount'))
+    return {row[:-2]: (row[-2], Decimal(str(row[-1]))) for row in rows}
+
+
+def compare_counters(expected, actual):
+    """
+    Compare two {key: (count, total)} maps, the values recomputed from raw
+    expenses and the stored ones, and return a list of (key, expected,
+    actual) mismatches.
+    """
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        expected_value = expected.get(key)
+        actual_value = actual.get(key)
+        # SQLite sums decimals as floats, compare at the fields' precision
+        if expected_value is None or actual_value is None or expected_value[0] != actual_value[0] or \
+                Decimal(expected_value[1]).quantize(CENTS) != Decimal(actual_value[1]).quantize(CENTS):
+            mismatches.append((key, expected_value, actual_value))
+    return mismatches
@@ -0,0 +1,184 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.core.mail import get_connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Messages sent over one SMTP connection
+EMAIL_BATCH_SIZE = 50
+# Batches sent concurrently
+EMAIL_MAX_WORKERS = 4
+# Attempts per message after the first one fails
+EMAIL_MAX_RETRIES = 3
+# Seconds to wait before the first retry, doubled for each further retry
+EMAIL_RETRY_BACKOFF = 0.5
+
+
+class BatchResult:
+    """
+    Outcome of sending one batch of messages over a single connection.
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.sent = []
+        self.failed = []
+
+    def __repr__(self):
+        return f'<BatchResult sent={len(self.sent)} failed={len(self.failed)}>'
+
+
+class EmailDispatcher:
+    """
+    Send email messages in batches over a bounded thread pool.
+
+    Each batch opens one connection from get_connection() and reuses it for
+    every message in the batch. A message that fails is retried with
+    exponential backoff on a fresh connection before being reported as
+    failed, without failing the rest of the batch.
+    """
+
+    def __init__(self, batch_size=EMAIL_BATCH_SIZE, max_workers=EMAIL_MAX_WORKERS,
+                 max_retries=EMAIL_MAX_RETRIES, backoff=EMAIL_RETRY_BACKOFF,
+                 connection_factory=get_connection):
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.connection_factory = connection_factory
+
+    def send_batch(self, messages):
+        """
+        Send a batch of messages over one connection and return a BatchResult.
+        If the connection cannot be opened, every message of the batch is
+        reported as failed rather than failing the caller.
+        """
+        result = BatchResult(messages)
+        connection = self.connection_factory()
+        error = self._open_with_retry(connection)
+        if error is not None:
+            result.failed = [(message, error) for message in messages]
+            return result
+        try:
+            for message in messages:
+                error = self._send_with_retry(connection, message)
+                if error is None:
+                    result.sent.append(message)
+                else:
+                    result.failed.append((message, error))
+        finally:
+            connection.close()
+        return result
+
+    def _open_with_retry(self, connection):
+        """
+        Open a connection, retrying with backoff. Returns None on success or
+        the last error message.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                connection.open()
+                return None
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"Opening an email connection failed (attempt {attempt + 1}): {error}")
+        connection.close()
+        return error
+
+    def _send_with_retry(self, connection, message):
+        """
+        Send one message, retrying with backoff. Returns None on success or
+        the last error message.
+        """
+        if not message.recipients():
+            return 'Message has no recipients'
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+                # The connection may be broken after a failure, start over
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as e:
+                    error = str(e)
+                    continue
+            try:
+                if connection.send_messages([message]):
+                    return None
+                error = 'Message was not accepted'
+            except Exception as e:
+                error = str(e)
+            logger.warning(f"Sending email to {', '.join(message.recipients())} failed (attempt {attempt + 1}): {error}")
+        return error
+
+    def iter_batches(self, messages):
+        """
+        Group an iterable of messages into lists of batch_size.
+        """
+        batch = []
+        for message in messages:
+            batch.append(message)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def iter_dispatch(self, messages):
+        """
+        Send messages and yield a BatchResult per batch in submission order.
+
+        The message iterable is consumed lazily and at most two batches per
+        worker are in flight, so memory stays bounded however many messages
+        are produced. If a batch or the message iterable raises, the
+        batches already in flight still send their messages: their results
+        are yielded before the error is raised, so callers can record them.
+        Batches not started yet when the caller stops iterating are cancelled.
+        """
+        max_in_flight = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = deque()
+            try:
+                for batch in self.iter_batches(messages):
+                    in_flight.append(executor.submit(self.send_batch, batch))
+                    if len(in_flight) >= max_in_flight:
+                        yield in_flight.popleft().result()
+                while in_flight:
+                    yield in_flight.popleft().result()
+            except Exception:
+                while in_flight:
+                    future = in_flight.popleft()
+                    if future.exception() is None:
+                        yield future.result()
+                raise
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def dispatch(self, messages):
+        """
+        Send all messages and return a success/failure summary.
+        """
+        started = time.monotonic()
+        summary = {'batches': 0, 'sent': 0, 'failed': 0, 'failures': []}
+
+        for result in self.iter_dispatch(messages):
+            summary['batches'] += 1
+            summary['sent'] += len(result.sent)
+            summary['failed'] += len(result.failed)
+            for message, error in result.failed:
+                summary['failures'].append({'recipients': message.recipients(), 'error': error})
+
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        logger.info(
+            f"Email dispatch completed: {summary['sent']} sent, {summary['failed']} failed "
+            f"in {summary['batches']} batches ({summary['elapsed_seconds']}s)"
+        )
+        return summary
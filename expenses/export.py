@@ -0,0 +1,91 @@
+import csv
+import json
+
+# Columns exported for each expense, in order
+EXPORT_FIELDS = ('id', 'user_id', 'category', 'description', 'amount', 'currency', 'created_at', 'updated_at')
+EXPORT_HEADER = ('id', 'user', 'category', 'description', 'amount', 'currency', 'created_at', 'updated_at')
+
+# Rows fetched per database round-trip and rows joined into one response chunk
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_ROWS_PER_WRITE = 500
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+class Echo:
+    """
+    File-like object whose write() returns the value instead of storing it,
+    so csv.writer can be used to format rows for a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _format_datetime(value):
+    # Same representation as the API's DateTimeField output
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _batched(lines):
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= EXPORT_ROWS_PER_WRITE:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def iter_csv(rows):
+    """
+    Yield CSV text for values_list rows, starting with the header.
+    """
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow(EXPORT_HEADER)
+        for expense_id, user_id, category, description, amount, currency, created_at, updated_at in rows:
+            yield writer.writerow([
+                expense_id, user_id, category, description, str(amount), currency,
+                _format_datetime(created_at), _format_datetime(updated_at),
+            ])
+
+    return _batched(lines())
+
+
+def iter_jsonl(rows):
+    """
+    Yield one JSON object per line for values_list rows.
+    """
+    def lines():
+        for expense_id, user_id, category, description, amount, currency, created_at, updated_at in rows:
+            yield json.dumps({
+                'id': expense_id,
+                'user': user_id,
+                'category': category,
+                'description': description,
+                'amount': str(amount),
+                'currency': currency,
+                'created_at': _format_datetime(created_at),
+                'updated_at': _format_datetime(updated_at),
+            }, ensure_ascii=False) + '\n'
+
+    return _batched(lines())
+
+
+def iter_export(queryset, export_format):
+    """
+    Stream a queryset as CSV or JSONL without instantiating models.
+    """
+    rows = queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if export_format == 'jsonl':
+        return iter_jsonl(rows)
+    return iter_csv(rows)
@@ -0,0 +1,366 @@
+import csv
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DateField, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from .cache import get_cache
+from .models import FxRate
+
+CURRENCY_CODE = re.compile(r'^[A-Z]{3}$')
+
+ONE_DAY = timedelta(days=1)
+
+# Rates upserted per INSERT statement by load_rates
+LOAD_BATCH_SIZE = 1000
+
+# Bumped in the response cache backend whenever rates are loaded; every
+# process clears its rate cache when it sees a new value
+RATES_GENERATION_KEY = 'expenses:fx-generation'
+
+
+class MissingRateError(LookupError):
+    """
+    No FX rate is loaded for a currency on a date, nor in the
+    FX_RATE_MAX_AGE_DAYS before it.
+    """
+
+
+def is_currency_code(value):
+    return isinstance(value, str) and CURRENCY_CODE.match(value) is not None
+
+
+class RateCache:
+    """
+    Thread-safe in-memory LRU cache of FX rates keyed by (currency, date).
+
+    Every date resolves to the rate published on it or, failing that, to
+    the latest rate at most FX_RATE_MAX_AGE_DAYS older. preload() fills
+    the cache for many currencies and dates with a single query, so
+    converting grouped totals or the rows of a report run costs one query
+    however many rows there are. Entries expire after `timeout` seconds,
+    which bounds how long a process keeps using rates that were reloaded
+    by another one when the rates generation cannot reach it.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # RATES_GENERATION_KEY value the entries were loaded under
+        self.generation = None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def cached(self, currency, day):
+        """
+        Return the cached rate, or None if missing or expired.
+        """
+        key = (currency, day)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            rate, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return rate
+
+    def store(self, items):
+        expires_at = time.monotonic() + self.timeout
+        with self.lock:
+            for key, rate in items:
+                self.entries[key] = (rate, expires_at)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def preload(self, start, end, currencies=None):
+        """
+        Cache the rate of every date from start to end inclusive for the
+        given currencies, or all loaded currencies, with one query.
+        """
+        if currencies is not None:
+            currencies = set(currencies) - {settings.FX_RATE_BASE_CURRENCY}
+            if not currencies:
+                return
+        max_age = timedelta(days=settings.FX_RATE_MAX_AGE_DAYS)
+        rates = FxRate.objects.filter(date__gte=start - max_age, date__lte=end)
+        if currencies is not None:
+            rates = rates.filter(currency__in=currencies)
+
+        published = defaultdict(list)
+        for currency, day, rate in rates.order_by('currency', 'date').values_list('currency', 'date', 'rate'):
+            published[currency].append((day, rate))
+
+        items = []
+        for currency, currency_rates in published.items():
+            index = 0
+            latest = None
+            day = start
+            while day <= end:
+                while index < len(currency_rates) and currency_rates[index][0] <= day:
+                    latest = currency_rates[index]
+                    index += 1
+                if latest is not None and day - latest[0] <= max_age:
+                    items.append(((currency, day), latest[1]))
+                day += ONE_DAY
+        self.store(items)
+
+    def preload_pairs(self, pairs):
+        """
+        Cache the rates of (currency, date) pairs that are not cached yet,
+        with at most one query.
+        """
+        missing = {
+            (currency, day) for currency, day in pairs
+            if currency != settings.FX_RATE_BASE_CURRENCY and self.cached(currency, day) is None
+        }
+        if missing:
+            days = [day for _, day in missing]
+            self.preload(min(days), max(days), {currency for currency, _ in missing})
+
+    def get_rate(self, currency, day):
+        """
+        Return the units of `currency` one FX_RATE_BASE_CURRENCY buys on `day`.
+        """
+        if currency == settings.FX_RATE_BASE_CURRENCY:
+            return Decimal('1')
+        rate = self.cached(currency, day)
+        if rate is None:
+            self.preload(day, day, [currency])
+            rate = self.cached(currency, day)
+        if rate is None:
+            raise MissingRateError(
+                f'No FX rate for {currency} on {day} or in the {settings.FX_RATE_MAX_AGE_DAYS} days before.'
+            )
+        return rate
+
+    def convert(self, amount, from_currency, to_currency, day):
+        """
+        Convert an amount between currencies at the rates of `day`, unrounded.
+        """
+        if from_currency == to_currency:
+            return amount
+        return Decimal(amount) * self.get_rate(to_currency, day) / self.get_rate(from_currency, day)
+
+
+_rate_cache = None
+
+
+def get_rate_cache():
+    """
+    Return the process-wide rate cache, cleared first if rates were
+    loaded since it was filled.
+    """
+    global _rate_cache
+    if _rate_cache is None:
+        _rate_cache = RateCache(settings.FX_RATE_CACHE_SIZE, settings.FX_RATE_CACHE_TIMEOUT)
+    generation = get_cache().get(RATES_GENERATION_KEY)
+    if generation != _rate_cache.generation:
+        _rate_cache.clear()
+        _rate_cache.generation = generation
+    return _rate_cache
+
+
+def bump_rates_generation():
+    """
+    Make every process that shares the response cache backend drop the
+    rates it cached. With a per-process backend such as locmem only this
+    process is reached; the others keep their rates for up to
+    FX_RATE_CACHE_TIMEOUT seconds.
+    """
+    cache = get_cache()
+    try:
+        cache.incr(RATES_GENERATION_KEY)
+    except ValueError:
+        cache.add(RATES_GENERATION_KEY, 1, timeout=None)
+
+
+def group_for_conversion(queryset, fields, currency, **aggregates):
+    """
+    Group an expense queryset by `fields` for conversion into `currency`,
+    a currency code or an expression such as F('user__base_currency'),
+    and annotate each group with `aggregates`.
+
+    Expenses already in the target currency form one group per value of
+    `fields`; the others are also split by currency and local date, so
+    that every group converts at a single rate. Rows carry 'currency',
+    'target_currency' and 'rate_date' (None when no conversion is needed).
+    """
+    target = Value(currency) if isinstance(currency, str) else currency
+    return (
+        queryset.order_by()
+        .annotate(target_currency=target)
+        .annotate(rate_date=Case(
+            When(currency=F('target_currency'), then=Value(None)),
+            default=TruncDate('created_at'),
+            output_field=DateField(),
+        ))
+        .values(*fields, 'currency', 'target_currency', 'rate_date')
+        .annotate(**aggregates)
+    )
+
+
+def convert_rows(rows, amount_fields=('total_amount',), rates=None):
+    """
+    Evaluate rows of group_for_conversion() and convert their amount
+    fields into the target currency in place, loading all the rates they
+    need with at most one query. Returns the rows as a list.
+    """
+    rows = list(rows)
+    rates = rates or get_rate_cache()
+    pairs = set()
+    for row in rows:
+        if row['rate_date'] is not None:
+            pairs.add((row['currency'], row['rate_date']))
+            pairs.add((row['target_currency'], row['rate_date']))
+    rates.preload_pairs(pairs)
+
+    for row in rows:
+        for field in amount_fields:
+            if row[field] is None:
+                continue
+            # SQLite returns sums of decimals as floats
+            amount = Decimal(str(row[field]))
+            if row['rate_date'] is not None:
+                amount = rates.convert(amount, row['currency'], row['target_currency'], row['rate_date'])
+            row[field] = amount
+    return rows
+
+
+def sum_converted(queryset, fields, currency, rates=None):
+    """
+    Count, total, minimum and maximum amount of an expense queryset per
+    value of `fields`, converted into `currency`, a currency code or an
+    expression such as F('user__base_currency').
+
+    The first query groups by `fields` only, aggregating the expenses
+    already in the target currency and counting the others, so when no
+    conversion is needed it costs what a plain aggregate does. Only if
+    other currencies are present, a second query groups those by
+    currency and date (see group_for_conversion) and they are converted
+    with cached rates; no rate is ever looked up per expense. Returns
+    {key tuple: totals}, where the amounts are unrounded Decimals.
+    """
+    target = Value(currency) if isinstance(currency, str) else currency
+    same = Q(currency=F('target_currency'))
+    rows = list(
+        queryset.order_by().annotate(target_currency=target).values(*fields, 'target_currency').annotate(
+            count=Count('id', filter=same),
+            total_amount=Sum('amount', filter=same),
+            min_amount=Min('amount', filter=same),
+            max_amount=Max('amount', filter=same),
+            foreign_count=Count('id', filter=~same),
+        )
+    )
+    if any(row['foreign_count'] for row in rows):
+        rows.extend(convert_rows(
+            group_for_conversion(
+                queryset.exclude(currency=target), fields, currency,
+                count=Count('id'), total_amount=Sum('amount'), min_amount=Min('amount'), max_amount=Max('amount'),
+            ),
+            ('total_amount', 'min_amount', 'max_amount'),
+            rates,
+        ))
+
+    totals = {}
+    for row in rows:
+        if not row['count']:
+            continue
+        key = tuple(row[field] for field in fields)
+        amounts = [Decimal(str(row[field])) for field in ('total_amount', 'min_amount', 'max_amount')]
+        total = totals.get(key)
+        if total is None:
+            totals[key] = {
+                'currency': row['target_currency'],
+                'count': row['count'],
+                'total_amount': amounts[0],
+                'min_amount': amounts[1],
+                'max_amount': amounts[2],
+            }
+            continue
+        total['count'] += row['count']
+        total['total_amount'] += amounts[0]
+        total['min_amount'] = min(total['min_amount'], amounts[1])
+        total['max_amount'] = max(total['max_amount'], amounts[2])
+    return totals
+
+
+def parse_rate(record, position):
+    """
+    Validate one {'date', 'currency', 'rate'} record from a rate file and
+    return an unsaved FxRate. Raises ValueError naming the position.
+    """
+    try:
+        currency = str(record['currency']).strip().upper()
+        day = date.fromisoformat(str(record['date']).strip())
+        rate = Decimal(str(record['rate']).strip())
+    except (KeyError, TypeError, ValueError, InvalidOperation) as exc:
+        raise ValueError(f'{position}: expected date (YYYY-MM-DD), currency and rate ({exc!r})')
+    if not is_currency_code(currency):
+        raise ValueError(f'{position}: {currency!r} is not a three-letter currency code')
+    if not rate.is_finite() or rate <= 0:
+        raise ValueError(f'{position}: rate must be a positive number')
+    return FxRate(currency=currency, date=day, rate=rate)
+
+
+def read_rate_file(path):
+    """
+    Yield FxRate instances from a local CSV file with date, currency and
+    rate columns, or a JSON file holding a list of objects with those keys.
+    """
+    if os.path.splitext(path)[1].lower() == '.json':
+        with open(path, encoding='utf-8') as rate_file:
+            records = json.load(rate_file)
+        if not isinstance(records, list):
+            raise ValueError(f'{path}: expected a JSON list of rates')
+        for index, record in enumerate(records):
+            yield parse_rate(record if isinstance(record, dict) else {}, f'{path} item {index}')
+        return
+
+    with open(path, newline='', encoding='utf-8') as rate_file:
+        # Line 1 is the header
+        for line, record in enumerate(csv.DictReader(rate_file), start=2):
+            yield parse_rate(record, f'{path} line {line}')
+
+
+@transaction.atomic
+def load_rates(rates, batch_size=LOAD_BATCH_SIZE):
+    """
+    Insert or update FxRate instances by (currency, date) in batches and,
+    once committed, bump the rates generation so rate caches are cleared.
+    Returns the number of rates written.
+    """
+    count = 0
+    batch = []
+    for rate in rates:
+        batch.append(rate)
+        if len(batch) >= batch_size:
+            count += _upsert_rates(batch)
+            batch = []
+    if batch:
+        count += _upsert_rates(batch)
+    transaction.on_commit(bump_rates_generation)
+    return count
+
+
+def _upsert_rates(batch):
+    # Later rows of a file win over earlier ones for the same day
+    batch = list({(rate.currency, rate.date): rate for rate in batch}.values())
+    FxRate.objects.bulk_create(
+        batch, update_conflicts=True, unique_fields=['currency', 'date'], update_fields=['rate'],
+    )
+    return len(batch)
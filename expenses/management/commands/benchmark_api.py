@@ -0,0 +1,265 @@
+import json
+import platform
+import random
+import statistics
+import subprocess
+from datetime import timedelta
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from travel_expense_management.instrumentation import QueryStats
+from users.models import CustomUser
+from reports.models import WeeklyReport
+from expenses.cache import bump_generation
+from expenses.models import Expense, MonthlyReportRun
+from expenses.serializers import CATEGORY_CHOICES
+from expenses.tasks import generate_monthly_expense_report
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def git_revision():
+    """
+    Return (commit, dirty) of the working tree, or (None, None) outside git.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status)
+
+
+def summarize(latencies, queries, elapsed):
+    """
+    Latency percentiles (ms), throughput and queries per call for one scenario.
+    """
+    cut_points = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    result = {
+        'iterations': len(latencies),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'min_ms': round(min(latencies) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+    }
+    for percentile in PERCENTILES:
+        result[f'p{percentile}_ms'] = round(cut_points[percentile - 1] * 1000, 3)
+    result['throughput_per_second'] = round(len(latencies) / elapsed, 2) if elapsed else None
+    result['queries_per_call'] = round(statistics.fmean(queries), 2)
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles and throughput of the main API paths and "
+        "the monthly report job against the current data (see seed_expenses), "
+        "and print the results as JSON. All changes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Measured calls per API scenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured calls before each scenario')
+        parser.add_argument('--report-iterations', type=int, default=3, help='Runs of the monthly report job')
+        parser.add_argument('--scenarios', default='', help='Comma-separated scenario name prefixes to run')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Let list responses come from the response cache instead of invalidating it per call')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--compare', help='Print p50/p95 changes against a previous JSON result')
+        parser.add_argument('--seed', type=int, default=0)
+
+    # Scenarios. Each returns the response of one call; fixtures are built
+    # once in setup_fixtures.
+
+    def scenarios(self):
+        return [
+            ('expenses.list', self.expense_list, {}),
+            ('expenses.list_filtered', self.expense_list, {'category': 'food', 'start_date': self.month_ago}),
+            ('expenses.list_search', self.expense_list, {'search': 'airport'}),
+            ('expenses.list_ordering', self.expense_list, {'ordering': '-amount'}),
+            ('expenses.list_totals', self.expense_list, {'include_total': 'true', 'breakdown': 'category,month'}),
+            ('expenses.list_next_page', self.expense_next_page, None),
+            ('expenses.create', self.expense_create, None),
+            ('expenses.update', self.expense_update, None),
+            ('reports.list', self.report_list, None),
+            ('reports.create', self.report_create, None),
+            ('reports.retrieve', self.report_retrieve, None),
+            ('reports.update', self.report_update, None),
+            ('reports.submit', self.report_submit, None),
+            ('reports.delete', self.report_delete, None),
+        ]
+
+    def expense_list(self, params):
+        if not self.warm_cache:
+            bump_generation()
+        return self.client.get('/expenses/', params), 200
+
+    def expense_next_page(self, params):
+        if not self.warm_cache:
+            bump_generation()
+        return self.client.get(self.next_page_url), 200
+
+    def expense_create(self, params):
+        return self.client.post('/expenses/', {
+            'user': self.user.id,
+            'category': self.rng.choice(self.categories),
+            'description': 'Benchmark taxi to airport',
+            'amount': f'{self.rng.uniform(5, 300):.2f}',
+        }, format='json'), 201
+
+    def expense_update(self, params):
+        expense_id = self.rng.choice(self.expense_ids)
+        return self.client.put(f'/expenses/{expense_id}/', {
+            'user': self.user.id,
+            'category': self.rng.choice(self.categories),
+            'description': 'Benchmark update',
+            'amount': f'{self.rng.uniform(5, 300):.2f}',
+        }, format='json'), 200
+
+    def report_list(self, params):
+        return self.client.get('/reports/'), 200
+
+    def next_week(self):
+        self.week_start -= timedelta(days=7)
+        return {'week_start': self.week_start.isoformat(), 'week_end': (self.week_start + timedelta(days=6)).isoformat()}
+
+    def report_create(self, params):
+        return self.client.post('/reports/', {**self.next_week(), 'status': 'draft'}, format='json'), 201
+
+    def report_retrieve(self, params):
+        return self.client.get(f'/reports/{self.rng.choice(self.report_ids)}/'), 200
+
+    def report_update(self, params):
+        report_id = self.rng.choice(self.report_ids)
+        return self.client.patch(f'/reports/{report_id}/', {'comments': 'Benchmark comment'}, format='json'), 200
+
+    def report_submit(self, params):
+        return self.client.patch(f'/reports/{self.draft_ids.pop()}/', {'status': 'submitted'}, format='json'), 200
+
+    def report_delete(self, params):
+        return self.client.delete(f'/reports/{self.deletable_ids.pop()}/'), 204
+
+    def setup_fixtures(self, calls):
+        self.user = CustomUser.objects.filter(expenses__isnull=False).order_by('id').first()
+        if self.user is None:
+            raise CommandError('No expenses to benchmark against, run seed_expenses first')
+        hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+        self.client = APIClient(HTTP_HOST=hosts[0] if hosts else 'localhost')
+        self.client.force_authenticate(self.user)
+        self.categories = [choice for choice, _ in CATEGORY_CHOICES]
+        self.month_ago = (timezone.now() - timedelta(days=30)).date().isoformat()
+        self.expense_ids = list(Expense.objects.order_by('-id').values_list('id', flat=True)[:1000])
+
+        first_page = self.client.get('/expenses/').json()
+        self.next_page_url = first_page['next'] or '/expenses/'
+
+        # Reports live in weeks far in the past so they never overlap
+        self.week_start = (timezone.now() - timedelta(days=3650)).date()
+        reports = WeeklyReport.objects.bulk_create([
+            WeeklyReport(user=self.user, status='draft', **self.next_week()) for _ in range(calls * 3 + 10)
+        ])
+        ids = [report.id for report in reports]
+        self.report_ids = ids[:10]
+        self.draft_ids = ids[10:10 + calls]
+        self.deletable_ids = ids[10 + calls:]
+
+    def run_scenario(self, func, params, iterations, warmup):
+        latencies = []
+        queries = []
+        for index in range(warmup + iterations):
+            with QueryStats() as stats:
+                response, expected_status = func(params)
+            if response.status_code != expected_status:
+                raise CommandError(f'{func.__name__} returned {response.status_code}: {response.content[:500]!r}')
+            if index >= warmup:
+                latencies.append(stats.elapsed)
+                queries.append(stats.queries)
+        return summarize(latencies, queries, sum(latencies))
+
+    def run_monthly_report(self, iterations):
+        today = timezone.now()
+        latencies = []
+        queries = []
+        rows = []
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            for _ in range(iterations):
+                MonthlyReportRun.objects.all().delete()
+                with QueryStats() as stats:
+                    result = generate_monthly_expense_report(today=today)
+                latencies.append(stats.elapsed)
+                queries.append(stats.queries)
+                rows.append(result['rows'])
+        summary = summarize(latencies, queries, sum(latencies))
+        summary['rows'] = rows[-1]
+        summary['rows_per_second'] = round(sum(rows) / sum(latencies), 1) if sum(latencies) else None
+        return summary
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.warm_cache = options['warm_cache']
+        iterations = options['iterations']
+        prefixes = [prefix.strip() for prefix in options['scenarios'].split(',') if prefix.strip()]
+        if iterations < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        def selected(name):
+            return not prefixes or any(name.startswith(prefix) for prefix in prefixes)
+
+        commit, dirty = git_revision()
+        results = {
+            'git_commit': commit,
+            'git_dirty': dirty,
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'options': {key: options[key] for key in ('iterations', 'warmup', 'report_iterations', 'warm_cache', 'seed')},
+            'data': {
+                'users': CustomUser.objects.count(),
+                'expenses': Expense.objects.count(),
+            },
+            'scenarios': {},
+        }
+
+        with transaction.atomic():
+            self.setup_fixtures(options['warmup'] + iterations)
+            for name, func, params in self.scenarios():
+                if selected(name):
+                    self.stderr.write(f'Running {name}')
+                    results['scenarios'][name] = self.run_scenario(func, params, iterations, options['warmup'])
+            if selected('reports.monthly') and options['report_iterations'] > 0:
+                self.stderr.write('Running reports.monthly')
+                results['scenarios']['reports.monthly'] = self.run_monthly_report(options['report_iterations'])
+            transaction.set_rollback(True)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(results, options['compare'])
+
+    def compare(self, results, path):
+        with open(path) as handle:
+            baseline = json.load(handle)
+        self.stderr.write(f"Compared with {baseline.get('git_commit') or path}:")
+        for name, current in results['scenarios'].items():
+            previous = baseline.get('scenarios', {}).get(name)
+            if not previous:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms'):
+                if previous.get(key):
+                    changes.append(f'{key} {previous[key]} -> {current[key]} ({(current[key] / previous[key] - 1) * 100:+.1f}%)')
+            self.stderr.write(f"  {name}: {', '.join(changes)}")
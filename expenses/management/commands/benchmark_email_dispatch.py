@@ -0,0 +1,111 @@
+import socketserver
+import threading
+import time
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from expenses.dispatch import EmailDispatcher
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal SMTP server that accepts and discards every message, sleeping
+    `latency` seconds before each reply to simulate a network round-trip.
+    """
+
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost debugging SMTP server')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.strip().split(b' ', 1)[0].upper()
+            if command == b'EHLO':
+                self.reply('250 localhost')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.received += 1
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), DebuggingSMTPHandler)
+        self.latency = latency
+        self.received = 0
+
+
+class Command(BaseCommand):
+    help = "Compare serial email.send() against batched EmailDispatcher throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--latency-ms', type=float, default=2.0, help='Simulated delay per SMTP reply')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--host', help='Use an existing SMTP server instead of the built-in one')
+        parser.add_argument('--port', type=int, default=25)
+
+    def build_messages(self, count):
+        for index in range(count):
+            email = EmailMessage(
+                'Expense Report',
+                'Please find attached your expense report.',
+                'expenses@yourcompany.com',
+                [f'user{index}@example.com'],
+            )
+            email.attach('expense_report.csv', 'Category,Description,Amount,Date\n', 'text/csv')
+            yield email
+
+    def handle(self, *args, **options):
+        server = None
+        host, port = options['host'], options['port']
+        if not host:
+            server = DebuggingSMTPServer(options['latency_ms'] / 1000)
+            host, port = server.server_address
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def connection_factory():
+            return get_connection('django.core.mail.backends.smtp.EmailBackend', host=host, port=port)
+
+        count = options['messages']
+        try:
+            started = time.monotonic()
+            for email in self.build_messages(count):
+                # One connection per message, as email.send() does
+                email.connection = connection_factory()
+                email.send()
+            serial = time.monotonic() - started
+
+            dispatcher = EmailDispatcher(
+                batch_size=options['batch_size'],
+                max_workers=options['workers'],
+                connection_factory=connection_factory,
+            )
+            summary = dispatcher.dispatch(self.build_messages(count))
+            batched = summary['elapsed_seconds']
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write(f'serial:  {count} messages in {serial:.3f}s ({count / serial:.1f} msg/s)')
+        self.stdout.write(
+            f"batched: {summary['sent']} messages in {batched:.3f}s ({summary['sent'] / batched:.1f} msg/s), "
+            f"{summary['failed']} failed, batch size {options['batch_size']}, {options['workers']} workers"
+        )
+        self.stdout.write(f'speedup: {serial / batched:.1f}x')
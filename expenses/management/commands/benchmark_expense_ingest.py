@@ -0,0 +1,67 @@
+import json
+import random
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.test import APIClient
+from users.models import CustomUser
+from expenses.serializers import CATEGORY_CHOICES
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/sec of POST /expenses/ one row at a time against "
+        "POST /expenses/bulk/. All rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def build_rows(self, count, user_id):
+        categories = [choice for choice, _ in CATEGORY_CHOICES]
+        return [
+            {
+                'user': user_id,
+                'category': random.choice(categories),
+                'description': f'Card transaction {index}',
+                'amount': f'{random.uniform(1, 500):.2f}',
+            }
+            for index in range(count)
+        ]
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+        client = APIClient(HTTP_HOST=hosts[0] if hosts else 'localhost')
+
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(
+                username='benchmark-ingest', email='benchmark@example.com', employee_id='BENCH-INGEST'
+            )
+            rows = self.build_rows(count, user.id)
+
+            started = time.monotonic()
+            for row in rows:
+                response = client.post('/expenses/', row, format='json')
+                if response.status_code != 201:
+                    raise CommandError(f'POST /expenses/ returned {response.status_code}: {response.content[:500]!r}')
+            single = time.monotonic() - started
+
+            body = '\n'.join(json.dumps(row) for row in rows)
+            started = time.monotonic()
+            response = client.post(
+                f"/expenses/bulk/?batch_size={options['batch_size']}",
+                body,
+                content_type='application/x-ndjson',
+            )
+            bulk = time.monotonic() - started
+            if response.status_code != 201:
+                raise CommandError(f'POST /expenses/bulk/ returned {response.status_code}: {response.content[:500]!r}')
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'single: {count} rows in {single:.3f}s ({count / single:.0f} rows/s)')
+        self.stdout.write(f'bulk:   {count} rows in {bulk:.3f}s ({count / bulk:.0f} rows/s)')
+        self.stdout.write(f'speedup: {single / bulk:.1f}x')
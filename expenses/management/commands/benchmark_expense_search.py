@@ -0,0 +1,82 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework import filters
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from users.models import CustomUser
+from expenses.models import Expense
+from expenses.search import ExpenseSearchFilter
+from expenses.serializers import CATEGORY_CHOICES, EXPENSE_LIST_FIELDS
+from expenses.views import ExpenseViewSet
+
+WORDS = (
+    'taxi hotel lunch dinner airport train flight conference client meeting '
+    'coffee parking fuel rental snacks breakfast visa luggage toll ferry'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ?search= through the full-text index against the LIKE based "
+        "SearchFilter on the first list page. All rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--terms', default='airport,ref12345,hotel visa,ab',
+                            help='Comma-separated searches to run')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def first_page(self, backend, term):
+        request = Request(APIRequestFactory().get('/expenses/', {'search': term}))
+        view = ExpenseViewSet(request=request, format_kwarg=None, action='list')
+        queryset = Expense.objects.order_by('-created_at', '-id')
+        queryset = backend.filter_queryset(request, queryset, view)
+        return queryset, list(queryset.values(*EXPENSE_LIST_FIELDS, *queryset.query.annotations)[:50])
+
+    def time_best(self, backend, term, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset, _ = self.first_page(backend, term)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, queryset
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        categories = [choice for choice, _ in CATEGORY_CHOICES]
+
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(
+                username='benchmark-search', email='benchmark@example.com', employee_id='BENCH-SEARCH'
+            )
+            started = time.monotonic()
+            Expense.objects.bulk_create(
+                [
+                    Expense(
+                        user=user,
+                        category=random.choice(categories),
+                        description=' '.join(random.sample(WORDS, 4)) + f' ref{index}',
+                        amount=random.randint(100, 50000) / 100,
+                    )
+                    for index in range(count)
+                ],
+                batch_size=1000,
+            )
+            self.stdout.write(f'Inserted {count} rows (index kept in sync) in {time.monotonic() - started:.1f}s')
+
+            for term in options['terms'].split(','):
+                like, like_queryset = self.time_best(filters.SearchFilter(), term, options['repeat'])
+                indexed, indexed_queryset = self.time_best(ExpenseSearchFilter(), term, options['repeat'])
+                matches = like_queryset.count()
+                if set(like_queryset.values_list('id', flat=True)) != set(indexed_queryset.values_list('id', flat=True)):
+                    self.stdout.write(self.style.WARNING(f'{term!r}: LIKE and the index disagree'))
+                self.stdout.write(
+                    f'{term!r} ({matches} matches): LIKE {like * 1000:.1f}ms, '
+                    f'index {indexed * 1000:.1f}ms ({like / indexed:.1f}x)'
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,71 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from expenses.models import Expense
+from expenses.serializers import CATEGORY_CHOICES, ExpenseSerializer, serialize_expense_rows
+
+# Rows serialized per call, so 1M rows never have to be in memory at once
+CHUNK_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ExpenseSerializer(many=True) on model instances against "
+        "serialize_expense_rows on values() rows, using synthetic rows "
+        "(no database access)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Comma-separated row counts to benchmark')
+        parser.add_argument('--no-verify', action='store_true',
+                            help='Skip checking that both outputs are identical')
+
+    def build_rows(self, start, count):
+        categories = [choice for choice, _ in CATEGORY_CHOICES]
+        base = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        rows = []
+        for expense_id in range(start + 1, start + count + 1):
+            created_at = base + timedelta(seconds=expense_id * 37)
+            rows.append({
+                'id': expense_id,
+                'user_id': expense_id % 500 + 1,
+                'category': random.choice(categories),
+                'description': f'Card transaction {expense_id}',
+                'amount': Decimal(random.randint(1, 5000000)) / 100,
+                'created_at': created_at,
+                'updated_at': created_at + timedelta(minutes=5),
+            })
+        return rows
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+
+        for size in sizes:
+            model_seconds = 0.0
+            rows_seconds = 0.0
+            for start in range(0, size, CHUNK_SIZE):
+                rows = self.build_rows(start, min(CHUNK_SIZE, size - start))
+                instances = [Expense(**row) for row in rows]
+
+                started = time.perf_counter()
+                expected = ExpenseSerializer(instances, many=True).data
+                model_seconds += time.perf_counter() - started
+
+                started = time.perf_counter()
+                actual = serialize_expense_rows(rows)
+                rows_seconds += time.perf_counter() - started
+
+                if not options['no_verify'] and [dict(item) for item in expected] != actual:
+                    raise CommandError(f'Outputs differ in rows {start + 1}-{start + len(rows)}')
+
+            self.stdout.write(
+                f'{size} rows: serializer {model_seconds:.3f}s ({model_seconds / size * 1e6:.1f} us/row), '
+                f'rows {rows_seconds:.3f}s ({rows_seconds / size * 1e6:.1f} us/row), '
+                f'speedup {model_seconds / rows_seconds:.1f}x'
+            )
@@ -0,0 +1,101 @@
+import time
+from io import BytesIO
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from travel_expense_management.parsers import FastJSONParser, orjson
+from travel_expense_management.renderers import FastJSONRenderer
+from users.models import CustomUser
+from expenses.models import Expense
+from expenses.pagination import ExpenseKeysetPagination
+from expenses.serializers import CATEGORY_CHOICES
+from expenses.views import ExpenseViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare JSONRenderer/JSONParser against FastJSONRenderer/FastJSONParser "
+        "on GET /expenses/?include_total=true responses of increasing size. "
+        "All rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='50,500,5000,50000',
+                            help='Comma-separated page sizes to benchmark')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def time_best(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+        repeat = options['repeat']
+        self.stdout.write(f"JSON backend: {'orjson ' + orjson.__version__ if orjson else 'json (orjson not installed)'}")
+
+        class BenchmarkPagination(ExpenseKeysetPagination):
+            max_page_size = max(sizes)
+
+        pagination_class = ExpenseViewSet.pagination_class
+        ExpenseViewSet.pagination_class = BenchmarkPagination
+        client = APIClient(HTTP_HOST='localhost')
+        categories = [choice for choice, _ in CATEGORY_CHOICES]
+
+        try:
+            with transaction.atomic():
+                user = CustomUser.objects.create_user(
+                    username='benchmark-json', email='benchmark@example.com', employee_id='BENCH-JSON'
+                )
+                now = timezone.now()
+                Expense.objects.bulk_create(
+                    [
+                        Expense(
+                            user=user,
+                            category=categories[index % len(categories)],
+                            description=f'Card transaction {index} – café',
+                            amount=Decimal(index % 50000 + 1) / 100,
+                            created_at=now - timedelta(minutes=index),
+                        )
+                        for index in range(max(sizes))
+                    ],
+                    batch_size=1000,
+                )
+
+                for size in sizes:
+                    response = client.get(
+                        '/expenses/', {'page_size': size, 'include_total': 'true', 'breakdown': 'category,month'}
+                    )
+                    assert response.status_code == 200, response.content
+                    data = response.data
+
+                    body = JSONRenderer().render(data)
+                    if FastJSONRenderer().render(data) != body:
+                        raise CommandError(f'Rendered output differs at page size {size}')
+
+                    render = self.time_best(lambda: JSONRenderer().render(data), repeat)
+                    fast_render = self.time_best(lambda: FastJSONRenderer().render(data), repeat)
+                    parse = self.time_best(lambda: JSONParser().parse(BytesIO(body)), repeat)
+                    fast_parse = self.time_best(lambda: FastJSONParser().parse(BytesIO(body)), repeat)
+
+                    self.stdout.write(
+                        f'{size} rows ({len(body) / 1024:.0f} KiB): '
+                        f'render {render * 1000:.2f}ms -> {fast_render * 1000:.2f}ms ({render / fast_render:.1f}x), '
+                        f'parse {parse * 1000:.2f}ms -> {fast_parse * 1000:.2f}ms ({parse / fast_parse:.1f}x)'
+                    )
+
+                transaction.set_rollback(True)
+        finally:
+            ExpenseViewSet.pagination_class = pagination_class
@@ -0,0 +1,131 @@
+import re
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from expenses.models import Expense
+from expenses.pagination import ExpenseKeysetPagination
+from expenses.tasks import get_report_period, iter_monthly_expenses
+from expenses.views import ExpenseViewSet
+from users.models import CustomUser
+
+
+class CapturedQueries:
+    """
+    Execute wrapper keeping the SQL and parameters of every SELECT on the
+    expense table, to be explained afterwards exactly as they ran.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT') and Expense._meta.db_table in sql:
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the expense list, summary, timeline and monthly report code "
+        "paths, print the query plan of every expense query they make and "
+        "flag full table scans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=1, help='User id to use for per-user queries')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error if any query does a full table scan')
+
+    def run_view(self, action, params, user):
+        """
+        Run an ExpenseViewSet action for GET /expenses/ with `params`,
+        bypassing the response cache so its queries always reach the
+        database.
+        """
+        request = APIRequestFactory().get('/expenses/', params)
+        if user is not None:
+            force_authenticate(request, user=user)
+        view = ExpenseViewSet(action_map={'get': action}, args=(), kwargs={}, format_kwarg=None)
+        view.request = view.initialize_request(request)
+        return getattr(ExpenseViewSet, action).__wrapped__(view, view.request)
+
+    def get_queries(self, user_id):
+        """
+        Return (name, callable) pairs running the API and task code paths
+        whose queries are explained.
+        """
+        user = CustomUser.objects.filter(pk=user_id).first()
+        now = timezone.now()
+        start_date, end_date = get_report_period(now)
+        date_range = {'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()}
+
+        paginator = ExpenseKeysetPagination()
+        paginator.ordering = ['-created_at', '-id']
+        # A cursor past the newest expense, whatever the data
+        next_page = {'cursor': paginator.encode_cursor([now, 2 ** 31], reverse=False)}
+
+        return [
+            ('list', lambda: self.run_view('list', {}, user)),
+            ('list next page', lambda: self.run_view('list', next_page, user)),
+            ('list date range', lambda: self.run_view('list', date_range, user)),
+            ('list per category and date range', lambda: self.run_view('list', {'category': 'food', **date_range}, user)),
+            ('list search', lambda: self.run_view('list', {'search': 'airport'}, user)),
+            ('summary date range', lambda: self.run_view('summary', {'breakdown': 'category,month', **date_range}, user)),
+            ('timeline per user', lambda: self.run_view('timeline', {
+                'user': str(user_id), 'start_date': (now - timedelta(days=30)).date().isoformat(),
+                'end_date': now.date().isoformat(),
+            }, user)),
+            ('monthly report', lambda: next(iter_monthly_expenses(start_date, end_date), None)),
+        ]
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            rows = cursor.fetchall()
+        return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+    def is_full_scan(self, plan):
+        """
+        Detect sequential scans over the expense table in a query plan.
+        """
+        # The table name alone, not expenses_expense_fts and the like
+        table = re.escape(Expense._meta.db_table) + r'(?!\w)'
+        for line in plan.splitlines():
+            if connection.vendor == 'sqlite':
+                # SQLite prints "SCAN table" for a table scan and
+                # "SCAN table USING [COVERING] INDEX" for an index scan
+                if re.search(f'SCAN {table}', line) and 'USING' not in line:
+                    return True
+            elif connection.vendor == 'postgresql':
+                if re.search(f'Seq Scan on {table}', line):
+                    return True
+        return False
+
+    def handle(self, *args, **options):
+        full_scans = []
+
+        for name, run in self.get_queries(options['user']):
+            captured = CapturedQueries()
+            with connection.execute_wrapper(captured):
+                run()
+
+            for index, (sql, params) in enumerate(captured.queries, 1):
+                label = name if len(captured.queries) == 1 else f'{name} ({index}/{len(captured.queries)})'
+                plan = self.explain(sql, params)
+                self.stdout.write(self.style.MIGRATE_HEADING(f'== {label}'))
+                self.stdout.write(sql)
+                self.stdout.write(plan)
+
+                if self.is_full_scan(plan):
+                    full_scans.append(label)
+                    self.stdout.write(self.style.WARNING('Full table scan'))
+                self.stdout.write('')
+
+        if full_scans:
+            message = f"Full table scans in: {', '.join(full_scans)}"
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No full table scans on expenses'))
@@ -0,0 +1,43 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from expenses.tasks import REPORT_CHUNK_SIZE, generate_monthly_expense_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate and email the monthly expense reports. Resumes an "
+        "interrupted run; start one process per shard to spread the work."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month to report on as YYYY-MM (default: previous month)')
+        parser.add_argument('--shard-index', type=int, default=0)
+        parser.add_argument('--shard-count', type=int, default=1)
+        parser.add_argument('--chunk-size', type=int, default=REPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        shard_index, shard_count = options['shard_index'], options['shard_count']
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise CommandError('--shard-index must be between 0 and --shard-count - 1')
+
+        today = None
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m')
+            except ValueError:
+                raise CommandError('--month must be formatted as YYYY-MM')
+            # The report covers the month before "today"
+            year, month_number = (month.year + 1, 1) if month.month == 12 else (month.year, month.month + 1)
+            today = timezone.make_aware(datetime(year, month_number, 1))
+
+        stats = generate_monthly_expense_report(
+            today=today,
+            chunk_size=options['chunk_size'],
+            shard_index=shard_index,
+            shard_count=shard_count,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['users']} users, {stats['rows']} rows, "
+            f"{stats['emails_sent']} emails sent, {stats['emails_failed']} failed"
+        ))
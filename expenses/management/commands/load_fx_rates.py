@@ -0,0 +1,25 @@
+from itertools import chain
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from expenses.cache import invalidate_on_commit
+from expenses.fx import load_rates, read_rate_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Load FX rates from local CSV (date,currency,rate) or JSON files into the rate table, "
+        "replacing rates already loaded for the same currency and date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='CSV or JSON rate files')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                count = load_rates(chain.from_iterable(read_rate_file(path) for path in options['paths']))
+                # Cached totals were converted with the old rates
+                invalidate_on_commit()
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Loaded {count} FX rates'))
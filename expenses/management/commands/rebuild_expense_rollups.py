@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from expenses.rollups import rebuild_rollups, verify_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly expense rollup table from raw expenses and verify it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true', help='Only compare the table with raw expenses')
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            count = rebuild_rollups()
+            self.stdout.write(f'Rebuilt {count} rollup rows')
+
+        mismatches = verify_rollups()
+        for key, expected, actual in mismatches[:20]:
+            self.stdout.write(self.style.WARNING(f'{key}: expected {expected}, found {actual}'))
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} rollup rows do not match the expenses')
+        self.stdout.write(self.style.SUCCESS('Rollups match the expenses'))
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from expenses.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index over expense descriptions and categories."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        backend = rebuild_search_index(options['database'])
+        if backend is None:
+            raise CommandError('This database has no expense search index, searches use LIKE')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the {backend} expense search index in {time.monotonic() - started:.2f}s'
+        ))
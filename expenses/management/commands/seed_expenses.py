@@ -0,0 +1,144 @@
+import math
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from users.hierarchy import rebuild_hierarchy
+from users.models import CustomUser
+from users.serializers import DEPARTMENT_CHOICES
+from expenses.models import Expense
+from expenses.rollups import rebuild_rollups
+
+# Prefix of seeded usernames and employee ids, so --clear only removes seeded data
+SEED_PREFIX = 'seed'
+
+# Share of expenses, median amount and spread (lognormal sigma) per category
+CATEGORY_PROFILES = {
+    'food': (0.40, 18, 0.6),
+    'transport': (0.30, 35, 0.9),
+    'accommodation': (0.15, 140, 0.5),
+    'misc': (0.15, 25, 1.0),
+}
+
+DESCRIPTIONS = {
+    'food': ['Lunch with client', 'Team dinner', 'Breakfast at hotel', 'Coffee and snacks', 'Airport meal'],
+    'transport': ['Taxi to airport', 'Train ticket', 'Flight change fee', 'Car rental fuel', 'Parking at station', 'Metro card'],
+    'accommodation': ['Hotel night', 'Conference hotel', 'Serviced apartment', 'Late checkout fee'],
+    'misc': ['Visa fee', 'Conference registration', 'Printing', 'Luggage fee', 'Phone roaming'],
+}
+
+# Relative weight of each weekday (Monday first); travel is mostly on workdays
+WEEKDAY_WEIGHTS = (1.0, 1.1, 1.1, 1.0, 0.9, 0.3, 0.2)
+
+INSERT_BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed users (with a manager hierarchy) and expenses with realistic "
+        "category, amount and date distributions for benchmarks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--expenses', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=365, help='Spread expenses over this many past days')
+        parser.add_argument('--team-size', type=int, default=8, help='Users per manager')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded users and their data first')
+
+    def build_users(self, count, team_size, departments):
+        start = CustomUser.objects.filter(username__startswith=f'{SEED_PREFIX}-').count()
+        password = make_password(None)
+        users = [
+            CustomUser(
+                username=f'{SEED_PREFIX}-{start + index}',
+                email=f'{SEED_PREFIX}-{start + index}@example.com',
+                employee_id=f'{SEED_PREFIX.upper()}-{start + index}',
+                department=departments[index % len(departments)],
+                password=password,
+            )
+            for index in range(count)
+        ]
+        users = CustomUser.objects.bulk_create(users, batch_size=INSERT_BATCH_SIZE)
+
+        # Every team_size-th user manages the following ones, and managers
+        # report to the first user
+        manager = None
+        for index, user in enumerate(users):
+            if index % team_size == 0:
+                user.manager = users[0] if index else None
+                manager = user
+            else:
+                user.manager = manager
+        CustomUser.objects.bulk_update(users, ['manager'], batch_size=INSERT_BATCH_SIZE)
+        return users
+
+    def random_created_at(self, rng, now, days):
+        while True:
+            created_at = now - timedelta(days=rng.random() * days)
+            if rng.random() * max(WEEKDAY_WEIGHTS) <= WEEKDAY_WEIGHTS[created_at.weekday()]:
+                break
+        # Mostly during the working day
+        hour = min(23, max(0, int(rng.gauss(13, 3.5))))
+        return created_at.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60))
+
+    def build_expenses(self, rng, users, count, days):
+        categories = list(CATEGORY_PROFILES)
+        weights = [CATEGORY_PROFILES[category][0] for category in categories]
+        # A few users travel a lot more than others
+        user_weights = [rng.paretovariate(1.5) for _ in users]
+        now = timezone.now()
+
+        for user, category in zip(
+            rng.choices(users, weights=user_weights, k=count),
+            rng.choices(categories, weights=weights, k=count),
+        ):
+            _, median, sigma = CATEGORY_PROFILES[category]
+            amount = Decimal(f'{min(rng.lognormvariate(math.log(median), sigma), 99999):.2f}')
+            yield Expense(
+                user=user,
+                category=category,
+                description=rng.choice(DESCRIPTIONS[category]),
+                amount=max(amount, Decimal('0.50')),
+                created_at=self.random_created_at(rng, now, days),
+            )
+
+    def handle(self, *args, **options):
+        if options['users'] <= 0 or options['expenses'] < 0:
+            raise CommandError('--users must be positive and --expenses not negative')
+        rng = random.Random(options['seed'])
+        started = time.monotonic()
+
+        with transaction.atomic():
+            if options['clear']:
+                deleted, _ = CustomUser.objects.filter(username__startswith=f'{SEED_PREFIX}-').delete()
+                self.stdout.write(f'Deleted {deleted} previously seeded rows')
+
+            departments = [choice for choice, _ in DEPARTMENT_CHOICES]
+            users = self.build_users(options['users'], max(2, options['team_size']), departments)
+            rebuild_hierarchy()
+
+            created = 0
+            batch = []
+            for expense in self.build_expenses(rng, users, options['expenses'], options['days']):
+                batch.append(expense)
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    created += self.insert(batch)
+                    batch = []
+            if batch:
+                created += self.insert(batch)
+
+            # One recomputation instead of a rollup update per inserted row
+            rebuild_rollups()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(users)} users and {created} expenses in {time.monotonic() - started:.1f}s'
+        ))
+
+    def insert(self, expenses):
+        return len(Expense.objects.bulk_create(expenses))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0002_expense_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyReportRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('shard_index', models.PositiveIntegerField(default=0)),
+                ('shard_count', models.PositiveIntegerField(default=1)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('last_user_id', models.BigIntegerField(blank=True, null=True)),
+                ('users_processed', models.PositiveIntegerField(default=0)),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('emails_sent', models.PositiveIntegerField(default=0)),
+                ('emails_failed', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-month', 'shard_index'],
+                'constraints': [models.UniqueConstraint(fields=('month', 'shard_index', 'shard_count'), name='report_run_shard_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 20:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_monthlyreportrun'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('category', models.TextField()),
+                ('count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to='users.customuser')),
+            ],
+            options={
+                'ordering': ['user', 'month', 'category'],
+                'indexes': [models.Index(fields=['month'], name='rollup_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'month', 'category'), name='rollup_user_month_category_uniq')],
+            },
+        ),
+    ]
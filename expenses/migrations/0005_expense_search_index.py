@@ -0,0 +1,104 @@
+# Generated by Django 5.2 on 2026-10-18 21:40
+
+import django.db.models.deletion
+import expenses.models
+from django.db import migrations, models
+
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE expenses_expense_fts USING fts5(
+        description, category,
+        content='expenses_expense', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER expenses_expense_fts_ai AFTER INSERT ON expenses_expense BEGIN
+        INSERT INTO expenses_expense_fts(rowid, description, category)
+        VALUES (new.id, new.description, new.category);
+    END""",
+    """CREATE TRIGGER expenses_expense_fts_ad AFTER DELETE ON expenses_expense BEGIN
+        INSERT INTO expenses_expense_fts(expenses_expense_fts, rowid, description, category)
+        VALUES ('delete', old.id, old.description, old.category);
+    END""",
+    """CREATE TRIGGER expenses_expense_fts_au AFTER UPDATE OF id, description, category ON expenses_expense BEGIN
+        INSERT INTO expenses_expense_fts(expenses_expense_fts, rowid, description, category)
+        VALUES ('delete', old.id, old.description, old.category);
+        INSERT INTO expenses_expense_fts(rowid, description, category)
+        VALUES (new.id, new.description, new.category);
+    END""",
+    "INSERT INTO expenses_expense_fts(expenses_expense_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS expenses_expense_fts_ai',
+    'DROP TRIGGER IF EXISTS expenses_expense_fts_ad',
+    'DROP TRIGGER IF EXISTS expenses_expense_fts_au',
+    'DROP TABLE IF EXISTS expenses_expense_fts',
+]
+
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS expense_description_trgm_idx ON expenses_expense USING gin (UPPER(description) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS expense_category_trgm_idx ON expenses_expense USING gin (UPPER(category) gin_trgm_ops)',
+]
+
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS expense_description_trgm_idx',
+    'DROP INDEX IF EXISTS expense_category_trgm_idx',
+]
+
+
+def sqlite_has_fts5(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        # Loadable builds don't report the option, probe for the module instead
+        cursor.execute("SELECT 1 FROM pragma_module_list WHERE name = 'fts5'")
+        return cursor.fetchone() is not None
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite' and sqlite_has_fts5(schema_editor):
+        statements = SQLITE_FORWARD
+    elif vendor == 'postgresql':
+        statements = POSTGRES_FORWARD
+    else:
+        # Searches fall back to LIKE
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = SQLITE_REVERSE
+    elif vendor == 'postgresql':
+        statements = POSTGRES_REVERSE
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0004_expensemonthlyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseSearchIndex',
+            fields=[
+                ('expense', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='expenses.expense')),
+                ('document', expenses.models.FullTextDocumentField(db_column='expenses_expense_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'expenses_expense_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
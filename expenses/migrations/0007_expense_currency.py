@@ -0,0 +1,52 @@
+# Generated by Django 5.2 on 2026-10-18 21:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_expense_trip'),
+        ('users', '0003_customuser_base_currency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=20)),
+            ],
+            options={
+                'ordering': ['currency', 'date'],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='expensemonthlyrollup',
+            options={'ordering': ['user', 'month', 'category', 'currency']},
+        ),
+        migrations.RemoveConstraint(
+            model_name='expensemonthlyrollup',
+            name='rollup_user_month_category_uniq',
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='expensemonthlyrollup',
+            name='currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+        migrations.AddConstraint(
+            model_name='expensemonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'month', 'category', 'currency'), name='rollup_user_month_category_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='fxrate',
+            constraint=models.UniqueConstraint(fields=('currency', 'date'), name='fxrate_currency_date_uniq'),
+        ),
+    ]
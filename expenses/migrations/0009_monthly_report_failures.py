@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 21:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_expense_receipt'),
+        ('users', '0003_customuser_base_currency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlyreportrun',
+            name='handled_user_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='MonthlyReportFailure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('error', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='failures', to='expenses.monthlyreportrun')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_failures', to='users.customuser')),
+            ],
+            options={
+                'ordering': ['run', 'user'],
+            },
+        ),
+    ]
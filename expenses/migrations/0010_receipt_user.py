@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-18 21:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def assign_receipt_owners(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    Receipt = apps.get_model('expenses', 'Receipt')
+
+    owners = (
+        Expense.objects.filter(receipt__isnull=False)
+        .values_list('receipt_id', 'user_id').distinct().order_by('receipt_id', 'user_id')
+    )
+    assigned = set()
+    for receipt_id, user_id in owners:
+        if receipt_id not in assigned:
+            Receipt.objects.filter(pk=receipt_id).update(user_id=user_id)
+            assigned.add(receipt_id)
+            continue
+        # Every further owner gets a copy of the row sharing the stored file
+        receipt = Receipt.objects.get(pk=receipt_id)
+        receipt.pk = None
+        receipt.user_id = user_id
+        receipt.save()
+        Expense.objects.filter(receipt_id=receipt_id, user_id=user_id).update(receipt_id=receipt.pk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_monthly_report_failures'),
+        ('users', '0003_customuser_base_currency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='receipts', to='users.customuser'),
+        ),
+        migrations.AlterField(
+            model_name='receipt',
+            name='sha256',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+        migrations.RunPython(assign_receipt_owners, migrations.RunPython.noop),
+    ]
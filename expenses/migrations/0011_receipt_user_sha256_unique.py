@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0010_receipt_user'),
+    ]
+
+    operations = [
+        # Separate from the data migration, which PostgreSQL does not allow
+        # to be followed by a schema change in the same transaction
+        migrations.AddConstraint(
+            model_name='receipt',
+            constraint=models.UniqueConstraint(fields=('user', 'sha256'), name='receipt_user_sha256_unique'),
+        ),
+    ]
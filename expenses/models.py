@@ -1,7 +1,99 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from users.models import CustomUser
+from .storage import get_receipt_storage
+
+
+class Receipt(models.Model):
+    """
+    An uploaded receipt file, stored once per user and distinct content.
+    
+    Files are named after the SHA-256 of their content, computed while the
+    upload streams to disk, so a user's expenses that upload the same file
+    share one row. Rows of different users with the same content share the
+    stored copy on disk only; no user can tell that another has uploaded a
+    file. Metadata and the thumbnail are filled in off the request thread,
+    see expenses.receipts.
+    """
+    # Owner of the expenses it is attached to; null for receipts that no
+    # expense used when receipts became per user
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True, related_name='receipts')
+    sha256 = models.CharField(max_length=64, db_index=True)
+    file = models.FileField(storage=get_receipt_storage)
+    size = models.PositiveBigIntegerField()
+    # Sniffed from the content, not taken from the client
+    content_type = models.CharField(max_length=100)
+    # Image dimensions or PDF version, read from the file header
+    metadata = models.JSONField(default=dict, blank=True)
+    # Only rendered for images when Pillow is installed
+    thumbnail = models.FileField(storage=get_receipt_storage, null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'sha256'], name='receipt_user_sha256_unique'),
+        ]
+    
+    def __str__(self):
+        return f"Receipt {self.sha256[:12]} ({self.content_type}, {self.size} bytes)"
+
+# Columns the monthly rollups and trip counters are derived from, in the
+# order of expense state tuples, see expenses.counters
+STATE_FIELDS = ('user_id', 'trip_id', 'created_at', 'category', 'currency', 'amount')
+COUNTED_FIELDS = {field.removesuffix('_id') for field in STATE_FIELDS}
+
+
+class ExpenseQuerySet(models.QuerySet):
+    def new_state_expressions(self, kwargs):
+        """
+        Map each STATE_FIELDS column to an expression of the value it has
+        after update(**kwargs), for annotating the rows before updating.
+        """
+        expressions = {}
+        for name in STATE_FIELDS:
+            field = self.model._meta.get_field(name.removesuffix('_id'))
+            value = kwargs.get(field.name, kwargs.get(field.attname, models.F(name)))
+            if isinstance(value, models.Model):
+                value = value.pk
+            if not hasattr(value, 'resolve_expression'):
+                output_field = field.target_field if field.is_relation else field
+                value = models.Value(value, output_field=output_field)
+            expressions[f'new_{name}'] = value
+        return expressions
+
+    def update(self, **kwargs):
+        """
+        Update the matched expenses and drop the cached expense responses
+        once committed. When a counted field changes, group the matched
+        rows by their state before and after the update in one query and
+        send expenses_changed in the same transaction so the rollups and
+        trip counters follow.
+        """
+        from .cache import invalidate_on_commit
+        from .signals import expenses_changed
+        if not COUNTED_FIELDS & {name.removesuffix('_id') for name in kwargs}:
+            updated = super().update(**kwargs)
+            invalidate_on_commit()
+            return updated
+
+        expressions = self.new_state_expressions(kwargs)
+        with transaction.atomic():
+            groups = (
+                self.order_by().annotate(**expressions).values_list(*STATE_FIELDS, *expressions)
+                .annotate(count=models.Count('id'))
+            )
+            size = len(STATE_FIELDS)
+            changes = [
+                (row[:size], row[size:-1], row[-1]) for row in groups if row[:size] != row[size:-1]
+            ]
+            updated = super().update(**kwargs)
+            expenses_changed.send(sender=self.model, changes=changes)
+            invalidate_on_commit()
+        return updated
+
 
 class Expense(models.Model):
     """
@@ -10,21 +102,31 @@ class Expense(models.Model):
     
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='expenses')
+    trip = models.ForeignKey('trips.Trip', on_delete=models.SET_NULL, null=True, blank=True, related_name='expenses')
     category = models.TextField()
     description = models.TextField()
     amount = models.DecimalField(max_digits=12, decimal_places=2)
-    # receipt = models.FileField(upload_to='receipts/', blank=True, null=True)
+    # ISO 4217 code of amount
+    currency = models.CharField(max_length=3, default=settings.DEFAULT_CURRENCY)
+    receipt = models.ForeignKey(Receipt, on_delete=models.SET_NULL, null=True, blank=True, related_name='expenses')
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ExpenseQuerySet.as_manager()
+    
     class Meta:
         indexes = [
             models.Index(fields=['category'], name='category_idx'),
+            # Per-user listings and monthly reports filter by user and a created_at range
+            models.Index(fields=['user', 'created_at'], name='user_created_idx'),
+            models.Index(fields=['user', 'category', 'created_at'], name='user_category_created_idx'),
+            # Global listing ordered by (-created_at, -id) for keyset pagination
+            models.Index(fields=['created_at', 'id'], name='created_id_idx'),
         ]
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.user.username}'s expense: {self.amount} ({self.status})"
+        return f"{self.user.username}'s expense: {self.amount} {self.currency} ({self.category})"
     
     def save(self, *args, **kwargs):
         """
@@ -33,4 +135,158 @@ class Expense(models.Model):
         if not self.id:
             self.created_at = timezone.now()
         self.updated_at = timezone.now()
-        return super(Expense, self).save(*args, **kwargs)
\ No newline at end of file
+        # Derived tables are updated by post_save receivers, keep them in
+        # the same transaction as the row itself
+        with transaction.atomic():
+            return super(Expense, self).save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super(Expense, self).delete(*args, **kwargs)
+
+class FullTextDocumentField(models.TextField):
+    """
+    The hidden column named after an SQLite FTS5 table; matching it
+    searches every indexed column.
+    """
+
+
+@FullTextDocumentField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+class ExpenseSearchIndex(models.Model):
+    """
+    SQLite FTS5 trigram index over expense descriptions and categories.
+
+    The virtual table is created by a migration and kept in sync by
+    triggers on the expense table; this model only exists so searches can
+    join it and read its bm25 rank. See expenses.search.
+    """
+    expense = models.OneToOneField(
+        Expense, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+        db_constraint=False, related_name='search_index',
+    )
+    document = FullTextDocumentField(db_column='expenses_expense_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'expenses_expense_fts'
+
+class ExpenseMonthlyRollup(models.Model):
+    """
+    Expense count and total per user, month, category and currency.
+    
+    Kept current incrementally by the receivers in expenses.signals, for
+    saves, deletes and queryset updates, and rebuilt from scratch by the
+    rebuild_expense_rollups command. The per-category and per-month
+    summary breakdowns of unfiltered requests are read from it. bulk_create() must be followed by
+    expenses_bulk_created; raw SQL writes need a rebuild.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='expense_rollups')
+    month = models.DateField()
+    category = models.TextField()
+    currency = models.CharField(max_length=3, default=settings.DEFAULT_CURRENCY)
+    count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'category', 'currency'], name='rollup_user_month_category_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='rollup_month_idx'),
+        ]
+        ordering = ['user', 'month', 'category', 'currency']
+    
+    def __str__(self):
+        return f"{self.user_id} {self.month:%Y-%m} {self.category}: {self.count} expenses, {self.total_amount} {self.currency}"
+
+
+class FxRate(models.Model):
+    """
+    Exchange rate of a currency on a date: the units of the currency one
+    FX_RATE_BASE_CURRENCY buys. Loaded from files by the load_fx_rates
+    command and read through the cache in expenses.fx.
+    """
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+    
+    class Meta:
+        constraints = [
+            # Also serves lookups of a currency's rates over a date range
+            models.UniqueConstraint(fields=['currency', 'date'], name='fxrate_currency_date_uniq'),
+        ]
+        ordering = ['currency', 'date']
+    
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+
+REPORT_RUN_STATUS_CHOICES = [
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed')
+]
+
+
+class MonthlyReportRun(models.Model):
+    """
+    Checkpoint of a monthly expense report run for one shard of users.
+    
+    Users are processed in user id order and last_user_id is the last user
+    of the contiguous prefix of batches that completed. Batches that were
+    already in flight when an earlier one failed still send their emails;
+    their users are kept in handled_user_ids. A resumed run starts after
+    last_user_id and skips handled_user_ids, so nobody is emailed twice.
+    Shards split the user id space by user_id % shard_count.
+    """
+    month = models.DateField()
+    shard_index = models.PositiveIntegerField(default=0)
+    shard_count = models.PositiveIntegerField(default=1)
+    status = models.CharField(max_length=10, choices=REPORT_RUN_STATUS_CHOICES, default='running')
+    last_user_id = models.BigIntegerField(null=True, blank=True)
+    # Users after last_user_id whose batch completed after an earlier batch failed
+    handled_user_ids = models.JSONField(default=list, blank=True)
+    users_processed = models.PositiveIntegerField(default=0)
+    rows_processed = models.PositiveIntegerField(default=0)
+    emails_sent = models.PositiveIntegerField(default=0)
+    emails_failed = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'shard_index', 'shard_count'], name='report_run_shard_unique'),
+        ]
+        ordering = ['-month', 'shard_index']
+    
+    def __str__(self):
+        return f"Report run {self.month:%Y-%m} shard {self.shard_index + 1}/{self.shard_count} ({self.status})"
+
+
+class MonthlyReportFailure(models.Model):
+    """
+    A monthly report email that could not be delivered after all retries,
+    or whose amounts could not be converted for lack of an FX rate. The
+    run counts the user as processed and does not send it again.
+    """
+    run = models.ForeignKey(MonthlyReportRun, on_delete=models.CASCADE, related_name='failures')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='report_failures')
+    error = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['run', 'user']
+    
+    def __str__(self):
+        return f"{self.run}: user {self.user_id} failed ({self.error})"
@@ -0,0 +1,211 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ExpenseKeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over the active ordering plus the primary key.
+
+    Each page is fetched with a WHERE clause on the last row seen instead of
+    an OFFSET, so fetching page 1000 costs the same as fetching page 1. The
+    ordering comes from the OrderingFilter (or the view default) and `id` is
+    appended as a tie-breaker, so the default ordering is (-created_at, -id).
+    Pages are stable across writes for orderings on stored columns only;
+    an annotation such as the search rank can change under a cursor.
+    """
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    tiebreak_field = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset, view)
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['reverse'])
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self._flip(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+
+        if cursor is not None:
+            queryset = queryset.filter(self._position_filter(ordering, cursor['position']))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next = cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset, view):
+        """
+        Return the ordering applied by the filter backends (or the view
+        default), always ending with the tie-breaker field.
+        """
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        if not ordering:
+            ordering = list(getattr(view, 'ordering', None) or queryset.model._meta.ordering)
+
+        names = [field.lstrip('-') for field in ordering]
+        if self.tiebreak_field not in names and 'pk' not in names:
+            descending = ordering[0].startswith('-') if ordering else False
+            ordering.append(('-' if descending else '') + self.tiebreak_field)
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self._build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self._build_link(self.page[0], reverse=True)
+
+    def _build_link(self, row, reverse):
+        position = [self._get_value(row, field.lstrip('-')) for field in self.ordering]
+        token = self.encode_cursor(position, reverse)
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def encode_cursor(self, position, reverse):
+        """
+        Encode a position into an opaque, URL safe cursor token.
+        """
+        payload = {
+            'o': self.ordering,
+            'p': [self._encode_value(value) for value in position],
+            'r': 1 if reverse else 0,
+        }
+        data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        """
+        Decode the cursor query parameter, or return None for the first page.
+        """
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            ordering = payload['o']
+            position = payload['p']
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor is only meaningful for the ordering it was created with
+        if ordering != self.ordering or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return {'position': position, 'reverse': reverse}
+
+    def _position_filter(self, ordering, position):
+        """
+        Build the keyset condition selecting rows strictly after a position.
+
+        For ordering (a, b, id) this is
+            a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        with the comparison flipped for descending fields, guarded by a
+        leading a >= x so the database can range scan an index on `a`.
+        """
+        fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        values = [self._decode_value(name, value) for (name, _), value in zip(fields, position)]
+
+        condition = Q()
+        for index, (name, descending) in enumerate(fields):
+            branch = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[index]})
+            for prior_index in range(index):
+                branch &= Q(**{fields[prior_index][0]: values[prior_index]})
+            condition |= branch
+
+        first_name, first_descending = fields[0]
+        leading = Q(**{f"{first_name}__{'lte' if first_descending else 'gte'}": values[0]})
+        return leading & condition
+
+    def _decode_value(self, name, value):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations have no model field, keep the JSON value as is
+            return value
+        try:
+            return field.to_python(value)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    @staticmethod
+    def _get_value(row, name):
+        if isinstance(row, dict):
+            return row[name]
+        if name == 'pk':
+            return row.pk
+        value = getattr(row, name)
+        # Order on the raw column for relations
+        return getattr(value, 'pk', value)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
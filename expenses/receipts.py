@@ -0,0 +1,415 @@
+import hashlib
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
+from .models import Receipt
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Accepted receipt types by content type, with the stored file extension
+RECEIPT_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'application/pdf': '.pdf',
+}
+
+# Types Pillow renders thumbnails of
+THUMBNAIL_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+
+# Bytes read to sniff the type and read the header of PNG, GIF, WebP and PDF files
+HEADER_BYTES = 32
+
+# Bytes read per iteration when streaming a receipt to the client
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# A single byte range; other forms (several ranges, other units) get the whole file
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# JPEG start of frame markers, which carry the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Metadata and thumbnails of new receipts are generated here, off the request thread
+_background_executor = ThreadPoolExecutor(
+    max_workers=settings.RECEIPT_PROCESSING_WORKERS, thread_name_prefix='receipt-process',
+)
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream uploaded files to a temporary file on disk, whatever their size,
+    computing their SHA-256 on the way.
+
+    Completed files get a `sha256` attribute with the hex digest. An upload
+    larger than max_size stops the parse: the rest of the body is read and
+    discarded, nothing is kept and `too_large` is set.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.max_size is not None and start + len(raw_data) > self.max_size:
+            self.too_large = True
+            raise StopUpload(connection_reset=False)
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.sha256 = self.digest.hexdigest()
+        return upload
+
+
+def sniff_content_type(header):
+    """
+    Return the content type of a file from its first bytes, or None if it
+    is not one of RECEIPT_TYPES.
+    """
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    if header.startswith(b'%PDF-'):
+        return 'application/pdf'
+    return None
+
+
+def receipt_file_name(sha256, extension):
+    # Two directory levels keep directories small with many receipts
+    return f'{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+
+def store_receipt(upload, user):
+    """
+    Return (receipt, created) for a file received by HashingUploadHandler
+    for one of user's expenses.
+
+    A receipt of the user with the same hash is reused; receipts of other
+    users never are, so the response cannot tell whether someone else has
+    uploaded the file. Otherwise the temporary file is moved into receipt
+    storage, without being read again, unless another user's receipt
+    already stored that content, and its metadata is generated in the
+    background once the transaction commits. Raises ValueError for empty
+    files and unsupported types.
+    """
+    if not upload.size:
+        raise ValueError('The receipt is empty.')
+    upload.seek(0)
+    content_type = sniff_content_type(upload.read(HEADER_BYTES))
+    upload.seek(0)
+    if content_type is None:
+        raise ValueError(f"Receipts must be one of: {', '.join(RECEIPT_TYPES)}.")
+
+    existing = Receipt.objects.filter(user=user, sha256=upload.sha256).first()
+    if existing is not None:
+        return existing, False
+
+    receipt = Receipt(user=user, sha256=upload.sha256, size=upload.size, content_type=content_type)
+    storage = receipt.file.storage
+    name = receipt_file_name(upload.sha256, RECEIPT_TYPES[content_type])
+    # A file of another user's receipt, or left by a rolled back upload,
+    # has the same content
+    if not storage.exists(name):
+        name = storage.save(name, upload)
+    receipt.file.name = name
+    try:
+        with transaction.atomic():
+            receipt.save()
+    except IntegrityError:
+        # Stored concurrently by an upload of the same content
+        if name != receipt_file_name(upload.sha256, RECEIPT_TYPES[content_type]):
+            storage.delete(name)
+        return Receipt.objects.get(user=user, sha256=upload.sha256), False
+
+    schedule_receipt_processing(receipt.pk)
+    return receipt, True
+
+
+def read_jpeg_size(file):
+    """
+    Walk the JPEG segments up to the first start of frame and return
+    (width, height), or None. Skips over segments without reading them.
+    """
+    file.seek(2)
+    while True:
+        byte = file.read(1)
+        if byte != b'\xff':
+            return None
+        while byte == b'\xff':
+            byte = file.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Standalone markers have no length
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image, or start of scan without a frame header
+            return None
+        length = file.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack('>H', length)[0]
+        if marker in JPEG_SOF_MARKERS:
+            frame = file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        file.seek(length - 2, 1)
+
+
+def read_webp_size(header):
+    chunk = header[12:16]
+    if chunk == b'VP8X':
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+        return width, height
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        bits = int.from_bytes(header[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    return None
+
+
+def read_metadata(file, content_type):
+    """
+    Read the image size or PDF version of a receipt from its header,
+    without decoding the file.
+    """
+    header = file.read(HEADER_BYTES)
+    size = None
+    if content_type == 'image/png' and len(header) >= 24:
+        size = struct.unpack('>II', header[16:24])
+    elif content_type == 'image/gif' and len(header) >= 10:
+        size = struct.unpack('<HH', header[6:10])
+    elif content_type == 'image/webp' and len(header) >= 30:
+        size = read_webp_size(header)
+    elif content_type == 'image/jpeg':
+        size = read_jpeg_size(file)
+    elif content_type == 'application/pdf':
+        match = re.match(rb'%PDF-(\d+\.\d+)', header)
+        return {'pdf_version': match.group(1).decode('ascii')} if match else {}
+    if size is None:
+        return {}
+    return {'width': size[0], 'height': size[1]}
+
+
+def render_thumbnail(receipt):
+    """
+    Render a JPEG thumbnail of an image receipt within
+    RECEIPT_THUMBNAIL_SIZE and store it next to the receipt. Returns the
+    stored name.
+    """
+    size = tuple(settings.RECEIPT_THUMBNAIL_SIZE)
+    buffer = BytesIO()
+    with receipt.file.open('rb') as file, Image.open(file) as image:
+        # JPEGs are decoded at a reduced scale instead of full size
+        image.draft('RGB', size)
+        image.thumbnail(size)
+        image.convert('RGB').save(buffer, 'JPEG', quality=85)
+
+    storage = receipt.thumbnail.storage
+    name = receipt_file_name(receipt.sha256, '.thumb.jpg')
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(buffer.getvalue()))
+    return name
+
+
+def process_receipt(receipt_id):
+    """
+    Read the metadata of a stored receipt and, for images when Pillow is
+    installed, render its thumbnail. Returns the metadata.
+    """
+    receipt = Receipt.objects.get(pk=receipt_id)
+    with receipt.file.open('rb') as file:
+        metadata = read_metadata(file, receipt.content_type)
+
+    thumbnail = None
+    if Image is not None and receipt.content_type in THUMBNAIL_TYPES:
+        try:
+            thumbnail = render_thumbnail(receipt)
+        except Exception:
+            # Metadata is still worth keeping for files Pillow cannot read
+            logger.exception(f"Failed to render the thumbnail of {receipt}")
+
+    Receipt.objects.filter(pk=receipt_id).update(metadata=metadata, thumbnail=thumbnail, processed_at=timezone.now())
+    return metadata
+
+
+def _process_in_background(receipt_id):
+    close_old_connections()
+    try:
+        process_receipt(receipt_id)
+    except Exception:
+        logger.exception(f"Failed to process receipt {receipt_id}")
+    finally:
+        close_old_connections()
+
+
+def schedule_receipt_processing(receipt_id):
+    """
+    Process a receipt on the background pool once the current
+    transaction commits.
+    """
+    transaction.on_commit(lambda: _background_executor.submit(_process_in_background, receipt_id))
+
+
+def process_pending_receipts(older_than=timedelta(minutes=10)):
+    """
+    Process receipts whose background processing never finished, e.g.
+    because the process stopped. Returns the number processed.
+    """
+    pending = Receipt.objects.filter(
+        processed_at__isnull=True, created_at__lt=timezone.now() - older_than,
+    ).values_list('pk', flat=True)
+    processed = 0
+    for receipt_id in pending.iterator():
+        try:
+            process_receipt(receipt_id)
+        except Exception:
+            logger.exception(f"Failed to process receipt {receipt_id}")
+            continue
+        processed += 1
+    return processed
+
+
+def prune_receipts(older_than=None):
+    """
+    Delete receipts no expense refers to any more, and their files unless
+    another user's receipt shares them. Recent receipts are kept, as an
+    upload may be about to attach them. Returns the number deleted.
+    """
+    if older_than is None:
+        older_than = timedelta(hours=settings.RECEIPT_PRUNE_AFTER_HOURS)
+    unused = Receipt.objects.filter(
+        expenses__isnull=True, created_at__lt=timezone.now() - older_than,
+    ).values_list('pk', flat=True)
+    deleted = 0
+    for receipt_id in unused.iterator():
+        with transaction.atomic():
+            # The row lock holds off expenses attaching the receipt, so the
+            # references re-checked under it stay true until the delete
+            receipt = Receipt.objects.select_for_update().filter(pk=receipt_id).first()
+            if receipt is None or receipt.expenses.exists():
+                continue
+            receipt.delete()
+            for field_file in (receipt.file, receipt.thumbnail):
+                # Receipts of other users may share the stored file
+                if field_file and not Receipt.objects.filter(
+                    Q(file=field_file.name) | Q(thumbnail=field_file.name)
+                ).exists():
+                    transaction.on_commit(lambda field_file=field_file: field_file.delete(save=False))
+        deleted += 1
+    if deleted:
+        logger.info(f"Pruned {deleted} unused receipts")
+    return deleted
+
+
+def parse_range(header, size):
+    """
+    Return the (first, last) byte positions, inclusive, of a single-range
+    Range header. Returns None when the header is absent or not a single
+    byte range, in which case the whole file is sent. Raises ValueError
+    when the range starts past the end of the file.
+    """
+    match = RANGE_HEADER.match(header.strip()) if header else None
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if not int(last) or not size:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise ValueError(header)
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def iter_file_range(file, start, length, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Yield `length` bytes of an open file from `start` in chunks, closing
+    the file when done or when the response is closed early.
+    """
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def file_response(request, field_file, size, content_type, etag, filename):
+    """
+    Stream a stored file with support for single byte ranges (206 Partial
+    Content), If-Range and If-None-Match. The file is read in chunks as
+    the client consumes the response, never loaded whole.
+    """
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private',
+    }
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return HttpResponse(status=304, headers=headers)
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # A stale If-Range asks for the whole, changed, file
+    if not if_range or if_range == etag:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    start, last = byte_range or (0, size - 1)
+    file = field_file.storage.open(field_file.name, 'rb')
+    response = StreamingHttpResponse(
+        iter_file_range(file, start, last - start + 1),
+        status=206 if byte_range else 200,
+        content_type=content_type,
+        headers=headers,
+    )
+    response['Content-Length'] = str(last - start + 1)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{last}/{size}'
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    return response
@@ -0,0 +1,133 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .cache import invalidate_on_commit
+from .counters import add_to_counter, aggregate_counters, compare_counters
+from .fx import convert_rows, group_for_conversion
+from .models import Expense, ExpenseMonthlyRollup
+
+
+def month_of(created_at):
+    """
+    Return the first day of the month of a datetime, in the current time
+    zone, matching TruncMonth in the database.
+    """
+    return timezone.localtime(created_at).date().replace(day=1)
+
+
+def apply_delta(user_id, month, category, currency, count, amount):
+    """
+    Add count and amount to one rollup row, creating it if needed and
+    removing it once it no longer counts any expense.
+    """
+    if not count and not amount:
+        return
+
+    rows = add_to_counter(
+        ExpenseMonthlyRollup, {'user_id': user_id, 'month': month, 'category': category, 'currency': currency},
+        count=count, total_amount=amount,
+    )
+    if count < 0:
+        rows.filter(count__lte=0).delete()
+
+
+def record_changes(changes):
+    """
+    Move the contributions of changed expenses, given as (previous,
+    current, count) as sent with expenses_changed, with one update per
+    affected rollup row.
+    """
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    for previous, current, count in changes:
+        for state, sign in ((previous, -count), (current, count)):
+            if state is None:
+                continue
+            user_id, _, created_at, category, currency, amount = state
+            key = (user_id, month_of(created_at), category, currency)
+            deltas[key][0] += sign
+            deltas[key][1] += sign * Decimal(amount)
+
+    for (user_id, month, category, currency), (count, amount) in deltas.items():
+        apply_delta(user_id, month, category, currency, count, amount)
+
+
+def sum_rollups(queryset, field, currency):
+    """
+    Count and total amount of every expense per 'category' or 'month',
+    converted into `currency`, for an unfiltered expense `queryset`.
+
+    The rollup rows in `currency` are summed instead of the expenses, one
+    row per user, month and category. Only if other currencies are
+    present are those expenses grouped by currency and date and converted
+    as sum_converted does. Returns {(value,): totals} like sum_converted,
+    without minimum and maximum.
+    """
+    same = Q(currency=currency)
+    rows = ExpenseMonthlyRollup.objects.order_by().values(field).annotate(
+        same_count=Sum('count', filter=same),
+        same_amount=Sum('total_amount', filter=same),
+        foreign_count=Sum('count', filter=~same),
+    )
+    totals = defaultdict(lambda: {'currency': currency, 'count': 0, 'total_amount': Decimal('0')})
+    foreign = False
+    for row in rows:
+        foreign = foreign or bool(row['foreign_count'])
+        if row['same_count']:
+            totals[(row[field],)]['count'] += row['same_count']
+            totals[(row[field],)]['total_amount'] += Decimal(str(row['same_amount']))
+
+    if foreign:
+        expenses = queryset.exclude(currency=currency)
+        if field == 'month':
+            # Dates, like the month of the rollup rows
+            expenses = expenses.annotate(month=TruncMonth('created_at', output_field=DateField()))
+        for row in convert_rows(group_for_conversion(expenses, (field,), currency, count=Count('id'), total_amount=Sum('amount'))):
+            totals[(row[field],)]['count'] += row['count']
+            totals[(row[field],)]['total_amount'] += row['total_amount']
+    return dict(totals)
+
+
+def compute_rollups():
+    """
+    Aggregate the raw expense table into rollup values keyed by
+    (user_id, month, category, currency).
+    """
+    return aggregate_counters(
+        Expense.objects.annotate(month=TruncMonth('created_at', output_field=DateField())),
+        'user_id', 'month', 'category', 'currency',
+    )
+
+
+@transaction.atomic
+def rebuild_rollups(batch_size=1000):
+    """
+    Replace the rollup table with values recomputed from raw expenses and
+    drop the cached expense responses. Returns the number of rollup rows
+    written.
+    """
+    ExpenseMonthlyRollup.objects.all().delete()
+    rollups = [
+        ExpenseMonthlyRollup(
+            user_id=user_id, month=month, category=category, currency=currency,
+            count=count, total_amount=total_amount,
+        )
+        for (user_id, month, category, currency), (count, total_amount) in compute_rollups().items()
+    ]
+    ExpenseMonthlyRollup.objects.bulk_create(rollups, batch_size=batch_size)
+    invalidate_on_commit()
+    return len(rollups)
+
+
+def verify_rollups():
+    """
+    Compare the rollup table with the raw expenses and return a list of
+    (key, expected, actual) mismatches, where values are (count, total).
+    """
+    actual = {
+        (row.user_id, row.month, row.category, row.currency): (row.count, row.total_amount)
+        for row in ExpenseMonthlyRollup.objects.all()
+    }
+    return compare_counters(compute_rollups(), actual)
@@ -0,0 +1,162 @@
+from functools import reduce
+from operator import or_
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+SEARCH_RANK = 'search_rank'
+SEARCH_INDEX_TABLE = 'expenses_expense_fts'
+
+# The trigram tokenizer cannot match shorter terms, they fall back to LIKE
+MIN_INDEXED_TERM_LENGTH = 3
+
+# Keep the external content FTS5 table in step with the expense table.
+# Re-created after every migrate since rebuilding the expense table drops them.
+SQLITE_SEARCH_TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_ai AFTER INSERT ON expenses_expense BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}(rowid, description, category)
+        VALUES (new.id, new.description, new.category);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_ad AFTER DELETE ON expenses_expense BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, description, category)
+        VALUES ('delete', old.id, old.description, old.category);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_au AFTER UPDATE OF id, description, category ON expenses_expense BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, description, category)
+        VALUES ('delete', old.id, old.description, old.category);
+        INSERT INTO {SEARCH_INDEX_TABLE}(rowid, description, category)
+        VALUES (new.id, new.description, new.category);
+    END''',
+)
+
+POSTGRES_SEARCH_INDEXES = ('expense_description_trgm_idx', 'expense_category_trgm_idx')
+
+
+# Databases known to have the index, by name; only migrations add it
+_indexed_databases = set()
+
+
+def has_search_index(connection):
+    """
+    Return True if the database has the SQLite FTS5 expense index.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    name = str(connection.settings_dict['NAME'])
+    if name in _indexed_databases:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_INDEX_TABLE]
+        )
+        if cursor.fetchone() is None:
+            return False
+    _indexed_databases.add(name)
+    return True
+
+
+def install_search_triggers(using='default'):
+    """
+    Create the SQLite sync triggers if the index exists and they are missing.
+    """
+    connection = connections[using]
+    if not has_search_index(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            cursor.execute(statement)
+
+
+def rebuild_search_index(using='default'):
+    """
+    Rebuild the full-text index from the expense table.
+    Returns the backend that was rebuilt, or None if there is no index.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if has_search_index(connection):
+            install_search_triggers(using)
+            cursor.execute(f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('optimize')")
+            return 'sqlite-fts5'
+        if connection.vendor == 'postgresql':
+            for index_name in POSTGRES_SEARCH_INDEXES:
+                cursor.execute(f'REINDEX INDEX {index_name}')
+            return 'postgresql-trgm'
+    return None
+
+
+def fts_query(terms):
+    """
+    Build an FTS5 query matching rows that contain every term as a substring.
+    """
+    return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+class ExpenseSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter backed by a full-text index.
+
+    On SQLite, terms are matched against description and category through
+    the FTS5 trigram index (same substring semantics as icontains) and
+    results carry a `search_rank` from bm25. On PostgreSQL the icontains
+    lookups use the pg_trgm indexes and are ranked by trigram word
+    similarity. Other databases get the plain SearchFilter. Unless
+    ?ordering is given, results are ordered by rank, best first, then by
+    the view ordering.
+
+    Ranked pages give up the stability of keyset pagination: editing a
+    row moves its rank, and on SQLite bm25 depends on the whole index, so
+    any write can move the rank of every match. A cursor followed after a
+    write may then skip or repeat results. Pass ?ordering= for a search
+    that pages stably.
+
+    Place it after OrderingFilter so the rank ordering can take precedence.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        connection = connections[queryset.db]
+        if has_search_index(connection):
+            queryset = self.filter_sqlite(queryset, search_fields, search_terms)
+        elif connection.vendor == 'postgresql':
+            queryset = self.filter_postgresql(request, queryset, view, search_terms)
+        else:
+            return super().filter_queryset(request, queryset, view)
+
+        # Rank ordering is unstable across writes, see the class docstring
+        if SEARCH_RANK in queryset.query.annotations and \
+                not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by(f'-{SEARCH_RANK}', *queryset.query.order_by)
+        return queryset
+
+    def filter_sqlite(self, queryset, search_fields, search_terms):
+        indexed_terms = [term for term in search_terms if len(term) >= MIN_INDEXED_TERM_LENGTH]
+        lookups = [self.construct_search(str(field), queryset) for field in search_fields]
+        for term in search_terms:
+            if len(term) < MIN_INDEXED_TERM_LENGTH:
+                queryset = queryset.filter(reduce(or_, (Q(**{lookup: term}) for lookup in lookups)))
+
+        if indexed_terms:
+            queryset = queryset.filter(search_index__document__match=fts_query(indexed_terms)).annotate(
+                # bm25 is lower for better matches
+                **{SEARCH_RANK: -F('search_index__rank')}
+            )
+        return queryset
+
+    def filter_postgresql(self, request, queryset, view, search_terms):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        from django.db.models.functions import Greatest
+
+        text = ' '.join(search_terms)
+        return super().filter_queryset(request, queryset, view).annotate(**{
+            SEARCH_RANK: Greatest(
+                TrigramWordSimilarity(text, 'description'),
+                TrigramWordSimilarity(text, 'category'),
+            )
+        })
@@ -1,7 +1,12 @@
 from rest_framework import serializers
-from .models import Expense
+from .fx import MissingRateError, get_rate_cache, is_currency_code
+from .models import Expense, Receipt
 from decimal import Decimal
+import decimal
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+from trips.models import Trip
 from users.models import CustomUser
 # TODO: Implement JWT Authentication
 # TODO: Implement report generation cron job
@@ -23,11 +28,54 @@ class ExpenseSerializer(serializers.ModelSerializer):
         required=False,
         allow_null=True
     )
+    trip = serializers.PrimaryKeyRelatedField(
+        queryset=Trip.objects.all(),
+        required=False,
+        allow_null=True
+    )
     
     class Meta:
         model = Expense
-        fields = ['id', 'user', 'category', 'description', 'amount', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'user', 'trip', 'category', 'description', 'amount', 'currency', 'receipt', 'created_at', 'updated_at']
+        # Receipts are attached through /expenses/{id}/receipt/
+        read_only_fields = ['id', 'receipt', 'created_at', 'updated_at']
+
+    def validate_currency(self, value):
+        value = value.upper()
+        if not is_currency_code(value):
+            raise serializers.ValidationError("Must be a three-letter ISO 4217 code.")
+        return value
+
+    def validate(self, attrs):
+        # An expense can only be filed under one of its user's trips;
+        # update() never changes the user
+        trip = attrs.get('trip')
+        if self.instance is not None:
+            user = self.instance.user
+        else:
+            user = attrs.get('user')
+        if trip is not None and trip.user_id != getattr(user, 'pk', None):
+            raise serializers.ValidationError({'trip': ["Trip belongs to another user."]})
+
+        # Foreign currency amounts must be convertible into the base
+        # currency, and into the trip's currency for its budget counters
+        currency = attrs.get('currency')
+        if currency is None:
+            currency = self.instance.currency if self.instance is not None else settings.DEFAULT_CURRENCY
+        if 'trip' not in attrs and self.instance is not None:
+            trip = self.instance.trip
+        day = timezone.localtime(self.instance.created_at).date() if self.instance is not None else timezone.localdate()
+        targets = set()
+        if 'currency' in attrs:
+            targets.add(getattr(user, 'base_currency', settings.DEFAULT_CURRENCY))
+        if trip is not None:
+            targets.add(trip.currency)
+        for target in targets - {currency}:
+            try:
+                get_rate_cache().convert(1, currency, target, day)
+            except MissingRateError as exc:
+                raise serializers.ValidationError({'currency': [str(exc)]})
+        return attrs
 
     def create(self, validated_data):
         # Get the user from the request context
@@ -39,5 +87,135 @@ class ExpenseSerializer(serializers.ModelSerializer):
         instance.category = validated_data.get('category', instance.category)
         instance.description = validated_data.get('description', instance.description)
         instance.amount = validated_data.get('amount', instance.amount)
+        instance.currency = validated_data.get('currency', instance.currency)
+        instance.trip = validated_data.get('trip', instance.trip)
         instance.save()
-        return instance
\ No newline at end of file
+        return instance
+
+
+# Columns read for the list endpoint, in ExpenseSerializer field order
+EXPENSE_LIST_FIELDS = ('id', 'user_id', 'trip_id', 'category', 'description', 'amount', 'currency', 'receipt_id', 'created_at', 'updated_at')
+
+_AMOUNT_EXPONENT = Decimal('0.01')
+_AMOUNT_CONTEXT = decimal.Context(prec=12)
+
+
+def _format_amount(value):
+    # DecimalField(max_digits=12, decimal_places=2) representation
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value).strip())
+    return '{:f}'.format(value.quantize(_AMOUNT_EXPONENT, context=_AMOUNT_CONTEXT))
+
+
+def _format_datetime(value, tz):
+    # DateTimeField ISO 8601 representation in the current time zone
+    if not value:
+        return None
+    value = value.astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def serialize_expense_rows(rows):
+    """
+    Serialize .values(*EXPENSE_LIST_FIELDS) rows for the list endpoint.
+
+    Produces exactly what ExpenseSerializer(many=True).data produces for
+    the same expenses, without building model instances or running the
+    field, relation and choice machinery for every row.
+    """
+    tz = timezone.get_current_timezone()
+    return [
+        {
+            'id': row['id'],
+            'user': row['user_id'],
+            'trip': row['trip_id'],
+            'category': row['category'],
+            'description': row['description'],
+            'amount': _format_amount(row['amount']),
+            'currency': row['currency'],
+            'receipt': row['receipt_id'],
+            'created_at': _format_datetime(row['created_at'], tz),
+            'updated_at': _format_datetime(row['updated_at'], tz),
+        }
+        for row in rows
+    ]
+
+
+class ReceiptSerializer(serializers.ModelSerializer):
+    has_thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Receipt
+        fields = ['id', 'sha256', 'size', 'content_type', 'metadata', 'has_thumbnail', 'processed_at', 'created_at']
+        read_only_fields = fields
+
+    def get_has_thumbnail(self, receipt):
+        return bool(receipt.thumbnail)
+
+
+class PreloadedRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Related field resolved from a {pk: instance} map stored in the
+    serializer context under `context_key` instead of one query per row.
+    """
+
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        instances = self.context.get(self.context_key)
+        if instances is None:
+            return super().to_internal_value(data)
+        try:
+            return instances[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class BulkExpenseSerializer(ExpenseSerializer):
+    """
+    ExpenseSerializer for bulk ingestion, with users and trips preloaded
+    in one query each.
+    """
+    user = PreloadedRelatedField(
+        'users',
+        queryset=CustomUser.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    trip = PreloadedRelatedField(
+        'trips',
+        queryset=Trip.objects.all(),
+        required=False,
+        allow_null=True
+    )
+
+    @staticmethod
+    def referenced_ids(rows, field):
+        ids = set()
+        for row in rows:
+            if isinstance(row, dict):
+                try:
+                    ids.add(int(row.get(field)))
+                except (TypeError, ValueError):
+                    pass
+        return ids
+
+    @staticmethod
+    def preload_users(rows):
+        """
+        Fetch every user referenced by the rows with a single query.
+        """
+        return CustomUser.objects.in_bulk(BulkExpenseSerializer.referenced_ids(rows, 'user'))
+
+    @staticmethod
+    def preload_trips(rows):
+        """
+        Fetch every trip referenced by the rows with a single query.
+        """
+        return Trip.objects.in_bulk(BulkExpenseSerializer.referenced_ids(rows, 'trip'))
@@ -0,0 +1,104 @@
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from . import cache, rollups, search
+from .counters import expense_state
+from .models import STATE_FIELDS, Expense
+
+# Sent after Expense.objects.bulk_create(), which bypasses post_save.
+# Receivers get the list of created expenses as `expenses`.
+expenses_bulk_created = Signal()
+
+# Sent inside the transaction of every write that changes the counted
+# fields of expenses: save(), delete(), bulk_create() followed by
+# expenses_bulk_created, and queryset update(). Receivers get `changes`, a
+# list of (previous, current, count) where previous and current are
+# expense state tuples (see expenses.counters), previous is None for new
+# expenses and current None for deleted ones, and count is the number of
+# expenses that made that change. Saves and bulk creates also pass the
+# instances as `expenses`, to reuse relations they have loaded. The
+# monthly rollups and the trip counters are kept up to date from it.
+expenses_changed = Signal()
+
+
+@receiver(post_init, sender=Expense)
+def remember_expense_state(sender, instance, **kwargs):
+    """
+    Remember the loaded values so updates can move the old contribution.
+    """
+    if instance.pk and not set(STATE_FIELDS) & instance.get_deferred_fields():
+        instance._counted_state = expense_state(instance)
+    else:
+        instance._counted_state = None
+
+
+@receiver(pre_save, sender=Expense)
+@receiver(pre_delete, sender=Expense)
+def load_expense_state(sender, instance, raw=False, **kwargs):
+    """
+    Read the stored values for instances loaded with deferred fields or
+    built with an explicit primary key.
+    """
+    if raw or not instance.pk or instance._counted_state is not None:
+        return
+    stored = Expense.objects.filter(pk=instance.pk).values_list(*STATE_FIELDS).first()
+    instance._counted_state = stored
+    if stored is not None:
+        # Fill in deferred fields from the same row instead of loading them
+        # one query each when the new state is read after saving
+        deferred = instance.get_deferred_fields()
+        for field, value in zip(STATE_FIELDS, stored):
+            if field in deferred:
+                setattr(instance, field, value)
+
+
+@receiver(post_save, sender=Expense)
+def send_expense_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else instance._counted_state
+    current = expense_state(instance)
+    if previous != current:
+        expenses_changed.send(sender=Expense, changes=[(previous, current, 1)], expenses=[instance])
+    instance._counted_state = current
+
+
+@receiver(post_delete, sender=Expense)
+def send_expense_deleted(sender, instance, **kwargs):
+    if instance._counted_state is not None:
+        expenses_changed.send(sender=Expense, changes=[(instance._counted_state, None, 1)])
+        instance._counted_state = None
+
+
+@receiver(expenses_bulk_created, sender=Expense)
+def send_expenses_created(sender, expenses, **kwargs):
+    expenses_changed.send(
+        sender=Expense, changes=[(None, expense_state(expense), 1) for expense in expenses], expenses=expenses,
+    )
+
+
+@receiver(expenses_changed, sender=Expense)
+def update_rollups(sender, changes, **kwargs):
+    rollups.record_changes(changes)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(expenses_bulk_created, sender=Expense)
+@receiver(post_delete, sender='trips.Trip')
+def invalidate_cached_responses(sender, **kwargs):
+    """
+    Drop the cached expense responses once a write commits, whether it
+    came from the API, the admin, a command or the shell. Deleting a trip
+    clears the trip of its expenses without saving them.
+    """
+    cache.invalidate_on_commit()
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using='default', **kwargs):
+    """
+    Migrations that rebuild the expense table on SQLite drop its triggers,
+    put the full-text index triggers back.
+    """
+    if sender.name == 'expenses':
+        search.install_search_triggers(using)
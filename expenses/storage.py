@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.functional import cached_property
+
+
+class ReceiptStorage(FileSystemStorage):
+    """
+    Local storage for receipts under RECEIPT_ROOT, outside MEDIA_ROOT, so
+    receipts are only served through the expense receipt endpoint.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.RECEIPT_ROOT)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'RECEIPT_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+
+receipt_storage = ReceiptStorage()
+
+
+def get_receipt_storage():
+    # Referenced by the receipt file fields and their migration
+    return receipt_storage
@@ -0,0 +1,89 @@
+from decimal import Decimal
+from django.db.models.functions import TruncMonth
+from .fx import sum_converted
+from .rollups import sum_rollups
+
+# Breakdowns that can be requested with ?breakdown=category,month
+SUMMARY_BREAKDOWNS = ('category', 'month')
+
+TWO_PLACES = Decimal('0.01')
+
+
+def _quantize(value):
+    """
+    Round aggregate amounts to the precision of Expense.amount.
+    """
+    if value is None:
+        return None
+    return Decimal(value).quantize(TWO_PLACES)
+
+
+def parse_breakdowns(value):
+    """
+    Parse a comma separated ?breakdown= parameter into known breakdown names.
+    """
+    if not value:
+        return []
+    requested = [item.strip().lower() for item in value.split(',')]
+    return [item for item in SUMMARY_BREAKDOWNS if item in requested]
+
+
+def _sum_breakdown(queryset, field, currency):
+    """
+    Count and total of the queryset per value of `field`. Unfiltered
+    querysets are summed from the monthly rollups, which hold every
+    expense per month and category already.
+    """
+    if not queryset.query.has_filters():
+        return sum_rollups(queryset, field, currency)
+    if field == 'month':
+        queryset = queryset.annotate(month=TruncMonth('created_at'))
+    return sum_converted(queryset, (field,), currency)
+
+
+def summarize_expenses(queryset, currency, breakdowns=()):
+    """
+    Summarize an expense queryset in `currency` with grouped SQL aggregates.
+
+    Returns the total, count, min, max and average amount of the queryset,
+    plus the requested per-category and per-month breakdowns, each of which
+    is one grouped query, over the monthly rollups when the queryset is
+    not filtered. Amounts in other currencies are summed per
+    currency and date in SQL and converted with cached FX rates, so no
+    expense rows are loaded into Python and no rate is looked up per row.
+    """
+    totals = sum_converted(queryset, (), currency).get(()) or {
+        'count': 0, 'total_amount': None, 'min_amount': None, 'max_amount': None,
+    }
+    summary = {
+        'currency': currency,
+        'total_amount': _quantize(totals['total_amount']) or Decimal('0.00'),
+        'count': totals['count'],
+        'min_amount': _quantize(totals['min_amount']),
+        'max_amount': _quantize(totals['max_amount']),
+        'average_amount': _quantize(totals['total_amount'] / totals['count']) if totals['count'] else None,
+    }
+
+    if 'category' in breakdowns:
+        rows = _sum_breakdown(queryset, 'category', currency)
+        summary['by_category'] = [
+            {
+                'category': category,
+                'count': row['count'],
+                'total_amount': _quantize(row['total_amount']),
+            }
+            for (category,), row in sorted(rows.items())
+        ]
+
+    if 'month' in breakdowns:
+        rows = _sum_breakdown(queryset, 'month', currency)
+        summary['by_month'] = [
+            {
+                'month': month.strftime('%Y-%m'),
+                'count': row['count'],
+                'total_amount': _quantize(row['total_amount']),
+            }
+            for (month,), row in sorted(rows.items())
+        ]
+
+    return summary
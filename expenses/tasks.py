@@ -1,78 +1,327 @@
 import csv
+import time
+from django.conf import settings
 from django.core.mail import EmailMessage
+from django.db.models import F, Q
+from django.db.models.functions import Mod
 from django.utils import timezone
-from django.contrib.auth import get_user_model
 from io import StringIO
+from itertools import groupby
+from operator import itemgetter
 from datetime import timedelta
-from .models import Expense
+from decimal import Decimal
+from jobs.registry import task
+from travel_expense_management import metrics
+from .dispatch import EmailDispatcher
+from .fx import MissingRateError, get_rate_cache
+from .models import Expense, MonthlyReportFailure, MonthlyReportRun
+from .receipts import process_pending_receipts, prune_receipts
 import logging
 
 logger = logging.getLogger(__name__)
 
-def generate_monthly_expense_report():
+# Rows fetched per database round-trip while streaming the month
+REPORT_CHUNK_SIZE = 2000
+
+REPORT_FIELDS = (
+    'user_id', 'user__username', 'user__email', 'user__base_currency',
+    'category', 'description', 'amount', 'currency', 'created_at',
+)
+
+CENTS = Decimal('0.01')
+
+# Seconds without a checkpoint after which a running report run is
+# assumed lost and another worker may take it over
+DEFAULT_RUN_LEASE_SECONDS = 900
+
+
+def get_report_period(today=None):
     """
-    Generate a monthly expense report for all users and send it by email.
-    This can be scheduled with Django-crontab or Celery.
-    """
-    logger.info("Starting monthly expense report generation")
-    
-    User = get_user_model()
-    users = User.objects.all()
-    
-    # Get the first day of previous month
-    today = timezone.now()
-    first_day = today.replace(day=1)
+    Return (start_date, end_date) covering the previous calendar month.
+    """
+    today = today or timezone.now()
+    first_day = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     last_month = first_day - timedelta(days=1)
     start_date = last_month.replace(day=1)
-    
-    for user in users:
-        # Get expenses for the previous month
-        expenses = Expense.objects.filter(
-            user=user,
-            created_at__gte=start_date,
-            created_at__lt=first_day
-        ).order_by('category', 'created_at')
-        
-        if not expenses:
-            logger.info(f"No expenses found for user {user.username} in the last month")
-            continue
-            
-        # Create CSV file
-        csv_buffer = StringIO()
-        writer = csv.writer(csv_buffer)
-        writer.writerow(['Category', 'Description', 'Amount', 'Date'])
-        
-        total_amount = 0
-        for expense in expenses:
-            writer.writerow([
-                expense.category,
-                expense.description,
-                str(expense.amount),
-                expense.created_at.strftime('%Y-%m-%d')
-            ])
-            total_amount += expense.amount
-            
-        writer.writerow(['', 'Total', str(total_amount), ''])
-        
-        # Send email with report
-        subject = f'Expense Report for {last_month.strftime("%B %Y")}'
-        message = f'Please find attached your expense report for {last_month.strftime("%B %Y")}.'
-        email = EmailMessage(
-            subject,
-            message,
-            'expenses@yourcompany.com',
-            [user.email],
+    return start_date, first_day
+
+
+def iter_monthly_expenses(start_date, end_date, chunk_size=REPORT_CHUNK_SIZE,
+                          after_user_id=None, shard_index=0, shard_count=1, skip_user_ids=()):
+    """
+    Stream the month's expenses grouped by user.
+
+    Runs a single query ordered by (user_id, category, created_at) and
+    yields (user_id, username, email, rows) per user while the rows are
+    still being fetched, so only one chunk is held in memory. Users
+    without expenses never appear. after_user_id resumes after a
+    checkpoint, skipping skip_user_ids, and shard_index/shard_count
+    restrict the run to the users with user_id % shard_count == shard_index.
+    """
+    queryset = Expense.objects.filter(created_at__gte=start_date, created_at__lt=end_date)
+    if after_user_id is not None:
+        queryset = queryset.filter(user_id__gt=after_user_id)
+    if skip_user_ids:
+        queryset = queryset.exclude(user_id__in=skip_user_ids)
+    if shard_count > 1:
+        queryset = queryset.alias(shard=Mod('user_id', shard_count)).filter(shard=shard_index)
+
+    rows = (
+        queryset.order_by('user_id', 'category', 'created_at')
+        .values_list(*REPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    for user_id, user_rows in groupby(rows, key=itemgetter(0)):
+        first = next(user_rows)
+        yield user_id, first[1], first[2], _chain_first(first, user_rows)
+
+
+def _chain_first(first, rest):
+    yield first
+    yield from rest
+
+
+def build_report_csv(rows, rates=None):
+    """
+    Render a user's expense rows into CSV and return (csv_text, row_count).
+
+    Amounts and the total are in the user's base currency, converted at
+    the rate of each expense's date through the rate cache; preload it to
+    keep conversions from querying. Foreign currency rows also show the
+    original amount and currency.
+    """
+    rates = rates or get_rate_cache()
+    csv_buffer = StringIO()
+    writer = csv.writer(csv_buffer)
+    writer.writerow(['Category', 'Description', 'Amount', 'Date', 'Original Amount', 'Original Currency'])
+
+    total_amount = 0
+    row_count = 0
+    for _, _, _, base_currency, category, description, amount, currency, created_at in rows:
+        original = ['', '']
+        if currency != base_currency:
+            original = [str(amount), currency]
+            day = timezone.localtime(created_at).date()
+            amount = rates.convert(amount, currency, base_currency, day).quantize(CENTS)
+        writer.writerow([
+            category,
+            description,
+            str(amount),
+            created_at.strftime('%Y-%m-%d'),
+            *original,
+        ])
+        total_amount += amount
+        row_count += 1
+
+    writer.writerow(['', 'Total', str(total_amount), ''])
+    return csv_buffer.getvalue(), row_count
+
+
+def build_report_email(email_address, report_csv, start_date):
+    """
+    Build the monthly report email with the CSV attached.
+    """
+    subject = f'Expense Report for {start_date.strftime("%B %Y")}'
+    message = f'Please find attached your expense report for {start_date.strftime("%B %Y")}.'
+    email = EmailMessage(
+        subject,
+        message,
+        'expenses@yourcompany.com',
+        [email_address],
+    )
+    email.attach(
+        f'expense_report_{start_date.strftime("%Y_%m")}.csv',
+        report_csv,
+        'text/csv'
+    )
+    return email
+
+
+def claim_report_run(start_date, shard_index=0, shard_count=1, now=None):
+    """
+    Claim the checkpoint record for a month and shard, creating it if
+    needed, and return it. Returns None when the run is completed or
+    another worker holds it.
+
+    An existing run is claimed with one conditional UPDATE that requires it
+    not to be running, or to have gone REPORT_RUN_LEASE_SECONDS without a
+    checkpoint, so two workers never generate the same shard at once.
+    """
+    now = now or timezone.now()
+    run, created = MonthlyReportRun.objects.get_or_create(
+        month=start_date.date(),
+        shard_index=shard_index,
+        shard_count=shard_count,
+    )
+    if created:
+        return run
+    if run.status == 'completed':
+        logger.info(f"{run} already completed, skipping")
+        return None
+
+    lease = timedelta(seconds=getattr(settings, 'REPORT_RUN_LEASE_SECONDS', DEFAULT_RUN_LEASE_SECONDS))
+    claimed = (
+        MonthlyReportRun.objects.filter(pk=run.pk)
+        .exclude(status='completed')
+        .filter(~Q(status='running') | Q(updated_at__lt=now - lease))
+        .update(status='running', finished_at=None, updated_at=now)
+    )
+    if not claimed:
+        logger.info(f"{run} is being generated by another worker, skipping")
+        return None
+    run.refresh_from_db()
+    return run
+
+
+@task('expenses.monthly_expense_report')
+def generate_monthly_expense_report(today=None, chunk_size=REPORT_CHUNK_SIZE, dispatcher=None,
+                                    shard_index=0, shard_count=1):
+    """
+    Generate a monthly expense report for all users and send it by email.
+    Runs as the `expenses.monthly_expense_report` background job, see
+    JOB_SCHEDULES.
+
+    The whole month is read with one chunked query grouped by user while
+    streaming, with the FX rates of the month preloaded in one query for
+    converting amounts into each user's base currency, and the emails
+    are handed to an EmailDispatcher which sends
+    them in batches over reused connections. Progress is checkpointed in a
+    MonthlyReportRun after every completed batch, so rerunning after a
+    crash emails only the users whose batch never completed, and a
+    completed run is not repeated. A run is claimed atomically before it
+    starts; a worker that finds it held by another returns at once. Emails that still fail after the
+    dispatcher's retries are recorded as MonthlyReportFailure rows, as are
+    reports with an amount that has no FX rate; the other users still get
+    theirs.
+    Several shards of the user id space can run concurrently in separate
+    processes. Returns run statistics including rows/sec and users/sec.
+    """
+    start_date, end_date = get_report_period(today)
+    stats = {'users': 0, 'rows': 0, 'emails_sent': 0, 'emails_failed': 0}
+    run = claim_report_run(start_date, shard_index, shard_count)
+    if run is None:
+        return stats
+
+    if run.last_user_id is not None:
+        logger.info(f"Resuming {run} after user {run.last_user_id}")
+    else:
+        logger.info(f"Starting monthly expense report generation: {run}")
+
+    dispatcher = dispatcher or EmailDispatcher()
+    rates = get_rate_cache()
+    # Local dates of the month's expenses, whatever the time zone
+    rates.preload((start_date - timedelta(days=1)).date(), end_date.date())
+    started = time.monotonic()
+    # message -> (user_id, row_count) for every message handed to the
+    # dispatcher and not yet reported back, in submission order
+    pending = {}
+    handled_user_ids = list(run.handled_user_ids)
+
+    def record_unconvertible(user_id, email_address, exc):
+        MonthlyReportFailure.objects.create(run=run, user_id=user_id, error=str(exc))
+        MonthlyReportRun.objects.filter(pk=run.pk).update(
+            users_processed=F('users_processed') + 1,
+            emails_failed=F('emails_failed') + 1,
+            updated_at=timezone.now(),
         )
-        email.attach(
-            f'expense_report_{last_month.strftime("%Y_%m")}.csv',
-            csv_buffer.getvalue(),
-            'text/csv'
+        stats['users'] += 1
+        stats['emails_failed'] += 1
+        metrics.REPORT_USERS.inc(1)
+        metrics.REPORT_EMAILS.inc(1, result='failed')
+        logger.error(f"Could not build the expense report of {email_address}: {exc}")
+
+    def build_messages():
+        users = iter_monthly_expenses(
+            start_date, end_date, chunk_size,
+            after_user_id=run.last_user_id,
+            shard_index=shard_index,
+            shard_count=shard_count,
+            skip_user_ids=handled_user_ids,
         )
-        
-        try:
-            email.send()
-            logger.info(f"Expense report sent to {user.email}")
-        except Exception as e:
-            logger.error(f"Failed to send expense report to {user.email}: {str(e)}")
-            
-    logger.info("Monthly expense report generation completed")
\ No newline at end of file
+        for user_id, username, email_address, rows in users:
+            try:
+                report_csv, row_count = build_report_csv(rows, rates)
+            except MissingRateError as exc:
+                # One unconvertible amount must not hold up everyone else's report
+                record_unconvertible(user_id, email_address, exc)
+                continue
+            message = build_report_email(email_address, report_csv, start_date)
+            pending[message] = (user_id, row_count)
+            yield message
+
+    try:
+        for result in dispatcher.iter_dispatch(build_messages()):
+            # Batches come back in submission order unless an earlier batch
+            # failed; only a batch that continues the checkpointed prefix
+            # moves last_user_id, the users of the others are kept aside
+            contiguous = next(iter(pending)) is result.messages[0]
+            batch = [pending.pop(message) for message in result.messages]
+            batch_rows = sum(row_count for _, row_count in batch)
+            if contiguous:
+                checkpoint = {'last_user_id': batch[-1][0]}
+            else:
+                handled_user_ids.extend(user_id for user_id, _ in batch)
+                checkpoint = {'handled_user_ids': handled_user_ids}
+            user_ids = {message: user_id for message, (user_id, _) in zip(result.messages, batch)}
+            MonthlyReportFailure.objects.bulk_create([
+                MonthlyReportFailure(run=run, user_id=user_ids[message], error=error)
+                for message, error in result.failed
+            ])
+            MonthlyReportRun.objects.filter(pk=run.pk).update(
+                users_processed=F('users_processed') + len(batch),
+                rows_processed=F('rows_processed') + batch_rows,
+                emails_sent=F('emails_sent') + len(result.sent),
+                emails_failed=F('emails_failed') + len(result.failed),
+                # Renews the lease; update() does not touch auto_now fields
+                updated_at=timezone.now(),
+                **checkpoint,
+            )
+            stats['users'] += len(batch)
+            stats['rows'] += batch_rows
+            stats['emails_sent'] += len(result.sent)
+            stats['emails_failed'] += len(result.failed)
+            metrics.REPORT_USERS.inc(len(batch))
+            metrics.REPORT_ROWS.inc(batch_rows)
+            metrics.REPORT_EMAILS.inc(len(result.sent), result='sent')
+            metrics.REPORT_EMAILS.inc(len(result.failed), result='failed')
+            for message, error in result.failed:
+                logger.error(f"Failed to send expense report to {', '.join(message.recipients())}: {error}")
+    except Exception:
+        MonthlyReportRun.objects.filter(pk=run.pk).update(status='failed', updated_at=timezone.now())
+        metrics.REPORT_RUNS.inc(status='failed')
+        logger.exception(f"Monthly expense report generation failed: {run}")
+        raise
+
+    MonthlyReportRun.objects.filter(pk=run.pk).update(
+        status='completed', finished_at=timezone.now(), updated_at=timezone.now()
+    )
+    metrics.REPORT_RUNS.inc(status='completed')
+
+    elapsed = time.monotonic() - started
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    stats['rows_per_second'] = round(stats['rows'] / elapsed, 1) if elapsed else 0.0
+    stats['users_per_second'] = round(stats['users'] / elapsed, 1) if elapsed else 0.0
+
+    logger.info(
+        f"Monthly expense report generation completed: {stats['users']} users, "
+        f"{stats['rows']} rows in {stats['elapsed_seconds']}s "
+        f"({stats['rows_per_second']} rows/s, {stats['users_per_second']} users/s), "
+        f"{stats['emails_sent']} emails sent, {stats['emails_failed']} failed"
+    )
+    return stats
+
+
+@task('expenses.process_pending_receipts')
+def process_pending_receipts_job():
+    """
+    Generate the metadata of receipts whose background processing was lost.
+    """
+    return {'processed': process_pending_receipts()}
+
+
+@task('expenses.prune_receipts')
+def prune_receipts_job():
+    """
+    Delete receipts that no expense refers to any more.
+    """
+    return {'deleted': prune_receipts()}
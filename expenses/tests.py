@@ -1,3 +1,1373 @@
-from django.test import TestCase
+import base64
+import csv
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock
+from decimal import Decimal
+from django.conf import settings
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from travel_expense_management import metrics
+from travel_expense_management.instrumentation import QueryBudgetExceeded
+from travel_expense_management.parsers import FastJSONParser
+from travel_expense_management.renderers import FastJSONRenderer
+from reports.models import WeeklyReport
+from reports.totals import compute_report_total, recompute_report_totals
+from trips.models import Trip
+from users.models import CustomUser
+from .cache import get_cache
+from .checks import check_response_cache
+from .dispatch import EmailDispatcher
+from .fx import MissingRateError, RateCache, bump_rates_generation, get_rate_cache
+from .models import Expense, ExpenseMonthlyRollup, FxRate, MonthlyReportFailure, MonthlyReportRun, Receipt
+from .pagination import ExpenseKeysetPagination
+from .receipts import process_receipt, prune_receipts
+from .rollups import verify_rollups
+from .serializers import EXPENSE_LIST_FIELDS, ExpenseSerializer, serialize_expense_rows
+from .signals import expenses_bulk_created
+from .summary import summarize_expenses
+from .tasks import build_report_csv, generate_monthly_expense_report, iter_monthly_expenses
+from .timeline import build_timeline
+
+
+class CountingBackend(EmailBackend):
+    """
+    locmem backend that counts opened connections and can fail the first
+    attempts for given recipients.
+    """
+    opened = 0
+    failures = {}
+    open_failures = 0
+
+    def open(self):
+        if CountingBackend.open_failures > 0:
+            CountingBackend.open_failures -= 1
+            raise ConnectionRefusedError('Connection refused')
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            recipient = message.to[0]
+            if CountingBackend.failures.get(recipient, 0) > 0:
+                CountingBackend.failures[recipient] -= 1
+                raise ConnectionError('Temporary failure')
+        return super().send_messages(messages)
+
+
+def build_messages(count):
+    return [
+        EmailMessage('Subject', 'Body', 'expenses@yourcompany.com', [f'user{index}@example.com'])
+        for index in range(count)
+    ]
+
+
+class EmailDispatcherTests(TestCase):
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.failures = {}
+        CountingBackend.open_failures = 0
+        self.dispatcher = EmailDispatcher(
+            batch_size=10,
+            max_workers=3,
+            backoff=0,
+            connection_factory=CountingBackend,
+        )
+
+    def test_reuses_one_connection_per_batch(self):
+        summary = self.dispatcher.dispatch(build_messages(25))
+
+        self.assertEqual(summary['sent'], 25)
+        self.assertEqual(summary['failed'], 0)
+        self.assertEqual(summary['batches'], 3)
+        self.assertEqual(CountingBackend.opened, 3)
+        self.assertEqual(len(mail.outbox), 25)
+
+    def test_retries_failed_messages(self):
+        CountingBackend.failures = {'user3@example.com': 2}
+
+        summary = self.dispatcher.dispatch(build_messages(5))
+
+        self.assertEqual(summary['sent'], 5)
+        self.assertEqual(summary['failed'], 0)
+
+    def test_reports_messages_that_keep_failing(self):
+        CountingBackend.failures = {'user1@example.com': 10}
+
+        summary = self.dispatcher.dispatch(build_messages(5))
+
+        self.assertEqual(summary['sent'], 4)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['failures'][0]['recipients'], ['user1@example.com'])
+
+    def test_retries_opening_the_connection(self):
+        CountingBackend.open_failures = 2
+
+        summary = self.dispatcher.dispatch(build_messages(5))
+
+        self.assertEqual((summary['sent'], summary['failed']), (5, 0))
+
+    def test_batch_fails_without_raising_when_connection_never_opens(self):
+        CountingBackend.open_failures = 100
+
+        summary = self.dispatcher.dispatch(build_messages(15))
+
+        self.assertEqual((summary['sent'], summary['failed']), (0, 15))
+        self.assertEqual(summary['failures'][0]['error'], 'Connection refused')
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class CrashingDispatcher(EmailDispatcher):
+    """
+    Dispatcher that fails the batch containing a given recipient.
+    """
+
+    def __init__(self, crash_on, **kwargs):
+        super().__init__(**kwargs)
+        self.crash_on = crash_on
+
+    def send_batch(self, messages):
+        if any(self.crash_on in message.to for message in messages):
+            raise RuntimeError('Worker crashed')
+        return super().send_batch(messages)
+
+
+class MonthlyExpenseReportTests(TestCase):
+    today = datetime(2025, 4, 2, tzinfo=dt_timezone.utc)
+
+    def create_users(self, count, expenses_per_user):
+        for index in range(count):
+            user = CustomUser.objects.create_user(
+                username=f'user{index}', email=f'user{index}@example.com', employee_id=f'E{index}'
+            )
+            for _ in range(expenses_per_user(index)):
+                expense = Expense.objects.create(user=user, category='food', description='Lunch', amount=Decimal('12.50'))
+                Expense.objects.filter(pk=expense.pk).update(created_at=datetime(2025, 3, 10, tzinfo=dt_timezone.utc))
+
+    def test_sends_one_report_per_user_with_expenses(self):
+        self.create_users(3, lambda index: index)
+
+        stats = generate_monthly_expense_report(today=self.today)
+
+        self.assertEqual(stats['users'], 2)
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(stats['emails_sent'], 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['user1@example.com', 'user2@example.com'])
+        self.assertIn(',Total,25.00,', mail.outbox[1].attachments[0][1])
+
+    def test_resumes_after_last_delivered_user(self):
+        self.create_users(6, lambda index: 1)
+        dispatcher = CrashingDispatcher('user4@example.com', batch_size=2, max_workers=1)
+
+        with self.assertRaises(RuntimeError):
+            generate_monthly_expense_report(today=self.today, dispatcher=dispatcher)
+
+        run = MonthlyReportRun.objects.get()
+        self.assertEqual(run.status, 'failed')
+        self.assertEqual(run.users_processed, 4)
+        self.assertEqual(len(mail.outbox), 4)
+
+        stats = generate_monthly_expense_report(today=self.today)
+
+        run.refresh_from_db()
+        self.assertEqual(stats['users'], 2)
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(run.users_processed, 6)
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(len(recipients), len(set(recipients)))
+        self.assertEqual(len(recipients), 6)
+
+        stats = generate_monthly_expense_report(today=self.today)
+        self.assertEqual(stats['users'], 0)
+        self.assertEqual(len(mail.outbox), 6)
+
+    def test_batches_in_flight_after_a_failure_are_not_resent(self):
+        self.create_users(8, lambda index: 1)
+        # Batches 1-4 of two users are in flight together; batch 2 fails
+        # while 3 and 4 still send theirs
+        dispatcher = CrashingDispatcher('user2@example.com', batch_size=2, max_workers=2)
+
+        with self.assertRaises(RuntimeError):
+            generate_monthly_expense_report(today=self.today, dispatcher=dispatcher)
+
+        run = MonthlyReportRun.objects.get()
+        self.assertEqual((run.status, run.users_processed), ('failed', 6))
+        self.assertEqual(len(mail.outbox), 6)
+
+        for _ in range(2):
+            generate_monthly_expense_report(today=self.today)
+
+        recipients = sorted(message.to[0] for message in mail.outbox)
+        self.assertEqual(recipients, sorted(f'user{index}@example.com' for index in range(8)))
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.users_processed), ('completed', 8))
+
+    def test_undeliverable_reports_are_recorded(self):
+        self.create_users(3, lambda index: 1)
+        CountingBackend.failures = {'user1@example.com': 10}
+        dispatcher = EmailDispatcher(backoff=0, connection_factory=CountingBackend)
+        self.addCleanup(setattr, CountingBackend, 'failures', {})
+
+        stats = generate_monthly_expense_report(today=self.today, dispatcher=dispatcher)
+
+        self.assertEqual((stats['emails_sent'], stats['emails_failed']), (2, 1))
+        failure = MonthlyReportFailure.objects.get()
+        self.assertEqual((failure.user.email, failure.error), ('user1@example.com', 'Temporary failure'))
+        self.assertEqual(MonthlyReportRun.objects.get().status, 'completed')
+
+    def test_shards_split_users(self):
+        self.create_users(5, lambda index: 1)
+
+        for shard_index in range(2):
+            generate_monthly_expense_report(today=self.today, shard_index=shard_index, shard_count=2)
+
+        runs = MonthlyReportRun.objects.order_by('shard_index')
+        self.assertEqual([run.users_processed for run in runs], [2, 3])
+        self.assertEqual(len({message.to[0] for message in mail.outbox}), 5)
+
+    def test_run_held_by_another_worker_is_skipped_until_its_lease_expires(self):
+        self.create_users(2, lambda index: 1)
+        run = MonthlyReportRun.objects.create(month=date(2025, 3, 1), status='running')
+
+        stats = generate_monthly_expense_report(today=self.today)
+
+        self.assertEqual(stats['users'], 0)
+        self.assertEqual(len(mail.outbox), 0)
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'running')
+
+        stale = timezone.now() - timedelta(seconds=settings.REPORT_RUN_LEASE_SECONDS + 1)
+        MonthlyReportRun.objects.filter(pk=run.pk).update(updated_at=stale)
+
+        stats = generate_monthly_expense_report(today=self.today)
+
+        self.assertEqual(stats['users'], 2)
+        self.assertEqual(len(mail.outbox), 2)
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'completed')
+
+
+class ExpenseRollupTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='roller', email='roller@example.com', employee_id='E1')
+        self.other = CustomUser.objects.create_user(username='other', email='other@example.com', employee_id='E2')
+
+    def expense(self, amount, category='food', **fields):
+        return Expense.objects.create(user=self.user, category=category, description='Meal', amount=Decimal(amount), **fields)
+
+    def rollups(self):
+        return {
+            (row.user_id, row.month, row.category, row.currency): (row.count, row.total_amount)
+            for row in ExpenseMonthlyRollup.objects.all()
+        }
+
+    def assertMatchesRebuild(self):
+        self.assertEqual(verify_rollups(), [])
+        rollups = self.rollups()
+        call_command('rebuild_expense_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_saves_and_deletes_apply_deltas(self):
+        month = timezone.localdate().replace(day=1)
+        lunch = self.expense('10.00')
+        dinner = self.expense('25.00')
+        self.assertEqual(self.rollups(), {(self.user.id, month, 'food', 'USD'): (2, Decimal('35.00'))})
+
+        lunch.amount = Decimal('12.00')
+        lunch.save()
+        dinner.category = 'misc'
+        dinner.currency = 'EUR'
+        dinner.save()
+        self.assertEqual(self.rollups(), {
+            (self.user.id, month, 'food', 'USD'): (1, Decimal('12.00')),
+            (self.user.id, month, 'misc', 'EUR'): (1, Decimal('25.00')),
+        })
+        self.assertMatchesRebuild()
+
+        lunch.delete()
+        Expense.objects.filter(pk=dinner.pk).delete()
+        self.assertEqual(self.rollups(), {})
+        self.assertMatchesRebuild()
+
+    def test_deferred_instances_read_their_stored_state_once(self):
+        trip = Trip.objects.create(user=self.user, name='Oslo', start_date=date(2025, 3, 1), end_date=date(2025, 3, 7))
+        expense = self.expense('10.00', trip=trip)
+        loaded = Expense.objects.only('id', 'description').get(pk=expense.pk)
+        loaded.amount = Decimal('12.00')
+
+        with CaptureQueriesContext(connection) as queries:
+            loaded.save()
+
+        # One snapshot feeds both the rollups and the trip counters
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and '"expenses_expense"' in query['sql']]
+        self.assertEqual(len(reads), 1)
+        trip.refresh_from_db()
+        self.assertEqual((trip.expense_count, trip.spent_amount), (1, Decimal('12.00')))
+        self.assertMatchesRebuild()
+
+    def test_bulk_created_expenses_are_rolled_up(self):
+        expenses = [
+            Expense(user=user, category='food', description='Meal', amount=Decimal('5.00'))
+            for user in (self.user, self.user, self.other)
+        ]
+        Expense.objects.bulk_create(expenses)
+        expenses_bulk_created.send(sender=Expense, expenses=expenses)
+
+        month = timezone.localdate().replace(day=1)
+        self.assertEqual(self.rollups(), {
+            (self.user.id, month, 'food', 'USD'): (2, Decimal('10.00')),
+            (self.other.id, month, 'food', 'USD'): (1, Decimal('5.00')),
+        })
+        self.assertMatchesRebuild()
+
+    def test_queryset_updates_move_the_contributions(self):
+        expenses = [self.expense('10.00'), self.expense('20.00'), self.expense('30.00', category='misc')]
+        march = datetime(2025, 3, 15, 12, tzinfo=dt_timezone.utc)
+
+        Expense.objects.filter(category='food').update(created_at=march)
+        Expense.objects.filter(pk=expenses[2].pk).update(user=self.other, amount=Decimal('35.00'))
+        Expense.objects.filter(pk=expenses[0].pk).update(amount=F('amount') * 2)
+        # Fields the rollups do not depend on are updated as before
+        with self.assertNumQueries(1):
+            Expense.objects.update(description='Renamed')
+
+        self.assertEqual(self.rollups(), {
+            (self.user.id, date(2025, 3, 1), 'food', 'USD'): (2, Decimal('40.00')),
+            (self.other.id, timezone.localdate().replace(day=1), 'misc', 'USD'): (1, Decimal('35.00')),
+        })
+        self.assertMatchesRebuild()
+
+    def test_queryset_updates_group_rows_instead_of_listing_them(self):
+        for _ in range(5):
+            self.expense('10.00')
+
+        with CaptureQueriesContext(connection) as queries:
+            Expense.objects.filter(category='food').update(category='meals')
+
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and '"expenses_expense"' in query['sql']]
+        # One grouped read for all five rows, no list of primary keys
+        self.assertEqual(len(reads), 1)
+        self.assertIn('GROUP BY', reads[0])
+        self.assertFalse(any(' IN (' in query['sql'] for query in queries))
+        month = timezone.localdate().replace(day=1)
+        self.assertEqual(self.rollups(), {(self.user.id, month, 'meals', 'USD'): (5, Decimal('50.00'))})
+        self.assertMatchesRebuild()
+
+    def test_rebuild_repairs_drift(self):
+        self.expense('10.00')
+        ExpenseMonthlyRollup.objects.update(count=5)
+        self.assertEqual(len(verify_rollups()), 1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_expense_rollups', '--verify-only', stdout=StringIO())
+        call_command('rebuild_expense_rollups', stdout=StringIO())
+        self.assertEqual(verify_rollups(), [])
+
+
+class BulkIngestionTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = CustomUser.objects.create_user(username='bulk', email='bulk@example.com', employee_id='E1')
+        self.other = CustomUser.objects.create_user(username='other', email='other@example.com', employee_id='E2')
+        self.trip = Trip.objects.create(user=self.user, name='Oslo', start_date=date(2025, 3, 1), end_date=date(2025, 3, 7))
+        self.client = APIClient()
+
+    def row(self, **fields):
+        return {'user': self.user.id, 'trip': self.trip.id, 'category': 'food', 'description': 'Meal', 'amount': '10.00', **fields}
+
+    def post(self, rows, batch_size=None):
+        url = '/expenses/bulk/' if batch_size is None else f'/expenses/bulk/?batch_size={batch_size}'
+        return self.client.post(url, rows, format='json')
+
+    def test_invalid_rows_are_reported_by_index(self):
+        response = self.post([
+            self.row(),
+            self.row(category='souvenirs'),
+            self.row(amount='-5.00'),
+            self.row(user=None, trip=None),
+            self.row(user=9999),
+            self.row(user=self.other.id),
+            self.row(amount='2.50', trip=None),
+        ])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(sorted(Expense.objects.values_list('id', flat=True)), sorted(data['ids']))
+        errors = {error['index']: error['errors'] for error in data['errors']}
+        self.assertEqual(sorted(errors), [1, 2, 3, 4, 5])
+        self.assertIn('category', errors[1])
+        self.assertEqual(errors[2], {'detail': 'Amount must be positive.'})
+        self.assertEqual(errors[3], {'user': ['This field is required.']})
+        self.assertIn('user', errors[4])
+        self.assertEqual(errors[5], {'trip': ['Trip belongs to another user.']})
+
+    def test_payload_errors(self):
+        self.assertEqual(self.post(self.row()).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        response = self.post([self.row(amount='0')])
+        self.assertEqual((response.status_code, response.json()['created']), (400, 0))
+
+    def test_ndjson_body(self):
+        body = '\n'.join([json.dumps(self.row()), '', json.dumps(self.row(amount='5.00')), ''])
+        response = self.client.post('/expenses/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+
+        body = json.dumps(self.row()) + '\n{"user": '
+        response = self.client.post('/expenses/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 2', response.json()['detail'])
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_users_and_trips_are_preloaded(self):
+        def queries(count):
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.post([self.row() for _ in range(count)], batch_size=1000).status_code, 201)
+            return len(captured)
+
+        queries(1)
+        # Same users, trip and rollup rows: the row count does not matter
+        self.assertEqual(queries(2), queries(40))
+
+    def test_created_expenses_update_rollups_and_trip_counters(self):
+        self.post([self.row(), self.row(amount='15.00'), self.row(category='misc', trip=None)], batch_size=2)
+
+        month = timezone.localdate().replace(day=1)
+        self.assertEqual(
+            {(row.category, row.count, row.total_amount) for row in ExpenseMonthlyRollup.objects.filter(user=self.user, month=month)},
+            {('food', 2, Decimal('25.00')), ('misc', 1, Decimal('10.00'))},
+        )
+        self.trip.refresh_from_db()
+        self.assertEqual((self.trip.expense_count, self.trip.spent_amount), (2, Decimal('25.00')))
+        self.assertEqual(verify_rollups(), [])
+
+
+class ExpenseListSerializationTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = CustomUser.objects.create_user(username='lean', email='lean@example.com', employee_id='E1')
+        for amount in ('12.5', '0.01', '1234567890.99', '7'):
+            Expense.objects.create(user=self.user, category='travel', description='Taxi "airport" – €', amount=Decimal(amount))
+        Expense.objects.create(user=self.user, category='other', amount=Decimal('3.10'))
+
+    def test_rows_match_model_serializer(self):
+        queryset = Expense.objects.order_by('id')
+        expected = JSONRenderer().render(ExpenseSerializer(queryset, many=True).data)
+        actual = JSONRenderer().render(serialize_expense_rows(queryset.values(*EXPENSE_LIST_FIELDS)))
+        self.assertEqual(actual, expected)
+
+    def test_list_endpoint_uses_same_representation(self):
+        response = APIClient().get('/expenses/', {'page_size': 2, 'ordering': 'amount'})
+        self.assertEqual(response.status_code, 200)
+        queryset = Expense.objects.order_by('amount', 'id')
+        self.assertEqual(response.json()['results'], ExpenseSerializer(queryset[:2], many=True).data)
+
+        response = APIClient().get(response.json()['next'])
+        self.assertEqual(response.json()['results'], ExpenseSerializer(queryset[2:4], many=True).data)
+
+
+class ExpenseKeysetPaginationTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='pager', email='pager@example.com', employee_id='E1')
+        self.expenses = [
+            Expense.objects.create(user=self.user, category='other', description=f'Row {index}', amount=Decimal(index % 3))
+            for index in range(7)
+        ]
+
+    def page(self, url='/expenses/', **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, **params):
+        ids = []
+        data = self.page(page_size=3, **params)
+        while True:
+            ids.extend(row['id'] for row in data['results'])
+            if not data['next']:
+                return ids, data
+            data = self.page(data['next'])
+
+    def test_next_and_previous_links_round_trip(self):
+        first = self.page(page_size=3)
+        self.assertIsNone(first['previous'])
+        second = self.page(first['next'])
+        third = self.page(second['next'])
+        self.assertIsNone(third['next'])
+
+        expected = [expense.id for expense in reversed(self.expenses)]
+        pages = [first, second, third]
+        self.assertEqual([row['id'] for page in pages for row in page['results']], expected)
+
+        # Walking back returns the same pages
+        self.assertEqual(self.page(third['previous'])['results'], second['results'])
+        back = self.page(second['previous'])
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_equal_created_at_is_broken_by_id(self):
+        Expense.objects.update(created_at=datetime(2025, 3, 10, 12, 0, tzinfo=dt_timezone.utc))
+        ids, _ = self.walk()
+        self.assertEqual(ids, sorted((expense.id for expense in self.expenses), reverse=True))
+
+        # Duplicate amounts page in ascending id order for an ascending ordering
+        ids, _ = self.walk(ordering='amount')
+        self.assertEqual(ids, [expense.id for expense in sorted(self.expenses, key=lambda e: (e.amount, e.id))])
+
+    def test_rows_added_while_paging_are_not_repeated(self):
+        first = self.page(page_size=3)
+        Expense.objects.create(user=self.user, category='other', description='Newest', amount=Decimal('1.00'))
+        second = self.page(first['next'])
+        self.assertEqual([row['id'] for row in second['results']], [expense.id for expense in self.expenses[3:0:-1]])
+
+    def test_invalid_and_tampered_cursors_are_not_found(self):
+        next_url = self.page(page_size=3)['next']
+        token = next_url.split('cursor=')[1].split('&')[0]
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+
+        def encode(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+        cursors = [
+            'not-a-cursor',
+            encode({key: value for key, value in payload.items() if key != 'p'}),
+            encode({**payload, 'p': payload['p'][:1]}),
+            encode({**payload, 'p': ['yesterday', payload['p'][1]]}),
+            encode({**payload, 'o': ['-amount', '-id']}),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/expenses/', {'page_size': 3, 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json()['detail'], 'Invalid cursor')
+
+    def test_cursor_is_rejected_after_the_ordering_changes(self):
+        next_url = self.page(page_size=3, ordering='amount')['next']
+        self.assertEqual(self.client.get(next_url).status_code, 200)
+
+        changed = next_url.replace('ordering=amount', 'ordering=-amount')
+        self.assertNotEqual(changed, next_url)
+        self.assertEqual(self.client.get(changed).status_code, 404)
+        self.assertEqual(self.client.get(next_url.replace('ordering=amount', '')).status_code, 404)
+
+    def test_page_size_is_bounded(self):
+        self.assertEqual(len(self.page(page_size=0)['results']), 7)
+        self.assertEqual(len(self.page(page_size='many')['results']), 7)
+        with mock.patch.object(ExpenseKeysetPagination, 'max_page_size', 2):
+            self.assertEqual(len(self.page(page_size=5)['results']), 2)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = CustomUser.objects.create_user(username='cached', email='cached@example.com', employee_id='E1')
+        self.expense = Expense.objects.create(user=self.user, category='food', description='Lunch', amount=Decimal('12.50'))
+        self.client = APIClient()
+
+    def etag(self):
+        response = self.client.get('/expenses/summary/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def assertInvalidated(self, write):
+        etag = self.etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_if_none_match_answers_304_until_an_expense_changes(self):
+        etag = self.etag()
+        response = self.client.get('/expenses/summary/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/expenses/{self.expense.id}/', {'amount': '20.00'}, format='json')
+        response = self.client.get('/expenses/summary/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_amount'], 20.0)
+
+    def test_queryset_updates_refresh_the_cached_list_and_summary(self):
+        self.assertEqual(self.client.get('/expenses/').json()['results'][0]['amount'], '12.50')
+        self.assertEqual(self.client.get('/expenses/summary/').json()['total_amount'], 12.5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.filter(category='food').update(amount=Decimal('20.00'))
+        self.assertEqual(self.client.get('/expenses/').json()['results'][0]['amount'], '20.00')
+        self.assertEqual(self.client.get('/expenses/summary/').json()['total_amount'], 20.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.filter(pk=self.expense.pk).update(description='Renamed')
+        self.assertEqual(self.client.get('/expenses/').json()['results'][0]['description'], 'Renamed')
+
+    def test_writes_outside_the_api_invalidate(self):
+        trip = Trip.objects.create(user=self.user, name='Rome', start_date=date(2025, 3, 1), end_date=date(2025, 3, 7))
+
+        def save():
+            self.expense.description = 'Edited in the admin'
+            self.expense.save()
+
+        self.assertInvalidated(save)
+        self.assertInvalidated(lambda: Expense.objects.filter(pk=self.expense.pk).update(trip=trip))
+        self.assertInvalidated(trip.delete)
+        self.assertInvalidated(lambda: Expense.objects.filter(pk=self.expense.pk).update(description='Renamed'))
+        self.assertInvalidated(lambda: call_command('rebuild_expense_rollups', stdout=StringIO()))
+        self.assertInvalidated(lambda: Expense.objects.filter(pk=self.expense.pk).delete())
+
+    def test_deploy_check_wants_a_shared_cache(self):
+        self.assertEqual([message.id for message in check_response_cache(None)], ['expenses.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}}):
+            self.assertEqual(check_response_cache(None), [])
+
+    def test_cached_responses_are_served_until_invalidated(self):
+        self.etag()
+        # Not through the ORM, so nothing invalidates the cache
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE expenses_expense SET amount = 99')
+        self.assertEqual(self.client.get('/expenses/summary/').json()['total_amount'], 12.5)
+
+
+class ExpenseSummaryTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='summer', email='summer@example.com', employee_id='E1')
+        for month, category, amount in [(2, 'food', '10.00'), (3, 'food', '2.50'), (3, 'travel', '40.00'), (3, 'travel', '0.01')]:
+            expense = Expense.objects.create(user=self.user, category=category, description='Row', amount=Decimal(amount))
+            Expense.objects.filter(pk=expense.pk).update(created_at=datetime(2025, month, 15, 12, tzinfo=dt_timezone.utc))
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_summary_payload(self):
+        summary = self.get('/expenses/summary/', breakdown='month, Category,unknown')
+        self.assertEqual(summary, {
+            'currency': 'USD',
+            'total_amount': 52.51,
+            'count': 4,
+            'min_amount': 0.01,
+            'max_amount': 40.0,
+            'average_amount': 13.13,
+            'by_category': [
+                {'category': 'food', 'count': 2, 'total_amount': 12.5},
+                {'category': 'travel', 'count': 2, 'total_amount': 40.01},
+            ],
+            'by_month': [
+                {'month': '2025-02', 'count': 1, 'total_amount': 10.0},
+                {'month': '2025-03', 'count': 3, 'total_amount': 42.51},
+            ],
+        })
+        self.assertNotIn('by_month', self.get('/expenses/summary/'))
+
+    def test_unfiltered_breakdowns_are_read_from_the_rollups(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get('/expenses/summary/', breakdown='category,month')
+        tables = [query['sql'] for query in queries]
+        # Only the totals, which need the minimum and maximum, read expenses
+        self.assertEqual(sum('"expenses_expense"' in sql for sql in tables), 1)
+        self.assertEqual(sum('"expenses_expensemonthlyrollup"' in sql for sql in tables), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get('/expenses/summary/', breakdown='category,month', category='food')
+        self.assertFalse(any('"expenses_expensemonthlyrollup"' in query['sql'] for query in queries))
+
+    def test_summary_follows_the_filters(self):
+        summary = self.get('/expenses/summary/', category='travel', start_date='2025-03-01T00:00:00Z')
+        self.assertEqual((summary['total_amount'], summary['count']), (40.01, 2))
+
+        summary = self.get('/expenses/summary/', category='lodging', breakdown='category')
+        self.assertEqual(summary, {
+            'currency': 'USD', 'total_amount': 0.0, 'count': 0,
+            'min_amount': None, 'max_amount': None, 'average_amount': None, 'by_category': [],
+        })
+
+    def test_list_keeps_total_amount_next_to_the_summary(self):
+        data = self.get('/expenses/', include_total='true', page_size=1)
+        # The total covers every filtered expense, not just the page
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['total_amount'], 52.51)
+        self.assertEqual(data['summary'], self.get('/expenses/summary/'))
+        self.assertEqual(data['total_amount'], float(sum(expense.amount for expense in Expense.objects.all())))
+
+        data = self.get('/expenses/', include_total='TRUE', category='food', breakdown='category')
+        self.assertEqual(data['total_amount'], 12.5)
+        self.assertEqual(data['summary']['by_category'], [{'category': 'food', 'count': 2, 'total_amount': 12.5}])
+
+        data = self.get('/expenses/')
+        self.assertNotIn('total_amount', data)
+        self.assertNotIn('summary', data)
+
+
+class ExpenseExportTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='exporter', email='exporter@example.com', employee_id='E1')
+        self.other = CustomUser.objects.create_user(username='other', email='other@example.com', employee_id='E2')
+        self.taxi = Expense.objects.create(user=self.user, category='travel', description='Taxi, "airport"\nreturn', amount=Decimal('40.00'))
+        self.lunch = Expense.objects.create(user=self.other, category='food', description='Caf\u00e9 lunch', amount=Decimal('12.50'))
+        Expense.objects.filter(pk=self.lunch.pk).update(created_at=datetime(2025, 3, 10, 12, 0, tzinfo=dt_timezone.utc))
+        self.lunch.refresh_from_db()
+
+    def export(self, **params):
+        response = APIClient().get('/expenses/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_quotes_values_and_matches_the_api(self):
+        response, body = self.export(ordering='created_at')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="expenses.csv"')
+
+        rows = list(csv.reader(StringIO(body)))
+        self.assertEqual(rows[0], ['id', 'user', 'category', 'description', 'amount', 'currency', 'created_at', 'updated_at'])
+        self.assertEqual(len(rows), 3)
+        expected = ExpenseSerializer(self.lunch).data
+        self.assertEqual(rows[1], [
+            str(self.lunch.id), str(self.other.id), 'food', 'Caf\u00e9 lunch', '12.50',
+            expected['currency'], expected['created_at'], expected['updated_at'],
+        ])
+        self.assertEqual(rows[2][3], 'Taxi, "airport"\nreturn')
+
+    def test_jsonl_has_one_object_per_line(self):
+        response, body = self.export(export_format='JSONL', ordering='amount')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([line['id'] for line in lines], [self.lunch.id, self.taxi.id])
+        self.assertEqual(lines[0], {
+            key: value for key, value in ExpenseSerializer(self.lunch).data.items()
+            if key in ('id', 'user', 'category', 'description', 'amount', 'currency', 'created_at', 'updated_at')
+        })
+
+    def test_filters_apply_to_the_export(self):
+        _, body = self.export(export_format='jsonl', category='food')
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [self.lunch.id])
+        _, body = self.export(export_format='jsonl', end_date='2025-03-31T00:00:00Z')
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [self.lunch.id])
+        _, body = self.export(export_format='jsonl', search='airport')
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [self.taxi.id])
+        # Only the header when nothing matches
+        _, body = self.export(category='lodging')
+        self.assertEqual(len(body.splitlines()), 1)
+
+    def test_rows_are_streamed_in_batches(self):
+        Expense.objects.bulk_create(
+            Expense(user=self.user, category='other', description=f'Row {index}', amount=Decimal('1.00'))
+            for index in range(5)
+        )
+        with mock.patch('expenses.export.EXPORT_ROWS_PER_WRITE', 2):
+            response = APIClient().get('/expenses/export/', {'export_format': 'jsonl'})
+            chunks = list(response.streaming_content)
+        # Seven rows written two at a time
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [2, 2, 2, 1])
+
+    def test_unknown_format_is_rejected(self):
+        response = APIClient().get('/expenses/export/', {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('export_format', response.json()['detail'])
+
+
+class FastJSONTests(TestCase):
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            'results': [{'id': 1, 'amount': '12.50', 'description': 'Caf\u00e9 \u2028 line'}],
+            'total_amount': Decimal('12.50'),
+            'created_at': datetime(2025, 3, 10, 8, 30, 0, 123456, tzinfo=dt_timezone.utc),
+            'big': 2 ** 70,
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+
+    def test_parser_round_trip(self):
+        body = FastJSONRenderer().render({'rows': [{'amount': '1.00', 'note': '\u00e9'}], 'big': 2 ** 70})
+        self.assertEqual(
+            FastJSONParser().parse(BytesIO(body)),
+            {'rows': [{'amount': '1.00', 'note': '\u00e9'}], 'big': 2 ** 70},
+        )
+
+
+class ExpenseSearchTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='search', email='search@example.com', employee_id='E1')
+        self.taxi = Expense.objects.create(user=self.user, category='travel', description='Taxi to the airport', amount=Decimal('40.00'))
+        self.lunch = Expense.objects.create(user=self.user, category='food', description='Lunch at the airport with client', amount=Decimal('25.00'))
+        Expense.objects.create(user=self.user, category='food', description='Team dinner', amount=Decimal('90.00'))
+
+    def search(self, **params):
+        # Writes below bypass the views, so nothing invalidates cached responses
+        get_cache().clear()
+        response = self.client.get('/expenses/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_matches_substrings_of_every_term(self):
+        self.assertEqual(sorted(self.search(search='airport')), sorted([self.taxi.id, self.lunch.id]))
+        self.assertEqual(self.search(search='AIRPORT client'), [self.lunch.id])
+        self.assertEqual(self.search(search='trav'), [self.taxi.id])
+        # Terms shorter than a trigram are matched with LIKE
+        self.assertEqual(self.search(search='airport wi'), [self.lunch.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.taxi.description = 'Train ticket'
+        self.taxi.save()
+        Expense.objects.filter(pk=self.lunch.pk).update(description='Breakfast')
+        self.assertEqual(self.search(search='airport'), [])
+        self.assertEqual(self.search(search='ticket'), [self.taxi.id])
+
+        self.taxi.delete()
+        self.assertEqual(self.search(search='ticket'), [])
+
+    def test_ranked_results_paginate(self):
+        for index in range(5):
+            Expense.objects.create(user=self.user, category='other', description=f'Airport parking {index}', amount=Decimal('5.00'))
+        expected = self.search(search='airport', page_size=50)
+
+        ids = []
+        response = self.client.get('/expenses/', {'search': 'airport', 'page_size': 2})
+        while True:
+            ids.extend(row['id'] for row in response.json()['results'])
+            if not response.json()['next']:
+                break
+            response = self.client.get(response.json()['next'])
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(ids), 7)
+
+        self.assertEqual(self.search(search='airport', ordering='amount')[-1], self.taxi.id)
+
+    def test_explicit_ordering_pages_stably_across_writes(self):
+        for index in range(4):
+            Expense.objects.create(user=self.user, category='other', description=f'Airport parking {index}', amount=Decimal('5.00'))
+        expected = self.search(search='airport', ordering='-created_at', page_size=50)
+
+        response = self.client.get('/expenses/', {'search': 'airport', 'ordering': '-created_at', 'page_size': 3})
+        ids = [row['id'] for row in response.json()['results']]
+        # Changes the bm25 statistics of every match
+        Expense.objects.create(user=self.user, category='other', description='Airport airport airport', amount=Decimal('1.00'))
+        Expense.objects.filter(pk=self.lunch.pk).update(description='Lunch at the airport')
+        get_cache().clear()
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            ids.extend(row['id'] for row in response.json()['results'])
+        self.assertEqual(ids, expected)
+
+
+class ExpenseTimelineTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = CustomUser.objects.create_user(username='timeline', email='timeline@example.com', employee_id='E1')
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', employee_id='E2')
+        for user, day, category, amount in [
+            (self.user, 3, 'food', '10.00'),
+            (self.user, 3, 'transport', '30.50'),
+            (self.user, 5, 'food', '4.25'),
+            (self.user, 12, 'accommodation', '120.00'),
+            (other, 3, 'food', '99.00'),
+        ]:
+            expense = Expense.objects.create(user=user, category=category, description='Trip', amount=Decimal(amount))
+            Expense.objects.filter(pk=expense.pk).update(created_at=datetime(2025, 3, day, 12, tzinfo=dt_timezone.utc))
+
+    def timeline(self, **params):
+        response = APIClient().get('/expenses/timeline/', {'user': self.user.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_daily_buckets_with_running_totals(self):
+        timeline = self.timeline(start_date='2025-03-02', end_date='2025-03-06')
+
+        self.assertEqual([bucket['start'] for bucket in timeline['buckets']], [f'2025-03-0{day}' for day in range(2, 7)])
+        self.assertEqual([bucket['total_amount'] for bucket in timeline['buckets']], [0, 40.5, 0, 4.25, 0])
+        self.assertEqual([bucket['running_total'] for bucket in timeline['buckets']], [0, 40.5, 40.5, 44.75, 44.75])
+        self.assertEqual(timeline['buckets'][1]['by_category'], {'food': 10.0, 'transport': 30.5})
+        self.assertEqual(timeline['buckets'][1]['count'], 2)
+        self.assertEqual(timeline['total_amount'], 44.75)
+
+    def test_weekly_buckets_start_on_monday(self):
+        timeline = self.timeline(interval='week', start_date='2025-03-05', end_date='2025-03-12')
+
+        self.assertEqual((timeline['start_date'], timeline['end_date']), ('2025-03-03', '2025-03-16'))
+        self.assertEqual(
+            [(bucket['start'], bucket['total_amount'], bucket['running_total']) for bucket in timeline['buckets']],
+            [('2025-03-03', 44.75, 44.75), ('2025-03-10', 120.0, 164.75)],
+        )
+
+    def test_python_fallback_matches_window_functions(self):
+        queryset = Expense.objects.all()
+        args = ('day', datetime(2025, 3, 1).date(), datetime(2025, 3, 31).date(), 'USD')
+        with mock.patch.object(type(connection.features), 'supports_over_clause', False):
+            fallback = build_timeline(queryset, *args)
+        self.assertEqual(build_timeline(queryset, *args), fallback)
+        self.assertEqual(fallback['total_amount'], Decimal('263.75'))
+
+    def test_rejects_invalid_ranges(self):
+        client = APIClient()
+        for params in (
+            {'interval': 'month'},
+            {'start_date': '2025-03-10', 'end_date': '2025-03-01'},
+            {'start_date': '2020-01-01', 'end_date': '2025-01-01'},
+            {'start_date': 'yesterday'},
+        ):
+            with self.subTest(params):
+                self.assertEqual(client.get('/expenses/timeline/', params).status_code, 400)
+
+
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        user = CustomUser.objects.create_user(username='stats', email='stats@example.com', employee_id='E1')
+        Expense.objects.create(user=user, category='food', description='Lunch', amount=Decimal('12.50'))
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers_report_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/expenses/', {'include_total': 'true'})
+        self.assertEqual(response['X-Query-Count'], str(len(queries)))
+        self.assertIn('X-Serialization-Time-Ms', response)
+
+    def test_no_headers_without_debug(self):
+        self.assertNotIn('X-Query-Count', APIClient().get('/expenses/'))
+
+    @override_settings(QUERY_BUDGETS={'expense-list:GET': 0})
+    def test_exceeding_budget_raises(self):
+        # Set by the test runner, whatever command started the tests
+        self.assertTrue(settings.QUERY_BUDGET_RAISE)
+        with self.assertRaises(QueryBudgetExceeded):
+            APIClient().get('/expenses/')
+
+    @override_settings(QUERY_BUDGETS={'expense-list:GET': 0, 'expense-list:POST': 14})
+    def test_budgets_are_per_method(self):
+        user = CustomUser.objects.get()
+        response = APIClient().post('/expenses/', {
+            'user': user.id, 'category': 'food', 'description': 'Dinner', 'amount': '20.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        # The write fits its own budget; a read of the same URL does not
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'expense-list:GET ran 1 queries, budget is 0'):
+            APIClient().get('/expenses/')
+
+    def test_runner_keeps_metric_samples_out_of_the_tree(self):
+        self.assertTrue(settings.METRICS_DIR)
+        self.assertFalse(settings.METRICS_DIR.startswith(str(settings.BASE_DIR)))
+
+    @override_settings(QUERY_BUDGETS={'expense-list:GET': 0}, QUERY_BUDGET_RAISE=False)
+    def test_exceeding_budget_logs_a_warning(self):
+        with self.assertLogs('travel_expense_management.instrumentation', 'WARNING') as logs:
+            self.assertEqual(APIClient().get('/expenses/').status_code, 200)
+        self.assertIn('expense-list:GET ran', logs.output[0])
+
+
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+        self.settings_override = override_settings(METRICS_DIR=self.metrics_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        metrics.store.clear()
+
+    def test_exposes_request_and_cache_metrics(self):
+        client = APIClient()
+        client.get('/expenses/')
+        client.get('/expenses/')
+
+        body = client.get('/metrics').content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_requests_total{route="expense-list",method="GET",status="200"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="expense-list",le="+Inf"} 2', body)
+        self.assertIn('expense_response_cache_requests_total{view="list",result="hit"} 1', body)
+        self.assertIn('expense_response_cache_requests_total{view="list",result="miss"} 1', body)
+
+    def test_sums_samples_of_other_processes(self):
+        APIClient().get('/expenses/')
+        with open(os.path.join(self.metrics_dir, 'metrics-1-other.json'), 'w') as handle:
+            json.dump([['http_requests_total', [['route', 'expense-list'], ['method', 'GET'], ['status', '200']], 41]], handle)
+
+        body = APIClient().get('/metrics').content.decode()
+        self.assertIn('http_requests_total{route="expense-list",method="GET",status="200"} 42', body)
+
+    def test_ignores_and_removes_samples_of_exited_processes(self):
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        stale = os.path.join(self.metrics_dir, f'metrics-{exited.pid}-stale.json')
+        with open(stale, 'w') as handle:
+            json.dump([['http_requests_total', [['route', 'expense-list'], ['method', 'GET'], ['status', '200']], 41]], handle)
+
+        APIClient().get('/expenses/')
+        body = APIClient().get('/metrics').content.decode()
+        self.assertIn('http_requests_total{route="expense-list",method="GET",status="200"} 1', body)
+        self.assertFalse(os.path.exists(stale))
+
+    def test_reports_monthly_report_progress(self):
+        user = CustomUser.objects.create_user(username='metrics', email='metrics@example.com', employee_id='E1')
+        expense = Expense.objects.create(user=user, category='food', description='Lunch', amount=Decimal('12.50'))
+        Expense.objects.filter(pk=expense.pk).update(created_at=datetime(2025, 3, 10, tzinfo=dt_timezone.utc))
+        generate_monthly_expense_report(today=datetime(2025, 4, 2, tzinfo=dt_timezone.utc))
+
+        body = APIClient().get('/metrics').content.decode()
+        self.assertIn(
+            'expense_report_run_progress{month="2025-03",shard="0",shard_count="1",status="completed",field="emails_sent"} 1',
+            body,
+        )
+
+
+class ExplainExpenseQueriesTests(TestCase):
+    def test_plans_of_the_real_queries_use_the_indexes(self):
+        user = CustomUser.objects.create_user(username='plans', email='plans@example.com', employee_id='E1')
+        for _ in range(3):
+            Expense.objects.create(user=user, category='food', description='Airport lunch', amount=Decimal('12.50'))
+
+        output = StringIO()
+        call_command('explain_expense_queries', user=user.id, fail_on_scan=True, stdout=output)
+
+        output = output.getvalue()
+        for name in ('list next page', 'summary date range', 'timeline per user', 'monthly report'):
+            self.assertIn(f'== {name}', output)
+        # Keyset pages and date ranges, and the per-user timeline
+        self.assertIn('SEARCH expenses_expense USING INDEX created_id_idx (created_at<?)', output)
+        self.assertIn('USING INDEX user_created_idx (user_id=? AND created_at>? AND created_at<?)', output)
+        self.assertIn('expenses_expense_fts', output)
+        self.assertIn('No full table scans on expenses', output)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_seed_and_benchmark(self):
+        call_command('seed_expenses', users=6, expenses=300, days=60, team_size=3, seed=1, stdout=StringIO())
+        self.assertEqual(Expense.objects.count(), 300)
+        self.assertEqual(CustomUser.objects.filter(manager__isnull=True).count(), 1)
+
+        output = StringIO()
+        call_command('benchmark_api', iterations=2, warmup=1, report_iterations=1, stdout=output, stderr=StringIO())
+        results = json.loads(output.getvalue())
+
+        self.assertEqual(results['data']['expenses'], 300)
+        self.assertIn('expenses.list_totals', results['scenarios'])
+        self.assertIn('reports.delete', results['scenarios'])
+        self.assertEqual(results['scenarios']['reports.monthly']['iterations'], 1)
+        for scenario in results['scenarios'].values():
+            self.assertLessEqual(scenario['p50_ms'], scenario['p99_ms'])
+        # Everything the benchmark wrote was rolled back
+        self.assertEqual(Expense.objects.count(), 300)
+
+    def test_ingest_benchmark_fails_on_rejected_rows(self):
+        output = StringIO()
+        call_command('benchmark_expense_ingest', rows=3, stdout=output)
+        self.assertIn('speedup:', output.getvalue())
+
+        with mock.patch('expenses.management.commands.benchmark_expense_ingest.CATEGORY_CHOICES', [('souvenirs', 'Souvenirs')]):
+            with self.assertRaisesMessage(CommandError, 'POST /expenses/ returned 400'):
+                call_command('benchmark_expense_ingest', rows=3, stdout=StringIO())
+        self.assertFalse(Expense.objects.exists())
+
+
+class CurrencyConversionTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        get_rate_cache().clear()
+        self.addCleanup(get_rate_cache().clear)
+        call_command('load_fx_rates', self.rate_file(), stdout=StringIO())
+
+        self.user = CustomUser.objects.create_user(username='traveller', email='traveller@example.com', employee_id='E1')
+        for day, currency, amount in [(3, 'USD', '10.00'), (4, 'EUR', '9.00'), (10, 'EUR', '8.00'), (10, 'GBP', '7.50')]:
+            expense = Expense.objects.create(
+                user=self.user, category='food', description='Meal', amount=Decimal(amount), currency=currency,
+            )
+            Expense.objects.filter(pk=expense.pk).update(created_at=datetime(2025, 3, day, 12, tzinfo=dt_timezone.utc))
+
+    def rate_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'rates.csv')
+        with open(path, 'w') as rate_file:
+            rate_file.write('date,currency,rate\n2025-03-03,EUR,0.9\n2025-03-10,EUR,0.8\n2025-03-03,GBP,0.75\n')
+        return path
+
+    def test_summary_converts_into_base_currency(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        summary = client.get('/expenses/summary/', {'breakdown': 'category'}).json()
+        # 10 USD + 9 EUR at 0.9 (carried over from Monday) + 8 EUR at 0.8 + 7.50 GBP at 0.75
+        self.assertEqual((summary['currency'], summary['total_amount'], summary['count']), ('USD', 40.0, 4))
+        self.assertEqual((summary['min_amount'], summary['max_amount'], summary['average_amount']), (10.0, 10.0, 10.0))
+        self.assertEqual(summary['by_category'], [{'category': 'food', 'count': 4, 'total_amount': 40.0}])
+
+        self.user.base_currency = 'EUR'
+        self.user.save()
+        response = client.get('/expenses/', {'include_total': 'true'}).json()
+        self.assertEqual((response['summary']['currency'], response['total_amount']), ('EUR', 34.0))
+        self.assertEqual({row['currency'] for row in response['results']}, {'USD', 'EUR', 'GBP'})
+
+    def test_totals_need_no_per_row_rate_queries(self):
+        queryset = Expense.objects.all()
+        # Totals, foreign currency totals by currency and date, then rates
+        with self.assertNumQueries(3):
+            first = summarize_expenses(queryset, 'EUR')
+        with self.assertNumQueries(2):
+            self.assertEqual(summarize_expenses(queryset, 'EUR'), first)
+        # Nothing to convert: one plain aggregate
+        with self.assertNumQueries(1):
+            summarize_expenses(queryset.filter(currency='EUR'), 'EUR')
+
+        # Report runs preload the month's rates, then only read expenses
+        get_rate_cache().clear()
+        get_rate_cache().preload(datetime(2025, 3, 1).date(), datetime(2025, 3, 31).date())
+        with self.assertNumQueries(1):
+            for _, _, _, rows in iter_monthly_expenses(
+                datetime(2025, 3, 1, tzinfo=dt_timezone.utc), datetime(2025, 4, 1, tzinfo=dt_timezone.utc),
+            ):
+                report_csv, row_count = build_report_csv(rows)
+        self.assertEqual(row_count, 4)
+        self.assertIn('Meal,10.00,2025-03-04,9.00,EUR', report_csv)
+        self.assertIn(',Total,40.00,', report_csv)
+
+    def test_monthly_report_records_users_without_rates_and_continues(self):
+        traveller = CustomUser.objects.create_user(username='tokyo', email='tokyo@example.com', employee_id='E2')
+        expense = Expense.objects.create(
+            user=traveller, category='food', description='Sushi', amount=Decimal('900'), currency='JPY',
+        )
+        Expense.objects.filter(pk=expense.pk).update(created_at=datetime(2025, 3, 5, 12, tzinfo=dt_timezone.utc))
+
+        stats = generate_monthly_expense_report(today=datetime(2025, 4, 2, tzinfo=dt_timezone.utc))
+
+        self.assertEqual((stats['users'], stats['emails_sent'], stats['emails_failed']), (2, 1, 1))
+        self.assertEqual([message.to[0] for message in mail.outbox], ['traveller@example.com'])
+        failure = MonthlyReportFailure.objects.get()
+        self.assertEqual(failure.user, traveller)
+        self.assertIn('JPY', failure.error)
+        run = MonthlyReportRun.objects.get()
+        self.assertEqual((run.status, run.users_processed, run.emails_failed), ('completed', 2, 1))
+
+    def test_weekly_report_totals_in_base_currency(self):
+        self.user.base_currency = 'EUR'
+        self.user.save()
+        self.assertEqual(compute_report_total(self.user, date(2025, 3, 3), date(2025, 3, 9)), Decimal('18.00'))
+
+        report = WeeklyReport.objects.create(user=self.user, week_start=date(2025, 3, 10), week_end=date(2025, 3, 16))
+        recompute_report_totals([WeeklyReport.objects.only('id', 'user_id', 'week_start', 'week_end').get()])
+        report.refresh_from_db()
+        self.assertEqual((report.total_amount, report.currency), (Decimal('16.00'), 'EUR'))
+
+    def test_missing_rates(self):
+        client = APIClient()
+        response = client.get('/expenses/summary/', {'currency': 'JPY'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(client.get('/expenses/summary/', {'currency': 'euro'}).status_code, 400)
+
+        response = client.post('/expenses/', {
+            'user': self.user.id, 'category': 'food', 'description': 'Sushi', 'amount': '900', 'currency': 'JPY',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('currency', response.json())
+
+    def test_expenses_must_convert_into_the_trip_currency(self):
+        trip = Trip.objects.create(
+            user=self.user, name='Tokyo', start_date=date(2025, 3, 1), end_date=date(2025, 3, 7), currency='JPY',
+        )
+        client = APIClient()
+        row = {'user': self.user.id, 'trip': trip.id, 'category': 'food', 'description': 'Ramen', 'amount': '12.00'}
+        response = client.post('/expenses/', row, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('currency', response.json())
+
+        response = client.post('/expenses/bulk/', [row, {**row, 'trip': None}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [0])
+
+        expense = Expense.objects.get(description='Ramen')
+        response = client.patch(f'/expenses/{expense.id}/', {'trip': trip.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(Expense.objects.get(pk=expense.pk).trip_id)
+
+    def test_missing_rates_while_writing_roll_back(self):
+        trip = Trip.objects.create(user=self.user, name='Paris', start_date=date(2025, 3, 1), end_date=date(2025, 3, 7))
+        expense = Expense.objects.create(user=self.user, trip=trip, category='food', description='Crepe', amount=Decimal('5.00'))
+        with mock.patch('trips.budgets.get_rate_cache') as rates:
+            rates.return_value.convert.side_effect = MissingRateError('No FX rate for EUR')
+            response = APIClient().delete(f'/expenses/{expense.id}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('currency', response.json())
+        self.assertTrue(Expense.objects.filter(pk=expense.pk).exists())
+
+    def test_loading_rates_clears_the_rate_cache_of_every_process(self):
+        rates = get_rate_cache()
+        self.assertEqual(rates.get_rate('EUR', date(2025, 3, 3)), Decimal('0.9'))
+
+        # Another process loads new rates into the shared cache backend
+        FxRate.objects.filter(currency='EUR', date=date(2025, 3, 3)).update(rate=Decimal('0.95'))
+        self.assertEqual(get_rate_cache().get_rate('EUR', date(2025, 3, 3)), Decimal('0.9'))
+        bump_rates_generation()
+        self.assertEqual(get_rate_cache().get_rate('EUR', date(2025, 3, 3)), Decimal('0.95'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_fx_rates', self.rate_file(), stdout=StringIO())
+        self.assertEqual(get_rate_cache().get_rate('EUR', date(2025, 3, 3)), Decimal('0.9'))
+
+    def test_rate_cache_is_bounded(self):
+        cache = RateCache(maxsize=3, timeout=60)
+        cache.preload(datetime(2025, 3, 3).date(), datetime(2025, 3, 12).date())
+        self.assertEqual(len(cache.entries), 3)
+        # Dates past FX_RATE_MAX_AGE_DAYS without a rate are not filled in
+        self.assertEqual(list(cache.entries), [('GBP', datetime(2025, 3, d).date()) for d in (8, 9, 10)])
+
+
+# A PNG header (40x30) and a JPEG with an APP0 segment before its 640x480 frame
+PNG_RECEIPT = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>IIBBBBB', 40, 30, 8, 2, 0, 0, 0) + b'\0' * 64
+JPEG_RECEIPT = (
+    b'\xff\xd8\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    + b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, 480, 640, 1) + b'\x01\x11\x00\xff\xd9'
+)
+
+
+class ReceiptTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.settings_override = override_settings(RECEIPT_ROOT=directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.user = CustomUser.objects.create_user(username='traveller', email='traveller@example.com', employee_id='E1')
+        self.expense = Expense.objects.create(user=self.user, category='food', description='Lunch', amount=Decimal('12.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, expense, content, name='receipt.png'):
+        return self.client.post(
+            f'/expenses/{expense.pk}/receipt/', {'file': SimpleUploadedFile(name, content)}, format='multipart',
+        )
+
+    def test_identical_uploads_are_stored_once(self):
+        other = Expense.objects.create(user=self.user, category='food', description='Dinner', amount=Decimal('30.00'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            first = self.upload(self.expense, PNG_RECEIPT)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json()['sha256'], hashlib.sha256(PNG_RECEIPT).hexdigest())
+        self.assertEqual((first.json()['content_type'], first.json()['deduplicated']), ('image/png', False))
+        # Processing is handed to the background pool, cache invalidation runs too
+        self.assertEqual(len(callbacks), 2)
+
+        second = self.upload(other, PNG_RECEIPT, name='copy.png')
+        self.assertEqual((second.json()['id'], second.json()['deduplicated']), (first.json()['id'], True))
+        self.assertEqual(Receipt.objects.count(), 1)
+        self.assertEqual(set(Expense.objects.values_list('receipt_id', flat=True)), {first.json()['id']})
+        receipt = Receipt.objects.get()
+        self.assertTrue(receipt.file.storage.exists(receipt.file.name))
+        self.assertEqual(self.client.get(f'/expenses/{other.pk}/').json()['receipt'], receipt.pk)
+
+    def test_upload_and_removal_refresh_the_cached_responses(self):
+        self.assertIsNone(self.client.get('/expenses/').json()['results'][0]['receipt'])
+        summary_etag = self.client.get('/expenses/summary/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            receipt_id = self.upload(self.expense, PNG_RECEIPT).json()['id']
+        self.assertEqual(self.client.get('/expenses/').json()['results'][0]['receipt'], receipt_id)
+        self.assertNotEqual(self.client.get('/expenses/summary/')['ETag'], summary_etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/expenses/{self.expense.pk}/receipt/').status_code, 204)
+        self.assertIsNone(self.client.get('/expenses/').json()['results'][0]['receipt'])
+
+    def test_rejects_oversized_and_unsupported_uploads(self):
+        with override_settings(RECEIPT_MAX_SIZE=len(PNG_RECEIPT) - 1):
+            self.assertEqual(self.upload(self.expense, PNG_RECEIPT).status_code, 413)
+        self.assertEqual(self.upload(self.expense, b'#!/bin/sh\n', name='receipt.png').status_code, 400)
+        self.assertEqual(self.upload(self.expense, b'').status_code, 400)
+        self.assertFalse(Receipt.objects.exists())
+
+    def test_metadata_is_read_from_the_header(self):
+        self.upload(self.expense, JPEG_RECEIPT, name='receipt.jpg')
+        receipt = Receipt.objects.get()
+        self.assertEqual(process_receipt(receipt.pk), {'width': 640, 'height': 480})
+        receipt.refresh_from_db()
+        self.assertIsNotNone(receipt.processed_at)
+
+        self.upload(self.expense, b'%PDF-1.7\n%\xe2\xe3\n1 0 obj\n', name='receipt.pdf')
+        self.assertEqual(process_receipt(Receipt.objects.get(content_type='application/pdf').pk), {'pdf_version': '1.7'})
+        self.assertEqual(process_receipt(Receipt.objects.create(
+            sha256='0' * 64, size=len(PNG_RECEIPT), content_type='image/png',
+            file=SimpleUploadedFile('receipt.png', PNG_RECEIPT),
+        ).pk), {'width': 40, 'height': 30})
+
+    def test_download_supports_ranges(self):
+        self.upload(self.expense, PNG_RECEIPT)
+        url = f'/expenses/{self.expense.pk}/receipt/'
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['Accept-Ranges']), (200, 'bytes'))
+        self.assertEqual(b''.join(response.streaming_content), PNG_RECEIPT)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_RANGE='bytes=8-15')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, f'bytes 8-15/{len(PNG_RECEIPT)}'))
+        self.assertEqual(b''.join(response.streaming_content), PNG_RECEIPT[8:16])
+        response = self.client.get(url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), PNG_RECEIPT[-4:])
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(PNG_RECEIPT)}-').status_code, 416)
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"stale"').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, {'thumbnail': 'true'}).status_code, 404)
+
+    def test_unused_receipts_are_pruned(self):
+        other = Expense.objects.create(user=self.user, category='food', description='Dinner', amount=Decimal('30.00'))
+        self.upload(self.expense, PNG_RECEIPT)
+        self.upload(other, PNG_RECEIPT)
+        receipt = Receipt.objects.get()
+
+        self.assertEqual(self.client.delete(f'/expenses/{self.expense.pk}/receipt/').status_code, 204)
+        self.assertEqual(self.client.get(f'/expenses/{self.expense.pk}/receipt/').status_code, 404)
+        self.assertEqual(prune_receipts(older_than=timedelta(0)), 0)
+
+        other.delete()
+        # Files are deleted once the deletes commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(prune_receipts(older_than=timedelta(0)), 1)
+        self.assertFalse(Receipt.objects.exists())
+        self.assertFalse(receipt.file.storage.exists(receipt.file.name))
+
+    def test_uploads_are_not_deduplicated_across_users(self):
+        first = self.upload(self.expense, PNG_RECEIPT).json()
+        colleague = CustomUser.objects.create_user(username='colleague', email='colleague@example.com', employee_id='E2')
+        other = Expense.objects.create(user=colleague, category='food', description='Dinner', amount=Decimal('30.00'))
+        self.client.force_authenticate(colleague)
+
+        second = self.upload(other, PNG_RECEIPT).json()
+
+        # Nothing tells the colleague that someone uploaded the file before
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertFalse(second['deduplicated'])
+        mine, theirs = Receipt.objects.order_by('id')
+        self.assertEqual((mine.user, theirs.user), (self.user, colleague))
+        # Only the stored copy is shared, and outlives the pruned receipt
+        self.assertEqual(mine.file.name, theirs.file.name)
+        self.expense.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(prune_receipts(older_than=timedelta(0)), 1)
+        self.assertTrue(theirs.file.storage.exists(theirs.file.name))
+        self.assertEqual(b''.join(self.client.get(f'/expenses/{other.pk}/receipt/').streaming_content), PNG_RECEIPT)
 
-# Create your tests here.
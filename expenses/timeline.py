@@ -0,0 +1,133 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from django.db import connections
+from django.db.models import Count, DateField, F, Func, Sum, Window
+from django.db.models.functions import TruncDate, TruncWeek
+from django.utils import timezone
+from .fx import convert_rows, group_for_conversion
+from .summary import _quantize
+
+# Bucket sizes accepted by ?interval=, with the bucket length
+TIMELINE_INTERVALS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+# Buckets covered when no start_date is given
+TIMELINE_DEFAULT_BUCKETS = {'day': 30, 'week': 12}
+
+# Largest range one response may cover, in buckets
+TIMELINE_MAX_BUCKETS = 366
+
+
+class RunningSum(Func):
+    """
+    SUM() usable over an aggregate inside a window, so
+    Window(RunningSum(Sum('amount')), order_by=...) on a grouped queryset
+    compiles to SUM(SUM(amount)) OVER (ORDER BY ...).
+    """
+    function = 'SUM'
+    window_compatible = True
+
+
+def parse_timeline_range(interval, start_date=None, end_date=None, today=None):
+    """
+    Validate ?interval=, ?start_date= and ?end_date= (YYYY-MM-DD, inclusive)
+    and return (first_bucket, last_bucket) dates. Weekly ranges are widened
+    to whole weeks starting on Monday. Raises ValueError with a message
+    suitable for the client.
+    """
+    if interval not in TIMELINE_INTERVALS:
+        raise ValueError(f"interval must be one of: {', '.join(TIMELINE_INTERVALS)}.")
+    step = TIMELINE_INTERVALS[interval]
+    try:
+        end = date.fromisoformat(end_date) if end_date else (today or timezone.localdate())
+        start = date.fromisoformat(start_date) if start_date else end - step * (TIMELINE_DEFAULT_BUCKETS[interval] - 1)
+    except ValueError:
+        raise ValueError('start_date and end_date must be formatted as YYYY-MM-DD.')
+    if start > end:
+        raise ValueError('start_date must not be after end_date.')
+
+    if interval == 'week':
+        start -= timedelta(days=start.weekday())
+        end -= timedelta(days=end.weekday())
+    if (end - start) // step + 1 > TIMELINE_MAX_BUCKETS:
+        raise ValueError(f'The range may cover at most {TIMELINE_MAX_BUCKETS} {interval}s.')
+    return start, end
+
+
+def build_timeline(queryset, interval, start, end, currency):
+    """
+    Return per-bucket totals, running totals and per-category splits of an
+    expense queryset in `currency` between the first and last bucket dates.
+
+    One query grouped by bucket and category reads at most one row per
+    bucket and category, whatever the number of expenses; amounts in other
+    currencies are further grouped by currency and date and converted with
+    cached FX rates. Where the database supports window functions and no
+    conversion is needed, bucket totals and running totals are computed
+    over the grouped rows in SQL (rows of one bucket are peers, so the
+    running total covers the whole bucket); otherwise they are summed in
+    Python. Buckets without expenses are included with zero totals.
+    """
+    step = TIMELINE_INTERVALS[interval]
+    range_start = timezone.make_aware(datetime.combine(start, time.min))
+    range_end = timezone.make_aware(datetime.combine(end + step, time.min))
+    if interval == 'week':
+        bucket = TruncWeek('created_at', output_field=DateField())
+    else:
+        bucket = TruncDate('created_at')
+
+    rows = group_for_conversion(
+        queryset.filter(created_at__gte=range_start, created_at__lt=range_end).annotate(bucket=bucket),
+        ('bucket', 'category'), currency,
+        count=Count('id'), total_amount=Sum('amount'),
+    )
+    window = connections[queryset.db].features.supports_over_clause
+    if window:
+        # A separate annotate() keeps the windows out of the GROUP BY
+        rows = rows.annotate(
+            bucket_total=Window(RunningSum(Sum('amount')), partition_by=[F('bucket')]),
+            running_total=Window(RunningSum(Sum('amount')), order_by=F('bucket').asc()),
+        )
+
+    rows = convert_rows(rows.order_by('bucket', 'category'))
+    # Window sums add up raw amounts, which is only right in one currency
+    window = window and all(row['rate_date'] is None for row in rows)
+
+    by_bucket = {}
+    for row in rows:
+        by_bucket.setdefault(row['bucket'], []).append(row)
+
+    buckets = []
+    running_total = Decimal('0.00')
+    current = start
+    while current <= end:
+        category_rows = by_bucket.get(current, [])
+        by_category = {}
+        for row in category_rows:
+            by_category[row['category']] = by_category.get(row['category'], 0) + row['total_amount']
+        by_category = {category: _quantize(amount) for category, amount in by_category.items()}
+        if window and category_rows:
+            total_amount = _quantize(category_rows[0]['bucket_total'])
+            running_total = _quantize(category_rows[0]['running_total'])
+        else:
+            total_amount = sum(by_category.values(), Decimal('0.00'))
+            running_total += total_amount
+        buckets.append({
+            'start': current,
+            'count': sum(row['count'] for row in category_rows),
+            'total_amount': total_amount,
+            'running_total': running_total,
+            'by_category': by_category,
+        })
+        current += step
+
+    return {
+        'interval': interval,
+        'currency': currency,
+        'start_date': start,
+        'end_date': end + step - timedelta(days=1),
+        'total_amount': running_total,
+        'buckets': buckets,
+    }
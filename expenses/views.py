@@ -1,24 +1,64 @@
+import os
+from contextlib import contextmanager
 from rest_framework import viewsets, permissions, filters, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
+from travel_expense_management.parsers import FastJSONParser
+from .cache import cached_response
+from .export import EXPORT_FORMATS, iter_export
+from .fx import MissingRateError, get_rate_cache, is_currency_code
 from .models import Expense
-from .serializers import ExpenseSerializer
+from .pagination import ExpenseKeysetPagination
+from .parsers import NDJSONParser
+from .receipts import HashingUploadHandler, file_response, store_receipt
+from .search import ExpenseSearchFilter
+from .serializers import EXPENSE_LIST_FIELDS, BulkExpenseSerializer, ExpenseSerializer, ReceiptSerializer, serialize_expense_rows
+from .signals import expenses_bulk_created
+from .summary import parse_breakdowns, summarize_expenses
+from .timeline import build_timeline, parse_timeline_range
 import logging
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Bulk ingestion limits
+BULK_MAX_ROWS = 10000
+BULK_BATCH_SIZE = 500
+BULK_MAX_BATCH_SIZE = 5000
+
+
+@contextmanager
+def rates_required():
+    """
+    Run an expense write atomically and report an FX rate it needs but
+    that is not loaded (for the trip counters) as a validation error
+    instead of a server error, without keeping half of the write.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except MissingRateError as exc:
+        raise ValidationError({'currency': [str(exc)]})
+
 class ExpenseViewSet(viewsets.ModelViewSet):
     """
     A viewset for viewing and editing expense instances.
     """
     serializer_class = ExpenseSerializer
     # permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ExpenseSearchFilter]
     filterset_fields = ['category']
     search_fields = ['description', 'category']
     ordering_fields = ['created_at', 'amount', 'category']
     ordering = ['-created_at']
+    pagination_class = ExpenseKeysetPagination
     
     def get_queryset(self):
         """
@@ -38,7 +78,16 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         # Log the create action
         # logger.info(f"User {self.request.user.username} creating new expense")
         # serializer.save(user=self.request.user)
-        serializer.save()
+        with rates_required():
+            serializer.save()
+    
+    def perform_update(self, serializer):
+        with rates_required():
+            serializer.save()
+    
+    def perform_destroy(self, instance):
+        with rates_required():
+            instance.delete()
     
     def create(self, request, *args, **kwargs):
         """
@@ -71,15 +120,12 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         logger.warning(f"Expense creation failed with errors: {serializer.errors}")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    def list(self, request, *args, **kwargs):
+    def filter_date_range(self, queryset):
         """
-        Override list method to add custom filtering and metadata.
+        Apply the optional start_date/end_date query parameters.
         """
-        # Optional: Add date range filtering
-        start_date = request.query_params.get('start_date', None)
-        end_date = request.query_params.get('end_date', None)
-        
-        queryset = self.get_queryset()
+        start_date = self.request.query_params.get('start_date', None)
+        end_date = self.request.query_params.get('end_date', None)
         
         if start_date:
             queryset = queryset.filter(created_at__gte=start_date)
@@ -87,34 +133,294 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         if end_date:
             queryset = queryset.filter(created_at__lte=end_date)
         
-        # Apply filters from filter backends
-        queryset = self.filter_queryset(queryset)
+        return queryset
+    
+    def get_currency(self):
+        """
+        Return the currency totals are reported in: ?currency=, else the
+        authenticated user's base currency, else DEFAULT_CURRENCY.
+        """
+        currency = self.request.query_params.get('currency')
+        if currency:
+            currency = currency.upper()
+            if not is_currency_code(currency):
+                raise ValidationError({'currency': ["Must be a three-letter ISO 4217 code."]})
+            return currency
+        return getattr(self.request.user, 'base_currency', None) or settings.DEFAULT_CURRENCY
+    
+    def get_filtered_queryset(self):
+        """
+        Return the queryset with date range and filter backends applied.
+        """
+        queryset = self.filter_date_range(self.get_queryset())
+        return self.filter_queryset(queryset)
+    
+    @action(detail=False, methods=['post'], parser_classes=[FastJSONParser, NDJSONParser])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create many expenses from a JSON array or an NDJSON body.
         
-        # Calculate total amount if requested
+        Every row is validated with the expense serializer and the
+        positive amount rule; valid rows are inserted with bulk_create in
+        batches of ?batch_size= inside one transaction, and invalid rows are
+        reported by index without failing the rest.
+        """
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response(
+                {"detail": "Expected a JSON array or NDJSON body of expenses."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not rows:
+            return Response({"detail": "No expenses provided."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > BULK_MAX_ROWS:
+            return Response(
+                {"detail": f"At most {BULK_MAX_ROWS} expenses can be created per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            batch_size = min(int(request.query_params.get('batch_size', BULK_BATCH_SIZE)), BULK_MAX_BATCH_SIZE)
+        except ValueError:
+            batch_size = BULK_BATCH_SIZE
+        batch_size = max(batch_size, 1)
+        
+        context = self.get_serializer_context()
+        context['users'] = BulkExpenseSerializer.preload_users(rows)
+        context['trips'] = BulkExpenseSerializer.preload_trips(rows)
+        serializer = BulkExpenseSerializer(data=rows, many=True, context=context)
+        
+        # Load today's rate of every currency the rows are converted between
+        # with one query, rather than one per row
+        currencies = {str(row.get('currency') or settings.DEFAULT_CURRENCY).upper() for row in rows if isinstance(row, dict)}
+        currencies.update(user.base_currency for user in context['users'].values())
+        currencies.update(trip.currency for trip in context['trips'].values())
+        today = timezone.localdate()
+        get_rate_cache().preload_pairs((currency, today) for currency in currencies if is_currency_code(currency))
+        
+        # Validate row by row with the list's child serializer so that one
+        # bad row does not discard the whole payload
+        expenses = []
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                validated_data = serializer.child.run_validation(row)
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+                continue
+            if float(validated_data.get('amount', 0)) <= 0:
+                errors.append({'index': index, 'errors': {"detail": "Amount must be positive."}})
+                continue
+            if validated_data.get('user') is None:
+                # Expense.user is not nullable, reject here rather than
+                # failing the whole insert
+                errors.append({'index': index, 'errors': {'user': ["This field is required."]}})
+                continue
+            expenses.append(Expense(**validated_data))
+        
+        if expenses:
+            with rates_required():
+                Expense.objects.bulk_create(expenses, batch_size=batch_size)
+                expenses_bulk_created.send(sender=Expense, expenses=expenses)
+        
+        logger.info(f"Bulk expense ingestion: {len(expenses)} created, {len(errors)} rejected")
+        
+        return Response(
+            {
+                'created': len(expenses),
+                'ids': [expense.id for expense in expenses],
+                'errors': errors,
+            },
+            status=status.HTTP_201_CREATED if expenses else status.HTTP_400_BAD_REQUEST
+        )
+    
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        """
+        Override list method to add custom filtering and metadata.
+        """
+        queryset = self.get_filtered_queryset()
+        
+        # Summarize in the database if requested
         include_total = request.query_params.get('include_total', 'false').lower() == 'true'
-        total_amount = None
+        summary = None
         if include_total:
-            total_amount = sum(expense.amount for expense in queryset)
+            breakdowns = parse_breakdowns(request.query_params.get('breakdown'))
+            try:
+                summary = summarize_expenses(queryset, self.get_currency(), breakdowns)
+            except MissingRateError as exc:
+                return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
         
+        # Read plain rows; serialize_expense_rows matches ExpenseSerializer output.
+        # Annotations (e.g. the search rank) are kept for the paginator's cursor.
+        rows = queryset.values(*EXPENSE_LIST_FIELDS, *queryset.query.annotations)
+
         # Paginate the results
-        page = self.paginate_queryset(queryset)
+        page = self.paginate_queryset(rows)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            response = self.get_paginated_response(serializer.data)
+            response = self.get_paginated_response(serialize_expense_rows(page))
             if include_total:
-                response.data['total_amount'] = total_amount
+                response.data['total_amount'] = summary['total_amount']
+                response.data['summary'] = summary
             return response
         
-        serializer = self.get_serializer(queryset, many=True)
         response_data = {
-            'results': serializer.data
+            'results': serialize_expense_rows(rows)
         }
         
         if include_total:
-            response_data['total_amount'] = total_amount
+            response_data['total_amount'] = summary['total_amount']
+            response_data['summary'] = summary
         
         return Response(response_data)
     
+    @action(detail=False, methods=['get'])
+    @cached_response
+    def summary(self, request, *args, **kwargs):
+        """
+        Return total, count, min, max and average amount for the filtered
+        expenses in the base currency (or ?currency=), with optional
+        ?breakdown=category,month groupings.
+        """
+        queryset = self.get_filtered_queryset()
+        breakdowns = parse_breakdowns(request.query_params.get('breakdown'))
+        try:
+            return Response(summarize_expenses(queryset, self.get_currency(), breakdowns))
+        except MissingRateError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+    
+    @action(detail=False, methods=['get'])
+    @cached_response
+    def timeline(self, request, *args, **kwargs):
+        """
+        Return daily or weekly (?interval=week) buckets between ?start_date=
+        and ?end_date= with totals, running totals and per-category
+        amounts in the base currency (or ?currency=), optionally for one
+        ?user=. The response size depends on
+        the number of buckets, not on the number of expenses.
+        """
+        try:
+            start, end = parse_timeline_range(
+                request.query_params.get('interval', 'day'),
+                request.query_params.get('start_date'),
+                request.query_params.get('end_date'),
+            )
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        user_id = request.query_params.get('user')
+        if user_id:
+            if not user_id.isdigit():
+                return Response({"detail": "user must be a user id."}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(user_id=user_id)
+        
+        try:
+            timeline = build_timeline(queryset, request.query_params.get('interval', 'day'), start, end, self.get_currency())
+        except MissingRateError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(timeline)
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        """
+        Stream the filtered expenses as CSV or JSONL (?export_format=jsonl).
+        
+        Rows are read with a chunked values_list query and written as they
+        arrive, so memory use does not grow with the number of expenses.
+        """
+        export_format = request.query_params.get('export_format', 'csv').lower()
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"detail": f"export_format must be one of: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        queryset = self.get_filtered_queryset()
+        content_type, extension = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(iter_export(queryset, export_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="expenses.{extension}"'
+        
+        logger.info(f"Expense export started ({export_format})")
+        return response
+    
+    @action(detail=True, methods=['get'], parser_classes=[MultiPartParser])
+    def receipt(self, request, *args, **kwargs):
+        """
+        Stream the expense's receipt, or its thumbnail with ?thumbnail=true.
+        
+        Single byte ranges are answered with 206 Partial Content, and the
+        ETag is the content hash, so clients can resume downloads and
+        revalidate with If-None-Match.
+        """
+        expense = self.get_object()
+        receipt = expense.receipt
+        if receipt is None:
+            return Response({"detail": "This expense has no receipt."}, status=status.HTTP_404_NOT_FOUND)
+        
+        extension = os.path.splitext(receipt.file.name)[1]
+        if request.query_params.get('thumbnail', 'false').lower() == 'true':
+            if not receipt.thumbnail:
+                return Response({"detail": "This receipt has no thumbnail."}, status=status.HTTP_404_NOT_FOUND)
+            return file_response(
+                request, receipt.thumbnail, receipt.thumbnail.size, 'image/jpeg',
+                f'"{receipt.sha256}-thumbnail"', f'receipt-{expense.pk}-thumbnail.jpg',
+            )
+        return file_response(
+            request, receipt.file, receipt.size, receipt.content_type,
+            f'"{receipt.sha256}"', f'receipt-{expense.pk}{extension}',
+        )
+    
+    @receipt.mapping.post
+    def upload_receipt(self, request, *args, **kwargs):
+        """
+        Attach a receipt uploaded as the multipart field `file`.
+        
+        The upload streams to a temporary file while it is hashed, so it is
+        never held in memory, and is then moved into receipt storage. The
+        same content uploaded for any of a user's expenses is stored once
+        and shared between them.
+        """
+        # Must be set before the body is parsed
+        handler = HashingUploadHandler(max_size=settings.RECEIPT_MAX_SIZE)
+        request.upload_handlers = [handler]
+        expense = self.get_object()
+        
+        upload = request.FILES.get('file')
+        if handler.too_large:
+            return Response(
+                {"detail": f"Receipts may be at most {settings.RECEIPT_MAX_SIZE} bytes."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if upload is None:
+            return Response({"detail": "Upload the receipt as the multipart field 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            receipt, created = store_receipt(upload, expense.user)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            upload.close()
+        
+        # The rollups, trip counters and search index do not depend on the
+        # receipt, so skip save() and its receivers
+        Expense.objects.filter(pk=expense.pk).update(receipt=receipt, updated_at=timezone.now())
+        logger.info(f"Receipt {receipt.sha256[:12]} attached to expense {expense.pk} ({'stored' if created else 'deduplicated'})")
+        
+        data = ReceiptSerializer(receipt).data
+        data['deduplicated'] = not created
+        return Response(data, status=status.HTTP_201_CREATED)
+    
+    @receipt.mapping.delete
+    def delete_receipt(self, request, *args, **kwargs):
+        """
+        Detach the expense's receipt. Its file is kept while other expenses
+        share it and removed by the expenses.prune_receipts job otherwise.
+        """
+        expense = self.get_object()
+        Expense.objects.filter(pk=expense.pk).update(receipt=None, updated_at=timezone.now())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
     def update(self, request, *args, **kwargs):
         """
         Override update method for logging and validation.
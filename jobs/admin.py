@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from .models import Job, Schedule
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'status', 'run_at', 'attempts', 'max_attempts', 'locked_by', 'finished_at')
+    list_filter = ('status', 'task')
+
+
+@admin.register(Schedule)
+class ScheduleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'task', 'cron', 'enabled', 'next_run_at', 'last_run_at')
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+from django.utils import timezone
+
+# (name, lowest, highest) of the five cron fields; weekday 0 (or 7) is Sunday
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),
+)
+
+CRON_ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+# Give up looking for a match after this long (e.g. "0 0 30 2 *" never matches)
+MAX_SEARCH_DAYS = 366 * 9
+
+
+def parse_field(text, low, high):
+    """
+    Parse one cron field ("*", "5", "1-5", "*/15", "0-30/10", "1,15")
+    into the set of values it matches.
+    """
+    values = set()
+    for part in text.split(','):
+        spec, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = (int(value) for value in spec.split('-', 1))
+        else:
+            start = end = int(spec)
+            if step != 1:
+                # "5/15" means every 15 starting at 5
+                end = high
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f'{part!r} is out of range {low}-{high}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """
+    A standard five-field cron expression (minute hour day month weekday)
+    with numeric values, evaluated in the current time zone.
+
+    As in cron, when both day and weekday are restricted a time matches
+    if either of them does.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f'Invalid cron expression {expression!r}: expected {len(CRON_FIELDS)} fields')
+        try:
+            self.minutes, self.hours, self.days, self.months, weekdays = (
+                parse_field(text, low, high) for text, (_, low, high) in zip(fields, CRON_FIELDS)
+            )
+        except ValueError as exc:
+            raise ValueError(f'Invalid cron expression {expression!r}: {exc}') from None
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.day_restricted = not fields[2].startswith('*')
+        self.weekday_restricted = not fields[4].startswith('*')
+
+    def __str__(self):
+        return self.expression
+
+    def matches_day(self, moment):
+        day_match = moment.day in self.days
+        # Python counts weekdays from Monday, cron from Sunday
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_after(self, after):
+        """
+        Return the first aware datetime strictly after `after` that matches.
+        """
+        moment = timezone.localtime(after).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=MAX_SEARCH_DAYS)
+        # Skip whole months, days and hours that cannot match
+        while moment < limit:
+            if moment.month not in self.months:
+                year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+                moment = datetime(year, month, 1)
+            elif not self.matches_day(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return timezone.make_aware(moment)
+        raise ValueError(f'Cron expression {self.expression!r} never matches')
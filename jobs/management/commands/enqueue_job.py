@@ -0,0 +1,29 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from jobs.queue import enqueue
+from jobs.registry import registered_tasks
+
+
+class Command(BaseCommand):
+    help = "Queue a background job for `run_jobs` workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', nargs='?', help='Registered task name (omit to list them)')
+        parser.add_argument('--kwargs', default='{}', help='Task arguments as a JSON object')
+        parser.add_argument('--max-attempts', type=int)
+
+    def handle(self, *args, **options):
+        if not options['task']:
+            self.stdout.write('\n'.join(registered_tasks()))
+            return
+        try:
+            kwargs = json.loads(options['kwargs'])
+        except ValueError:
+            raise CommandError('--kwargs must be a JSON object')
+        if not isinstance(kwargs, dict):
+            raise CommandError('--kwargs must be a JSON object')
+        try:
+            job = enqueue(options['task'], kwargs, max_attempts=options['max_attempts'])
+        except LookupError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Queued {job}'))
@@ -0,0 +1,34 @@
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from jobs.queue import sync_schedules
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs and the JOB_SCHEDULES cron schedules. Start as "
+        "many workers as needed; a job is only ever run by one of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Jobs run at the same time (threads)')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between checks for due jobs')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due or running')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        try:
+            sync_schedules()
+        except (LookupError, ValueError) as exc:
+            raise CommandError(f'Invalid JOB_SCHEDULES: {exc}')
+
+        worker = Worker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+
+        def shutdown(signum, frame):
+            self.stderr.write(f'Stopping {worker.name}, waiting for running jobs')
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        worker.run(once=options['once'])
@@ -0,0 +1,70 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+JOB_STATUS_CHOICES = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('succeeded', 'Succeeded'),
+    ('failed', 'Failed')
+]
+
+
+class Job(models.Model):
+    """
+    One call of a registered task, stored so it survives restarts.
+
+    Workers claim queued jobs whose run_at has passed with a conditional
+    UPDATE (status still queued), so a job is only ever run by the worker
+    that set locked_by. Failed attempts are requeued with a later run_at
+    until max_attempts is reached. See jobs.queue.
+    """
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=JOB_STATUS_CHOICES, default='queued')
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=1)
+    # Worker holding the job while running, and when it last said it was alive
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    last_error = models.TextField(blank=True)
+    schedule = models.ForeignKey('Schedule', on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers poll for queued jobs that are due, oldest first
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+        ordering = ['-run_at', '-id']
+
+    def __str__(self):
+        return f"Job {self.pk} {self.task} ({self.status}, attempt {self.attempts}/{self.max_attempts})"
+
+
+class Schedule(models.Model):
+    """
+    Enqueues a job for `task` whenever `cron` matches.
+
+    Schedules named in JOB_SCHEDULES are created and updated from settings
+    when a worker starts; others can be added in the admin. Workers move
+    next_run_at forward with a conditional UPDATE before enqueueing, so
+    each occurrence is enqueued once however many workers are running.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    task = models.CharField(max_length=200)
+    cron = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    enabled = models.BooleanField(default=True)
+    next_run_at = models.DateTimeField()
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name}: {self.task} at '{self.cron}'"
@@ -0,0 +1,203 @@
+import random
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from travel_expense_management import metrics
+from .cron import CronExpression
+from .models import Job, Schedule
+from .registry import get_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the JOB_* settings
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_DELAY = 30
+DEFAULT_RETRY_MAX_DELAY = 3600
+DEFAULT_LEASE_SECONDS = 300
+
+
+def job_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(task_name, kwargs=None, run_at=None, max_attempts=None, schedule=None):
+    """
+    Queue a call of a registered task with a dict of JSON serializable kwargs.
+    Enqueue inside a transaction to have the job only if it commits.
+    """
+    get_task(task_name)
+    return Job.objects.create(
+        task=task_name,
+        kwargs=kwargs or {},
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or job_setting('JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+        schedule=schedule,
+    )
+
+
+def retry_delay(attempts):
+    """
+    Seconds before retrying a job that failed its nth attempt: exponential
+    backoff, capped, with jitter so failed jobs do not retry in lockstep.
+    """
+    base = job_setting('JOB_RETRY_BASE_DELAY', DEFAULT_RETRY_BASE_DELAY)
+    delay = min(job_setting('JOB_RETRY_MAX_DELAY', DEFAULT_RETRY_MAX_DELAY), base * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def claim_jobs(worker, limit, now=None):
+    """
+    Claim up to `limit` due jobs for `worker` and return them.
+
+    Candidates are read first, then taken with one UPDATE that still
+    requires status = queued; rows another worker took in between are
+    skipped, so no job is claimed twice. Works on any database, without
+    SELECT ... FOR UPDATE.
+    """
+    now = now or timezone.now()
+    candidate_ids = list(
+        Job.objects.filter(status='queued', run_at__lte=now)
+        .order_by('run_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    if not candidate_ids:
+        return []
+    Job.objects.filter(pk__in=candidate_ids, status='queued').update(
+        status='running',
+        locked_by=worker,
+        locked_at=now,
+        started_at=now,
+        attempts=F('attempts') + 1,
+    )
+    return list(
+        Job.objects.filter(pk__in=candidate_ids, status='running', locked_by=worker, locked_at=now)
+        .order_by('run_at', 'id')
+    )
+
+
+def run_job(job):
+    """
+    Run a claimed job and record its result, or requeue it with a backoff
+    delay if it raised and has attempts left. Returns the new status.
+
+    Updates require the job to still be locked by the claiming worker, so
+    a job that was requeued as stale and taken by another worker is not
+    overwritten.
+    """
+    mine = Job.objects.filter(pk=job.pk, status='running', locked_by=job.locked_by)
+    started = time.monotonic()
+    try:
+        func = get_task(job.task)
+    except LookupError as exc:
+        # Not retried, the task will not appear before a deploy
+        mine.update(status='failed', finished_at=timezone.now(), locked_by='', locked_at=None, last_error=str(exc))
+        logger.error(f"{job} failed: {exc}")
+        metrics.JOBS.inc(task=job.task, result='failed')
+        return 'failed'
+
+    try:
+        result = func(**job.kwargs)
+    except Exception as exc:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = retry_delay(job.attempts)
+            mine.update(status='queued', run_at=now + timedelta(seconds=delay), locked_by='', locked_at=None, last_error=error)
+            status = 'retried'
+            logger.warning(f"{job} failed, retrying in {delay:.0f}s: {exc!r}")
+        else:
+            mine.update(status='failed', finished_at=now, locked_by='', locked_at=None, last_error=error)
+            status = 'failed'
+            logger.error(f"{job} failed permanently: {exc!r}")
+    else:
+        mine.update(status='succeeded', result=result, finished_at=timezone.now(), locked_by='', locked_at=None)
+        status = 'succeeded'
+        logger.info(f"{job} succeeded in {time.monotonic() - started:.1f}s")
+
+    metrics.JOBS.inc(task=job.task, result=status)
+    metrics.JOB_DURATION.observe(time.monotonic() - started, task=job.task)
+    return status
+
+
+def heartbeat(worker, job_ids, now=None):
+    """
+    Refresh the lease of the jobs a worker is still running.
+    """
+    if job_ids:
+        Job.objects.filter(pk__in=job_ids, status='running', locked_by=worker).update(locked_at=now or timezone.now())
+
+
+def requeue_stale_jobs(now=None):
+    """
+    Requeue running jobs whose worker stopped renewing the lease (it
+    crashed or was killed), or fail them when out of attempts.
+    Returns the number of jobs requeued.
+    """
+    now = now or timezone.now()
+    expired = Job.objects.filter(
+        status='running',
+        locked_at__lt=now - timedelta(seconds=job_setting('JOB_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)),
+    )
+    lost = 'Worker stopped renewing its lease'
+    expired.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, locked_by='', locked_at=None, last_error=lost,
+    )
+    requeued = expired.update(status='queued', run_at=now, locked_by='', locked_at=None, last_error=lost)
+    if requeued:
+        logger.warning(f"Requeued {requeued} jobs of lost workers")
+    return requeued
+
+
+def sync_schedules(definitions=None, now=None):
+    """
+    Create or update the schedules defined in JOB_SCHEDULES
+    ({name: {'task': ..., 'cron': ..., 'kwargs': {...}}}).
+    A schedule whose cron or task changed gets a new next_run_at.
+    """
+    now = now or timezone.now()
+    if definitions is None:
+        definitions = job_setting('JOB_SCHEDULES', {})
+    for name, definition in definitions.items():
+        get_task(definition['task'])
+        cron = CronExpression(definition['cron'])
+        values = {'task': definition['task'], 'cron': definition['cron'], 'kwargs': definition.get('kwargs', {})}
+        # Workers starting together may race to create it, get_or_create copes
+        schedule, created = Schedule.objects.get_or_create(
+            name=name, defaults={'next_run_at': cron.next_after(now), **values},
+        )
+        if not created and any(getattr(schedule, field) != value for field, value in values.items()):
+            if (schedule.cron, schedule.task) != (values['cron'], values['task']):
+                schedule.next_run_at = cron.next_after(now)
+            for field, value in values.items():
+                setattr(schedule, field, value)
+            schedule.save()
+
+
+def enqueue_due_schedules(now=None):
+    """
+    Enqueue one job for every enabled schedule that is due. Missed
+    occurrences (no worker was running) are collapsed into one run.
+    Returns the jobs enqueued.
+    """
+    now = now or timezone.now()
+    jobs = []
+    for schedule in Schedule.objects.filter(enabled=True, next_run_at__lte=now):
+        try:
+            get_task(schedule.task)
+            next_run_at = CronExpression(schedule.cron).next_after(now)
+        except (LookupError, ValueError):
+            logger.exception(f"Skipping schedule {schedule.name}")
+            continue
+        with transaction.atomic():
+            # Only the worker that moves next_run_at enqueues the job
+            claimed = Schedule.objects.filter(pk=schedule.pk, next_run_at=schedule.next_run_at).update(
+                next_run_at=next_run_at, last_run_at=now,
+            )
+            if claimed:
+                jobs.append(enqueue(schedule.task, schedule.kwargs, schedule=schedule))
+    return jobs
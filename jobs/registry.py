@@ -0,0 +1,31 @@
+# Job functions by task name
+_tasks = {}
+
+
+def task(name):
+    """
+    Register the decorated function as a background job task.
+
+        @task('expenses.monthly_expense_report')
+        def generate_monthly_expense_report(...):
+
+    Jobs call it with their JSON kwargs; the return value must be JSON
+    serializable and is stored as the job result.
+    """
+    def decorator(func):
+        if _tasks.get(name, func) is not func:
+            raise ValueError(f'Task {name} is already registered')
+        _tasks[name] = func
+        return func
+    return decorator
+
+
+def get_task(name):
+    try:
+        return _tasks[name]
+    except KeyError:
+        raise LookupError(f'Unknown task {name}') from None
+
+
+def registered_tasks():
+    return sorted(_tasks)
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from expenses.models import MonthlyReportRun
+from .cron import CronExpression
+from .models import Job, Schedule
+from .queue import claim_jobs, enqueue, enqueue_due_schedules, requeue_stale_jobs, run_job, sync_schedules
+from .registry import task
+
+calls = []
+
+
+@task('jobs.tests.record')
+def record(value=None, fail_times=0):
+    calls.append(value)
+    if len(calls) <= fail_times:
+        raise RuntimeError('boom')
+    return {'value': value}
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class CronExpressionTests(TestCase):
+    def test_next_after(self):
+        cases = [
+            ('0 6 1 * *', utc(2025, 3, 14, 9, 30), utc(2025, 4, 1, 6, 0)),
+            ('0 7 * * 1', utc(2025, 3, 14, 9, 30), utc(2025, 3, 17, 7, 0)),
+            ('*/15 9-17 * * 1-5', utc(2025, 3, 14, 17, 50), utc(2025, 3, 17, 9, 0)),
+            ('30 0 * 2 *', utc(2025, 2, 28, 1, 0), utc(2026, 2, 1, 0, 30)),
+            # Day and weekday both restricted: either matches
+            ('0 0 13 * 5', utc(2025, 3, 1), utc(2025, 3, 7)),
+            ('@hourly', utc(2025, 3, 14, 9, 0), utc(2025, 3, 14, 10, 0)),
+        ]
+        for expression, after, expected in cases:
+            with self.subTest(expression):
+                self.assertEqual(CronExpression(expression).next_after(after), expected)
+
+    def test_invalid_expressions(self):
+        for expression in ('* * * *', '60 * * * *', '*/0 * * * *', 'x * * * *'):
+            with self.subTest(expression), self.assertRaises(ValueError):
+                CronExpression(expression)
+        with self.assertRaises(ValueError):
+            CronExpression('0 0 30 2 *').next_after(utc(2025, 1, 1))
+
+
+@override_settings(JOB_RETRY_BASE_DELAY=10, JOB_RETRY_MAX_DELAY=60)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_job_is_claimed_once(self):
+        job = enqueue('jobs.tests.record', {'value': 1})
+        self.assertEqual([claimed.pk for claimed in claim_jobs('worker-a', 10)], [job.pk])
+        self.assertEqual(claim_jobs('worker-b', 10), [])
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('running', 'worker-a', 1))
+
+    def test_runs_and_stores_result(self):
+        enqueue('jobs.tests.record', {'value': 'x'})
+        [job] = claim_jobs('worker', 1)
+        self.assertEqual(run_job(job), 'succeeded')
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.result, {'value': 'x'})
+        self.assertEqual(job.locked_by, '')
+
+    def test_retries_with_backoff_then_fails(self):
+        enqueue('jobs.tests.record', {'fail_times': 5}, max_attempts=2)
+
+        [job] = claim_jobs('worker', 1)
+        before = timezone.now()
+        self.assertEqual(run_job(job), 'retried')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=5))
+        self.assertIn('RuntimeError: boom', job.last_error)
+        # Not due yet
+        self.assertEqual(claim_jobs('worker', 1), [])
+
+        [job] = claim_jobs('worker', 1, now=job.run_at)
+        self.assertEqual(run_job(job), 'failed')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_requeues_jobs_of_lost_workers(self):
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        enqueue('jobs.tests.record', run_at=an_hour_ago)
+        [job] = claim_jobs('worker', 1, now=an_hour_ago)
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('queued', ''))
+        # The lost worker finishing late does not overwrite the new state
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+
+    def test_due_schedule_is_enqueued_once(self):
+        now = utc(2025, 3, 31, 12)
+        sync_schedules({'monthly': {'task': 'jobs.tests.record', 'cron': '0 6 1 * *', 'kwargs': {'value': 'm'}}}, now=now)
+        schedule = Schedule.objects.get(name='monthly')
+        self.assertEqual(schedule.next_run_at, utc(2025, 4, 1, 6))
+
+        self.assertEqual(enqueue_due_schedules(now=now), [])
+        due = utc(2025, 4, 1, 6, 0, 30)
+        [job] = enqueue_due_schedules(now=due)
+        self.assertEqual(enqueue_due_schedules(now=due), [])
+        self.assertEqual((job.task, job.kwargs, job.schedule_id), ('jobs.tests.record', {'value': 'm'}, schedule.pk))
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.next_run_at, utc(2025, 5, 1, 6))
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_runs_registered_monthly_report(self):
+        enqueue('expenses.monthly_expense_report')
+        [job] = claim_jobs('worker', 1)
+        self.assertEqual(run_job(job), 'succeeded')
+
+        job.refresh_from_db()
+        self.assertEqual(job.result['users'], 0)
+        self.assertEqual(MonthlyReportRun.objects.get().status, 'completed')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Job.objects.filter(status='succeeded').count(), 1)
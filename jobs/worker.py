@@ -0,0 +1,78 @@
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.db import close_old_connections
+from django.utils import timezone
+from . import queue
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+class Worker:
+    """
+    Runs due jobs on a thread pool of `concurrency` threads.
+
+    The main thread enqueues due schedules, requeues jobs of lost workers,
+    renews the lease of its running jobs and claims as many jobs as there
+    are idle threads, every `poll_interval` seconds or as soon as a job
+    finishes. stop() lets running jobs finish and claims nothing more.
+    Several workers, on one host or many, can share a database.
+    """
+
+    def __init__(self, concurrency=4, poll_interval=1.0, name=None):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = name or worker_name()
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def execute(self, job):
+        # Each pool thread has its own connection, drop it if it went bad
+        close_old_connections()
+        try:
+            return queue.run_job(job)
+        except Exception:
+            logger.exception(f"Could not record the outcome of {job}")
+        finally:
+            close_old_connections()
+
+    def run(self, once=False):
+        """
+        Process jobs until stop() is called, or with once=True until no
+        job is due or running.
+        """
+        logger.info(f"Worker {self.name} started with {self.concurrency} threads")
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as executor:
+            while not self.stopping.is_set():
+                for future in [future for future in running if future.done()]:
+                    running.pop(future)
+
+                now = timezone.now()
+                queue.requeue_stale_jobs(now)
+                queue.enqueue_due_schedules(now)
+                queue.heartbeat(self.name, [job.pk for job in running.values()], now)
+
+                claimed = queue.claim_jobs(self.name, self.concurrency - len(running), now) if len(running) < self.concurrency else []
+                for job in claimed:
+                    running[executor.submit(self.execute, job)] = job
+
+                if once and not running:
+                    break
+                if not claimed:
+                    if running:
+                        wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    else:
+                        self.stopping.wait(self.poll_interval)
+            if running:
+                logger.info(f"Worker {self.name} waiting for {len(running)} running jobs")
+        logger.info(f"Worker {self.name} stopped")
@@ -0,0 +1,89 @@
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from expenses.fx import RateCache
+from reports.rendering import render_report, render_row
+
+# Currencies of the converted rows, with their rate against the base currency
+FOREIGN_RATES = {'EUR': Decimal('0.92'), 'GBP': Decimal('0.79')}
+
+
+class Command(BaseCommand):
+    help = "Measure weekly report rendering throughput for an increasing number of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reports', type=int, default=10000)
+        parser.add_argument('--rows', type=int, default=25, help='Expenses per report')
+        parser.add_argument('--workers', default=None, help='Comma separated worker counts (default: 1, 2, 4 ... cpu count)')
+        parser.add_argument('--html', action='store_true')
+        parser.add_argument('--foreign-share', type=float, default=0.2, help='Share of expenses in another currency')
+
+    def build_jobs(self, count, rows_per_report, include_html, foreign_share=0.2):
+        """
+        Build render jobs from rows made by the renderer's own render_row,
+        converting the foreign currency rows with rates cached up front.
+        """
+        categories = ['transport', 'food', 'accommodation', 'misc']
+        week_start = date(2025, 3, 3)
+        days = [week_start + timedelta(days=offset) for offset in range(7)]
+        base_currency = settings.FX_RATE_BASE_CURRENCY
+        foreign = [currency for currency in FOREIGN_RATES if currency != base_currency]
+        rates = RateCache(maxsize=len(days) * len(foreign), timeout=24 * 60 * 60)
+        rates.store(((currency, day), FOREIGN_RATES[currency]) for currency in foreign for day in days)
+
+        jobs = []
+        for report_id in range(count):
+            rows = []
+            for index in range(rows_per_report):
+                day = random.choice(days)
+                currency = random.choice(foreign) if foreign and random.random() < foreign_share else base_currency
+                rows.append(render_row(
+                    datetime(day.year, day.month, day.day, 12),
+                    random.choice(categories),
+                    f'Expense {index} for report {report_id}',
+                    Decimal(f'{random.uniform(1, 500):.2f}'),
+                    currency,
+                    base_currency,
+                    day,
+                    rates,
+                ))
+            jobs.append((report_id, '', rows, f'Weekly expense report {report_id}', include_html))
+        return jobs
+
+    def handle(self, *args, **options):
+        if options['workers']:
+            worker_counts = [int(value) for value in options['workers'].split(',')]
+        else:
+            worker_counts = [1]
+            while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+                worker_counts.append(worker_counts[-1] * 2)
+
+        jobs = self.build_jobs(options['reports'], options['rows'], options['html'], options['foreign_share'])
+        results = []
+
+        started = time.monotonic()
+        for job in jobs:
+            render_report(job)
+        inline = time.monotonic() - started
+        results.append({'workers': 0, 'seconds': round(inline, 3), 'reports_per_second': round(len(jobs) / inline, 1)})
+
+        for workers in worker_counts:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                started = time.monotonic()
+                for _ in executor.map(render_report, jobs, chunksize=max(1, len(jobs) // (workers * 16))):
+                    pass
+                elapsed = time.monotonic() - started
+            results.append({'workers': workers, 'seconds': round(elapsed, 3), 'reports_per_second': round(len(jobs) / elapsed, 1)})
+
+        self.stdout.write(json.dumps({
+            'reports': len(jobs),
+            'rows_per_report': options['rows'],
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }, indent=2))
@@ -0,0 +1,33 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from reports.models import WeeklyReport
+from reports.rendering import generate_report_files_in_batches
+
+
+class Command(BaseCommand):
+    help = "Render the CSV (and optionally HTML) files of weekly reports in a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--week-start', help='Only reports for this week, as YYYY-MM-DD')
+        parser.add_argument('--status', default='submitted', help='Only reports with this status (default: submitted)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--html', action='store_true', help='Also write an HTML version of each report')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        reports = WeeklyReport.objects.filter(status=options['status']).order_by('id')
+        if options['week_start']:
+            try:
+                week_start = datetime.strptime(options['week_start'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--week-start must be formatted as YYYY-MM-DD')
+            reports = reports.filter(week_start=week_start)
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            rendered, skipped = generate_report_files_in_batches(
+                reports, executor, include_html=options['html'], batch_size=options['batch_size'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'{rendered} report files rendered, {skipped} up to date'))
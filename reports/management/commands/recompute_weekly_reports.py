@@ -0,0 +1,22 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from reports.models import WeeklyReport
+from reports.totals import recompute_report_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute total_amount of the weekly reports for a week from expenses."
+
+    def add_arguments(self, parser):
+        parser.add_argument('week_start', help='First day of the week as YYYY-MM-DD')
+        parser.add_argument('--status', default='draft', help='Only recompute reports with this status (default: draft)')
+
+    def handle(self, *args, **options):
+        try:
+            week_start = datetime.strptime(options['week_start'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError('week_start must be formatted as YYYY-MM-DD')
+
+        reports = WeeklyReport.objects.filter(week_start=week_start, status=options['status'])
+        count = recompute_report_totals(reports.only('id', 'user_id', 'week_start', 'week_end'))
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {count} reports'))
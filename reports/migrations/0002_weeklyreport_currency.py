@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 21:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weeklyreport',
+            name='currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from users.models import CustomUser
 
@@ -9,6 +10,8 @@ class WeeklyReport(models.Model):
     week_end = models.DateField()
     status = models.CharField(max_length=10, default='draft')
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    # The user's base currency when total_amount was computed
+    currency = models.CharField(max_length=3, default=settings.DEFAULT_CURRENCY)
     report_file = models.FileField(upload_to='reports/%Y/%m/', null=True, blank=True)
     submitted_at = models.DateTimeField(null=True, blank=True)
     comments = models.TextField(blank=True)
@@ -0,0 +1,228 @@
+import csv
+import hashlib
+import html
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import StringIO
+from itertools import groupby
+from operator import itemgetter
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from expenses.fx import get_rate_cache
+from expenses.models import Expense
+from .models import WeeklyReport
+from .totals import week_range
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rendered layout changes so cached files are regenerated
+REPORT_FORMAT_VERSION = '2'
+
+# Amount is in the user's base currency; the original amount and currency
+# are filled in for expenses in other currencies
+REPORT_HEADER = ['Date', 'Category', 'Description', 'Amount', 'Original Amount', 'Original Currency']
+
+CENTS = Decimal('0.01')
+
+# Renders triggered from requests run here, off the request thread
+_background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report-render')
+
+
+def report_digest(rows):
+    """
+    Hash the rows a report is rendered from. Reports whose file name
+    already carries this digest are up to date and are not re-rendered.
+    """
+    digest = hashlib.sha256(REPORT_FORMAT_VERSION.encode('ascii'))
+    for row in rows:
+        digest.update('\x1f'.join(row).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def sum_amounts(rows):
+    return sum((Decimal(row[3]) for row in rows), Decimal('0.00'))
+
+
+def render_report_csv(rows):
+    """
+    Render report rows (date, category, description, amount, original
+    amount, original currency strings) as CSV.
+    Pure function so it can run in a worker process.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPORT_HEADER)
+    writer.writerows(rows)
+    writer.writerow(['', '', 'Total', str(sum_amounts(rows))])
+    return buffer.getvalue().encode('utf-8')
+
+
+def render_report_html(rows, title):
+    """
+    Render report rows as a standalone HTML table.
+    """
+    lines = [
+        '<!DOCTYPE html>',
+        f'<html><head><meta charset="utf-8"><title>{html.escape(title)}</title></head><body>',
+        f'<h1>{html.escape(title)}</h1>',
+        '<table>',
+        '<tr>' + ''.join(f'<th>{column}</th>' for column in REPORT_HEADER) + '</tr>',
+    ]
+    for row in rows:
+        lines.append('<tr>' + ''.join(f'<td>{html.escape(value)}</td>' for value in row) + '</tr>')
+    lines.append(f'<tr><td></td><td></td><th>Total</th><th>{sum_amounts(rows)}</th><td></td><td></td></tr>')
+    lines.append('</table></body></html>')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def render_report(job):
+    """
+    Render one report job (report_id, digest, rows, title, include_html).
+    Returns (report_id, digest, csv_bytes, html_bytes or None).
+    """
+    report_id, digest, rows, title, include_html = job
+    csv_content = render_report_csv(rows)
+    html_content = render_report_html(rows, title) if include_html else None
+    return report_id, digest, csv_content, html_content
+
+
+def render_row(created_at, category, description, amount, currency, base_currency, day, rates):
+    if currency == base_currency:
+        return (created_at.strftime('%Y-%m-%d'), category, description, str(amount), '', '')
+    converted = rates.convert(amount, currency, base_currency, day).quantize(CENTS)
+    return (created_at.strftime('%Y-%m-%d'), category, description, str(converted), str(amount), currency)
+
+
+def fetch_report_rows(reports):
+    """
+    Load the expense rows of many reports with one query per distinct week,
+    converting amounts into each user's base currency with the rates of
+    the week loaded in at most one more query.
+    Returns {report_id: [(date, category, description, amount,
+    original_amount, original_currency), ...]}.
+    """
+    rates = get_rate_cache()
+    weeks = defaultdict(list)
+    for report in reports:
+        weeks[(report.week_start, report.week_end)].append(report)
+
+    rows_by_report = {}
+    for (week_start, week_end), week_reports in weeks.items():
+        start, end = week_range(week_start, week_end)
+        rows = (
+            Expense.objects.filter(
+                user_id__in={report.user_id for report in week_reports},
+                created_at__gte=start,
+                created_at__lt=end,
+            )
+            .order_by('user_id', 'created_at', 'id')
+            .values_list('user_id', 'created_at', 'category', 'description', 'amount', 'currency', 'user__base_currency')
+        )
+        rows = [row + (timezone.localtime(row[1]).date(),) for row in rows]
+        rates.preload_pairs(
+            pair for _, _, _, _, _, currency, base_currency, day in rows if currency != base_currency
+            for pair in ((currency, day), (base_currency, day))
+        )
+        rows_by_user = {
+            user_id: [
+                render_row(created_at, category, description, amount, currency, base_currency, day, rates)
+                for _, created_at, category, description, amount, currency, base_currency, day in user_rows
+            ]
+            for user_id, user_rows in groupby(rows, key=itemgetter(0))
+        }
+        for report in week_reports:
+            rows_by_report[report.id] = rows_by_user.get(report.user_id, [])
+    return rows_by_report
+
+
+def report_file_name(report, digest):
+    return f'weekly_report_{report.id}_{digest[:16]}.csv'
+
+
+def generate_report_files(reports, executor=None, include_html=False):
+    """
+    Render report files for the given reports and attach them.
+
+    Rows are loaded in the calling thread, reports whose file already
+    matches the content digest are skipped, and the rest are rendered on
+    `executor` (e.g. a ProcessPoolExecutor) or inline when it is None.
+    Returns (rendered, skipped) counts.
+    """
+    reports = {report.id: report for report in reports}
+    rows_by_report = fetch_report_rows(reports.values())
+
+    jobs = []
+    for report_id, rows in rows_by_report.items():
+        report = reports[report_id]
+        digest = report_digest(rows)
+        if report.report_file and os.path.basename(report.report_file.name) == report_file_name(report, digest):
+            continue
+        title = f'Weekly expense report {report.week_start} - {report.week_end}'
+        jobs.append((report_id, digest, rows, title, include_html))
+
+    if executor is None:
+        results = map(render_report, jobs)
+    else:
+        results = executor.map(render_report, jobs, chunksize=max(1, len(jobs) // 100))
+
+    rendered = []
+    for report_id, digest, csv_content, html_content in results:
+        report = reports[report_id]
+        old_name = report.report_file.name if report.report_file else None
+        name = report_file_name(report, digest)
+        report.report_file.save(name, ContentFile(csv_content), save=False)
+        if html_content is not None:
+            default_storage.save(report.report_file.name[:-len('.csv')] + '.html', ContentFile(html_content))
+        if old_name:
+            default_storage.delete(old_name)
+            default_storage.delete(old_name[:-len('.csv')] + '.html')
+        rendered.append(report)
+
+    WeeklyReport.objects.bulk_update(rendered, ['report_file'], batch_size=500)
+    skipped = len(reports) - len(rendered)
+    logger.info(f"Weekly report files: {len(rendered)} rendered, {skipped} up to date")
+    return len(rendered), skipped
+
+
+def generate_report_files_in_batches(reports, executor=None, include_html=False, batch_size=1000):
+    """
+    Run generate_report_files over a queryset of reports in id order,
+    `batch_size` reports at a time. Returns (rendered, skipped) counts.
+    """
+    reports = reports.order_by('id')
+    rendered = skipped = 0
+    last_id = 0
+    while True:
+        batch = list(reports.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        batch_rendered, batch_skipped = generate_report_files(batch, executor, include_html=include_html)
+        rendered += batch_rendered
+        skipped += batch_skipped
+    return rendered, skipped
+
+
+def _generate_in_background(report_ids):
+    close_old_connections()
+    try:
+        generate_report_files(WeeklyReport.objects.filter(id__in=report_ids))
+    except Exception:
+        logger.exception(f"Failed to render weekly report files for {report_ids}")
+    finally:
+        close_old_connections()
+
+
+def schedule_report_files(report_ids):
+    """
+    Render report files on the background thread once the current
+    transaction commits.
+    """
+    report_ids = list(report_ids)
+    transaction.on_commit(lambda: _background_executor.submit(_generate_in_background, report_ids))
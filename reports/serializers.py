@@ -8,10 +8,42 @@ REPORT_STATUS_CHOICES = [
     ('rejected', 'Rejected')
 ]
 
+# Statuses a report can move to from each status
+REPORT_STATUS_TRANSITIONS = {
+    'draft': ['submitted'],
+    'submitted': ['approved', 'rejected'],
+    'approved': [],
+    'rejected': ['draft', 'submitted'],
+}
+
 class WeeklyReportSerializer(serializers.ModelSerializer):
     status = serializers.ChoiceField(choices=REPORT_STATUS_CHOICES)
 
     class Meta:
         model = WeeklyReport
         fields = ['id', 'user', 'week_start', 'week_end', 'status', 
-                 'total_amount', 'report_file', 'submitted_at', 'comments']
+                 'total_amount', 'currency', 'report_file', 'submitted_at', 'comments']
+        # The user comes from the request and total_amount is computed
+        # from the user's expenses for the week, in the user's base currency
+        read_only_fields = ['user', 'total_amount', 'currency']
+
+    def validate_status(self, value):
+        """
+        Allow only the moves in REPORT_STATUS_TRANSITIONS; new reports
+        start as drafts. Approving and rejecting is done by managers with
+        bulk_status.
+        """
+        current = self.instance.status if self.instance is not None else 'draft'
+        if value == current:
+            return value
+        if value in ('approved', 'rejected'):
+            raise serializers.ValidationError("Reports are approved and rejected by their managers through bulk_status.")
+        if value not in REPORT_STATUS_TRANSITIONS.get(current, []):
+            raise serializers.ValidationError(f"Cannot change status from '{current}' to '{value}'.")
+        return value
+
+
+class BulkStatusTransitionSerializer(serializers.Serializer):
+    """Validates a bulk status change request"""
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=5000)
+    status = serializers.ChoiceField(choices=REPORT_STATUS_CHOICES)
@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+from django.utils import timezone
+from jobs.registry import task
+from .models import WeeklyReport
+from .rendering import generate_report_files_in_batches
+
+
+@task('reports.weekly_report_files')
+def generate_weekly_report_files(week_start=None, status='submitted', include_html=False):
+    """
+    Render the files of a week's reports, by default the week (Monday to
+    Sunday) before the current one. week_start is an ISO date string.
+    """
+    if week_start is None:
+        today = timezone.localdate()
+        start = today - timedelta(days=today.weekday() + 7)
+    else:
+        start = date.fromisoformat(week_start)
+    reports = WeeklyReport.objects.filter(
+        status=status, week_start__gte=start, week_start__lt=start + timedelta(days=7),
+    )
+    rendered, skipped = generate_report_files_in_batches(reports, include_html=include_html)
+    return {'week_start': start.isoformat(), 'rendered': rendered, 'skipped': skipped}
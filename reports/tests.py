@@ -1,3 +1,247 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from expenses.models import Expense
+from users.models import CustomUser
+from .models import WeeklyReport
+from .management.commands.benchmark_report_rendering import Command as BenchmarkRenderingCommand
+from .rendering import REPORT_HEADER, generate_report_files, render_report_csv, render_report_html, schedule_report_files
+from .totals import compute_report_total, recompute_report_totals
 
-# Create your tests here.
+
+def create_user(name, manager=None):
+    return CustomUser.objects.create_user(
+        username=name, email=f'{name}@example.com', employee_id=name, manager=manager,
+    )
+
+
+def create_report(user, status='draft', week_start=date(2025, 3, 3)):
+    return WeeklyReport.objects.create(
+        user=user, week_start=week_start, week_end=week_start + timedelta(days=6), status=status,
+    )
+
+
+def create_expense(user, amount, day, hour=12):
+    expense = Expense.objects.create(user=user, category='food', description='Meal', amount=Decimal(amount))
+    created_at = timezone.make_aware(datetime.combine(day, datetime.min.time()).replace(hour=hour))
+    Expense.objects.filter(pk=expense.pk).update(created_at=created_at)
+    return expense
+
+
+class ReportTotalTests(TestCase):
+    def setUp(self):
+        self.user = create_user('spender')
+        self.other = create_user('other')
+        # Week of Monday 3 March 2025, with expenses on its first and last
+        # day and just outside it
+        create_expense(self.user, '10.00', date(2025, 3, 3), hour=0)
+        create_expense(self.user, '20.00', date(2025, 3, 9), hour=23)
+        create_expense(self.user, '40.00', date(2025, 3, 10), hour=0)
+        create_expense(self.user, '80.00', date(2025, 3, 2), hour=23)
+        create_expense(self.other, '5.00', date(2025, 3, 5))
+
+    def test_total_covers_the_week_of_the_user(self):
+        self.assertEqual(compute_report_total(self.user, date(2025, 3, 3), date(2025, 3, 9)), Decimal('30.00'))
+        self.assertEqual(compute_report_total(self.other, date(2025, 3, 3), date(2025, 3, 9)), Decimal('5.00'))
+        self.assertEqual(compute_report_total(self.user, date(2025, 4, 7), date(2025, 4, 13)), Decimal('0.00'))
+
+    def test_recompute_queries_once_per_week(self):
+        reports = [
+            create_report(self.user), create_report(self.other),
+            create_report(self.user, week_start=date(2025, 3, 10)), create_report(self.other, week_start=date(2025, 3, 10)),
+        ]
+        # User currencies, one total per week, then the bulk update in a savepoint
+        with self.assertNumQueries(5):
+            self.assertEqual(recompute_report_totals(WeeklyReport.objects.only('id', 'user_id', 'week_start', 'week_end')), 4)
+
+        totals = dict(WeeklyReport.objects.values_list('id', 'total_amount'))
+        self.assertEqual(
+            [totals[report.id] for report in reports],
+            [Decimal('30.00'), Decimal('5.00'), Decimal('40.00'), Decimal('0.00')],
+        )
+
+    def test_command_recomputes_the_week_with_the_status(self):
+        draft = create_report(self.user)
+        submitted = create_report(self.other, status='submitted')
+        out = StringIO()
+        call_command('recompute_weekly_reports', '2025-03-03', stdout=out)
+        self.assertIn('Recomputed 1 reports', out.getvalue())
+
+        draft.refresh_from_db()
+        submitted.refresh_from_db()
+        self.assertEqual((draft.total_amount, submitted.total_amount), (Decimal('30.00'), Decimal('0.00')))
+
+        call_command('recompute_weekly_reports', '2025-03-03', '--status', 'submitted', stdout=StringIO())
+        submitted.refresh_from_db()
+        self.assertEqual(submitted.total_amount, Decimal('5.00'))
+
+    def test_creating_a_submitted_report_submits_it(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = client.post('/reports/', {
+                'week_start': '2025-03-03', 'week_end': '2025-03-09', 'status': 'submitted',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        report = WeeklyReport.objects.get()
+        self.assertEqual((report.status, report.total_amount), ('submitted', Decimal('30.00')))
+        self.assertIsNotNone(report.submitted_at)
+        # The report file is rendered once the request commits
+        self.assertEqual(len(callbacks), 1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            client.post('/reports/', {'week_start': '2025-03-10', 'week_end': '2025-03-16', 'status': 'draft'}, format='json')
+        self.assertIsNone(WeeklyReport.objects.get(week_start=date(2025, 3, 10)).submitted_at)
+        self.assertEqual(len(callbacks), 0)
+
+
+class ReportRenderingTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = create_user('renderer')
+        create_expense(self.user, '12.50', date(2025, 3, 4))
+        self.report = create_report(self.user, status='submitted')
+
+    def read_file(self, report):
+        report.refresh_from_db()
+        with report.report_file.open('rb') as report_file:
+            return report_file.read().decode('utf-8')
+
+    def test_render_csv_and_html(self):
+        rows = [('2025-03-04', 'food', 'Fish & <chips>', '12.50', '', ''), ('2025-03-05', 'misc', 'Map', '3.00', '2.80', 'EUR')]
+        self.assertEqual(
+            render_report_csv(rows).decode().splitlines(),
+            [
+                'Date,Category,Description,Amount,Original Amount,Original Currency',
+                '2025-03-04,food,Fish & <chips>,12.50,,',
+                '2025-03-05,misc,Map,3.00,2.80,EUR',
+                ',,Total,15.50',
+            ],
+        )
+        html = render_report_html(rows, 'Week <1>').decode()
+        self.assertIn('<title>Week &lt;1&gt;</title>', html)
+        self.assertIn('<td>Fish &amp; &lt;chips&gt;</td>', html)
+        self.assertIn('<th>Total</th><th>15.50</th>', html)
+
+    def test_unchanged_reports_are_not_rendered_again(self):
+        self.assertEqual(generate_report_files([self.report], include_html=True), (1, 0))
+        self.assertIn('2025-03-04,food,Meal,12.50,,', self.read_file(self.report))
+        first_name = self.report.report_file.name
+        self.assertTrue(self.report.report_file.storage.exists(first_name[:-len('.csv')] + '.html'))
+
+        self.assertEqual(generate_report_files([self.report]), (0, 1))
+        self.assertEqual(WeeklyReport.objects.get().report_file.name, first_name)
+
+        # New content gets a new file and the old one is removed
+        create_expense(self.user, '7.50', date(2025, 3, 6))
+        self.assertEqual(generate_report_files([WeeklyReport.objects.get()]), (1, 0))
+        self.assertIn(',,Total,20.00', self.read_file(self.report))
+        self.assertNotEqual(self.report.report_file.name, first_name)
+        self.assertFalse(self.report.report_file.storage.exists(first_name))
+
+    def test_files_are_scheduled_after_commit(self):
+        with mock.patch('reports.rendering._background_executor') as executor:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                schedule_report_files([self.report.id])
+                executor.submit.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        [(function, report_ids)] = [call.args for call in executor.submit.call_args_list]
+        self.assertEqual((function.__name__, report_ids), ('_generate_in_background', [self.report.id]))
+
+    def test_benchmark_renders_the_production_row_shape(self):
+        jobs = BenchmarkRenderingCommand().build_jobs(2, 5, False, foreign_share=1.0)
+        rows = [row for job in jobs for row in job[2]]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual({len(row) for row in rows}, {len(REPORT_HEADER)})
+        self.assertTrue(all(row[5] in ('EUR', 'GBP') and row[4] for row in rows))
+
+
+class ReportStatusTests(TestCase):
+    def setUp(self):
+        self.manager = create_user('manager')
+        self.member = create_user('member', self.manager)
+        self.outsider = create_user('outsider')
+        self.client = APIClient()
+
+    def patch_status(self, report, status):
+        self.client.force_authenticate(report.user)
+        return self.client.patch(f'/reports/{report.id}/', {'status': status}, format='json')
+
+    def test_patch_follows_the_transitions(self):
+        report = create_report(self.member)
+
+        response = self.patch_status(report, 'rejected')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json())
+
+        response = self.patch_status(report, 'submitted')
+        self.assertEqual(response.status_code, 200)
+        report.refresh_from_db()
+        self.assertEqual(report.status, 'submitted')
+        self.assertIsNotNone(report.submitted_at)
+
+        # Submitted reports are approved by the manager, not by their owner
+        self.assertEqual(self.patch_status(report, 'approved').status_code, 400)
+        self.assertEqual(self.patch_status(report, 'draft').status_code, 400)
+        self.assertEqual(WeeklyReport.objects.get(pk=report.pk).status, 'submitted')
+
+    def test_reports_cannot_be_created_approved(self):
+        self.client.force_authenticate(self.member)
+        response = self.client.post('/reports/', {
+            'week_start': '2025-03-03', 'week_end': '2025-03-09', 'status': 'approved',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WeeklyReport.objects.exists())
+
+    def bulk_status(self, user, ids, status):
+        self.client.force_authenticate(user)
+        response = self.client.post('/reports/bulk_status/', {'ids': ids, 'status': status}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_bulk_submit_sets_submitted_at(self):
+        drafts = [create_report(self.member, week_start=date(2025, 3, day)) for day in (3, 10)]
+        approved = create_report(self.member, status='approved', week_start=date(2025, 3, 17))
+
+        result = self.bulk_status(self.member, [drafts[0].id, drafts[1].id, approved.id, 999], 'submitted')
+
+        self.assertEqual(result['transitioned'], [drafts[0].id, drafts[1].id])
+        self.assertEqual(result['not_transitioned'], [
+            {'id': approved.id, 'reason': "Cannot change status from 'approved' to 'submitted'."},
+            {'id': 999, 'reason': 'Not found.'},
+        ])
+        for report in drafts:
+            report.refresh_from_db()
+            self.assertEqual(report.status, 'submitted')
+            self.assertIsNotNone(report.submitted_at)
+
+    def test_bulk_approval_is_limited_to_the_team(self):
+        team_report = create_report(self.member, status='submitted')
+        outsider_report = create_report(self.outsider, status='submitted')
+        own_report = create_report(self.manager, status='submitted')
+
+        result = self.bulk_status(self.manager, [team_report.id, outsider_report.id, own_report.id], 'approved')
+
+        self.assertEqual(result['transitioned'], [team_report.id])
+        self.assertEqual(
+            [item['id'] for item in result['not_transitioned']], [outsider_report.id, own_report.id],
+        )
+        self.assertEqual(
+            dict(WeeklyReport.objects.values_list('id', 'status')),
+            {team_report.id: 'approved', outsider_report.id: 'submitted', own_report.id: 'submitted'},
+        )
+
+        # Members cannot approve their manager's reports either
+        result = self.bulk_status(self.member, [own_report.id], 'approved')
+        self.assertEqual(result['transitioned'], [])
@@ -0,0 +1,67 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db.models import F
+from django.utils import timezone
+from expenses.fx import sum_converted
+from expenses.models import Expense
+from expenses.summary import _quantize
+from users.models import CustomUser
+from .models import WeeklyReport
+
+
+def week_range(week_start, week_end):
+    """
+    Return the [start, end) datetimes covering week_start..week_end inclusive.
+    """
+    start = timezone.make_aware(datetime.combine(week_start, time.min))
+    end = timezone.make_aware(datetime.combine(week_end + timedelta(days=1), time.min))
+    return start, end
+
+
+def compute_report_total(user, week_start, week_end):
+    """
+    Sum a user's expenses for a week in the user's base currency with one
+    aggregate query grouped by currency and date, converted with cached
+    FX rates.
+    """
+    start, end = week_range(week_start, week_end)
+    totals = sum_converted(
+        Expense.objects.filter(user=user, created_at__gte=start, created_at__lt=end), (), user.base_currency,
+    )
+    return _quantize(totals[()]['total_amount']) if totals else Decimal('0.00')
+
+
+def recompute_report_totals(reports):
+    """
+    Recompute total_amount and currency for many reports with one grouped
+    query per distinct week, each converting into every user's base
+    currency, and save them with a single bulk update.
+    Returns the number of reports updated.
+    """
+    weeks = defaultdict(list)
+    for report in reports:
+        weeks[(report.week_start, report.week_end)].append(report)
+
+    updated = [report for week_reports in weeks.values() for report in week_reports]
+    currencies = dict(
+        CustomUser.objects.filter(pk__in={report.user_id for report in updated}).values_list('pk', 'base_currency')
+    )
+    for (week_start, week_end), week_reports in weeks.items():
+        start, end = week_range(week_start, week_end)
+        totals = sum_converted(
+            Expense.objects.filter(
+                user_id__in={report.user_id for report in week_reports},
+                created_at__gte=start,
+                created_at__lt=end,
+            ),
+            ('user_id',),
+            F('user__base_currency'),
+        )
+        for report in week_reports:
+            total = totals.get((report.user_id,))
+            report.total_amount = _quantize(total['total_amount']) if total else Decimal('0.00')
+            report.currency = currencies[report.user_id]
+
+    WeeklyReport.objects.bulk_update(updated, ['total_amount', 'currency'], batch_size=500)
+    return len(updated)
@@ -1,6 +1,10 @@
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from .models import WeeklyReport
-from .serializers import WeeklyReportSerializer
+from .rendering import schedule_report_files
+from .serializers import REPORT_STATUS_TRANSITIONS, BulkStatusTransitionSerializer, WeeklyReportSerializer
+from .totals import compute_report_total, recompute_report_totals
 from django.utils import timezone
 
 class WeeklyReportViewSet(viewsets.ModelViewSet):
@@ -19,16 +23,136 @@ class WeeklyReportViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """
-        Save the report and associate it with the authenticated user
+        Save the report and associate it with the authenticated user,
+        computing total_amount from the user's expenses for the week.
+        Reports created as submitted get submitted_at and their file
+        rendered in the background, as on submission.
         """
-        serializer.save(user=self.request.user)
+        total_amount = compute_report_total(
+            self.request.user,
+            serializer.validated_data['week_start'],
+            serializer.validated_data['week_end'],
+        )
+        extra = {}
+        submitting = serializer.validated_data.get('status') == 'submitted'
+        if submitting:
+            extra['submitted_at'] = timezone.now()
+        report = serializer.save(
+            user=self.request.user, total_amount=total_amount, currency=self.request.user.base_currency, **extra,
+        )
+        if submitting:
+            schedule_report_files([report.id])
 
     def perform_update(self, serializer):
         """
-        Update the report and set submitted_at if status changes to submitted
+        Update the report and set submitted_at if status changes to submitted.
+        total_amount is recomputed on submission or when the week changes,
+        and the report file is rendered in the background once submitted.
         """
-        instance = self.get_object()
-        if instance.status != 'submitted' and serializer.validated_data.get('status') == 'submitted':
-            serializer.save(submitted_at=timezone.now())
+        instance = serializer.instance
+        validated_data = serializer.validated_data
+        week_start = validated_data.get('week_start', instance.week_start)
+        week_end = validated_data.get('week_end', instance.week_end)
+
+        extra = {}
+        submitting = instance.status != 'submitted' and validated_data.get('status') == 'submitted'
+        if submitting:
+            extra['submitted_at'] = timezone.now()
+        if submitting or (week_start, week_end) != (instance.week_start, instance.week_end):
+            extra['total_amount'] = compute_report_total(instance.user, week_start, week_end)
+            extra['currency'] = instance.user.base_currency
+        serializer.save(**extra)
+        if submitting:
+            schedule_report_files([instance.id])
+
+    def get_team_queryset(self, max_depth=None):
+        """
+        Reports of everyone under the authenticated user, at any depth
+        or down to max_depth levels
+        """
+        # All conditions on the hierarchy link must be in one filter() call
+        # so they apply to the same joined row
+        links = {
+            'user__ancestor_links__ancestor': self.request.user,
+            'user__ancestor_links__depth__gt': 0,
+        }
+        if max_depth is not None:
+            links['user__ancestor_links__depth__lte'] = max_depth
+        return WeeklyReport.objects.filter(**links)
+
+    @action(detail=False, methods=['post'])
+    def bulk_status(self, request):
+        """
+        Move many reports to one status with a single conditional UPDATE.
+
+        Approving and rejecting applies to the reports of the user's team,
+        other transitions to the user's own reports. Transitions are checked
+        against REPORT_STATUS_TRANSITIONS in memory and the ids that could
+        not be transitioned are returned with the reason.
+        """
+        serializer = BulkStatusTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        target = serializer.validated_data['status']
+
+        if target in ('approved', 'rejected'):
+            scope = self.get_team_queryset()
         else:
-            serializer.save()
+            scope = self.get_queryset()
+        sources = [source for source, targets in REPORT_STATUS_TRANSITIONS.items() if target in targets]
+
+        current = dict(scope.filter(id__in=ids).values_list('id', 'status'))
+        eligible = [report_id for report_id in ids if current.get(report_id) in sources]
+
+        transitioned = []
+        if eligible:
+            changes = {'status': target}
+            if target == 'submitted':
+                changes['submitted_at'] = timezone.now()
+            # The status condition makes the update safe against concurrent changes
+            updated = WeeklyReport.objects.filter(id__in=eligible, status__in=sources).update(**changes)
+            if updated == len(eligible):
+                transitioned = eligible
+            else:
+                changed = set(WeeklyReport.objects.filter(id__in=eligible, status=target).values_list('id', flat=True))
+                transitioned = [report_id for report_id in eligible if report_id in changed]
+
+        if target == 'submitted' and transitioned:
+            recompute_report_totals(WeeklyReport.objects.filter(id__in=transitioned).only('id', 'user_id', 'week_start', 'week_end'))
+            schedule_report_files(transitioned)
+
+        transitioned_ids = set(transitioned)
+        not_transitioned = []
+        for report_id in ids:
+            if report_id in transitioned_ids:
+                continue
+            if report_id not in current:
+                reason = 'Not found.'
+            else:
+                reason = f"Cannot change status from '{current[report_id]}' to '{target}'."
+            not_transitioned.append({'id': report_id, 'reason': reason})
+
+        return Response({
+            'status': target,
+            'transitioned': transitioned,
+            'not_transitioned': not_transitioned,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def approval_queue(self, request):
+        """
+        List the submitted reports of everyone under the authenticated
+        manager, at any depth (or only ?depth=1 for direct reports), using
+        the manager hierarchy closure table.
+        """
+        max_depth = request.query_params.get('depth')
+        max_depth = int(max_depth) if max_depth and max_depth.isdigit() else None
+        queryset = self.get_team_queryset(max_depth).filter(status='submitted').order_by('submitted_at', 'id')
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
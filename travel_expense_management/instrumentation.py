@@ -0,0 +1,127 @@
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from . import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stats of the innermost active QueryStats block, if any
+_current_stats = ContextVar('query_stats', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    """
+    Context manager counting the SQL queries (and the time spent in them)
+    run by the current thread on every database while it is active.
+
+        with QueryStats() as stats:
+            ...
+        stats.queries, stats.sql_time
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+        self.started = None
+        self.elapsed = None
+        self._token = None
+        self._wrappers = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+
+    def __enter__(self):
+        self._wrappers = ExitStack()
+        for connection in connections.all():
+            self._wrappers.enter_context(connection.execute_wrapper(self))
+        self._token = _current_stats.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self.started
+        _current_stats.reset(self._token)
+        self._wrappers.close()
+        return False
+
+
+def current_stats():
+    return _current_stats.get()
+
+
+def record_serialization(seconds):
+    """
+    Add time spent rendering a response body to the active QueryStats.
+    """
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.serialization_time += seconds
+
+
+def get_query_budget(view_name, method):
+    """
+    Return the QUERY_BUDGETS entry of a URL name and HTTP method, keyed as
+    'view-name:METHOD', or None if the request has no budget.
+    """
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(f'{view_name}:{method}')
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Record query count, SQL time, serialization time and response size for
+    every request, and feed the request metrics.
+
+    Each request is logged as one key=value line on this module's logger.
+    With DEBUG on, the numbers are also returned as X-Query-* headers.
+    Requests whose view and method have an entry in QUERY_BUDGETS and run
+    more queries than it allows are logged as warnings, or raise
+    QueryBudgetExceeded when QUERY_BUDGET_RAISE is set (as it is under
+    `manage.py test`).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryStats() as stats:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        size = None if response.streaming else len(response.content)
+        metrics.observe_request(view_name, request.method, response.status_code, stats.elapsed, stats.queries, stats.sql_time)
+
+        logger.info(
+            f"method={request.method} path={request.path} view={view_name} status={response.status_code} "
+            f"queries={stats.queries} sql_ms={stats.sql_time * 1000:.1f} "
+            f"serialize_ms={stats.serialization_time * 1000:.1f} total_ms={stats.elapsed * 1000:.1f} "
+            f"bytes={size if size is not None else '-'}"
+        )
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(stats.queries)
+            response['X-Query-Time-Ms'] = f'{stats.sql_time * 1000:.1f}'
+            response['X-Serialization-Time-Ms'] = f'{stats.serialization_time * 1000:.1f}'
+            response['X-Response-Time-Ms'] = f'{stats.elapsed * 1000:.1f}'
+
+        budget = get_query_budget(view_name, request.method)
+        if budget is not None and stats.queries > budget:
+            message = f'{view_name}:{request.method} ran {stats.queries} queries, budget is {budget} ({request.method} {request.get_full_path()})'
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
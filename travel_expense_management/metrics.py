@@ -0,0 +1,325 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import Count
+from django.http import HttpResponse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of this process's samples to METRICS_DIR
+FLUSH_INTERVAL = 1.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricStore:
+    """
+    Samples of this process, keyed by (sample name, label pairs).
+
+    Updates only touch a dict under a lock. Every FLUSH_INTERVAL the dict
+    is written to this process's own file in METRICS_DIR (replaced
+    atomically, so no cross-process locking), and reads sum the files of
+    all running processes. Every sample is a sum, so merging is addition;
+    gauges are computed at scrape time and never written to the files.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.values = defaultdict(float)
+        self.file_name = f'metrics-{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.flushed_at = 0.0
+
+    def add(self, name, labels, amount):
+        with self.lock:
+            if os.getpid() != self.pid:
+                # Forked worker, start with an empty store of our own
+                self._reset()
+            self.values[(name, labels)] += amount
+            due = time.monotonic() - self.flushed_at >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def clear(self):
+        """
+        Forget this process's samples.
+        """
+        with self.lock:
+            self.values.clear()
+
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def flush(self):
+        directory = self.directory()
+        with self.lock:
+            self.flushed_at = time.monotonic()
+            if not directory:
+                return
+            samples = [[name, list(labels), value] for (name, labels), value in self.values.items()]
+            path = os.path.join(directory, self.file_name)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            temporary = f'{path}.tmp'
+            with open(temporary, 'w') as handle:
+                json.dump(samples, handle)
+            os.replace(temporary, path)
+        except OSError:
+            logger.exception(f"Could not write metrics to {path}")
+
+    def collect(self):
+        """
+        Return the summed samples of every process as {(name, labels): value}.
+        """
+        self.flush()
+        directory = self.directory()
+        if not directory or not os.path.isdir(directory):
+            with self.lock:
+                return dict(self.values)
+
+        totals = defaultdict(float)
+        for file_name in os.listdir(directory):
+            if not file_name.endswith('.json'):
+                continue
+            pid = file_pid(file_name)
+            if pid is not None and not process_alive(pid):
+                # Left behind by an exited process or an earlier server run
+                try:
+                    os.remove(os.path.join(directory, file_name))
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(directory, file_name)) as handle:
+                    samples = json.load(handle)
+            except (OSError, ValueError):
+                # Removed or being replaced, the next scrape will see it
+                continue
+            for name, labels, value in samples:
+                totals[(name, tuple(tuple(pair) for pair in labels))] += value
+        return totals
+
+
+def file_pid(file_name):
+    """
+    Return the pid in a metrics-<pid>-<id>.json file name, or None.
+    """
+    parts = file_name.split('-')
+    if len(parts) == 3 and parts[0] == 'metrics' and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running under another user
+        return True
+    return True
+
+
+store = MetricStore()
+atexit.register(store.flush)
+
+# Metric families by name, for HELP and TYPE lines
+registry = {}
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry[name] = self
+
+    def label_pairs(self, labels):
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        store.add(self.name, self.label_pairs(labels), amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        pairs = self.label_pairs(labels)
+        # Buckets are stored cumulative so samples from processes just add up
+        for bound in self.buckets:
+            if value <= bound:
+                store.add(f'{self.name}_bucket', pairs + (('le', repr(bound)),), 1)
+        store.add(f'{self.name}_bucket', pairs + (('le', '+Inf'),), 1)
+        store.add(f'{self.name}_sum', pairs, value)
+        store.add(f'{self.name}_count', pairs, 1)
+
+
+class Gauge(Metric):
+    """
+    Value computed at scrape time by `collect`, returning
+    [(label dict, value), ...]. Not stored.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status.', ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency by route.', ['route'])
+DB_QUERIES = Counter('db_queries_total', 'SQL queries run while handling requests, by route.', ['route'])
+DB_QUERY_SECONDS = Counter('db_query_seconds_total', 'Time spent in SQL queries while handling requests, by route.', ['route'])
+CACHE_REQUESTS = Counter('expense_response_cache_requests_total', 'Cached expense responses by view and result (hit, miss, not_modified).', ['view', 'result'])
+REPORT_USERS = Counter('expense_report_users_total', 'Users whose monthly expense report was processed.')
+REPORT_ROWS = Counter('expense_report_rows_total', 'Expense rows included in monthly expense reports.')
+REPORT_EMAILS = Counter('expense_report_emails_total', 'Monthly expense report emails by result (sent, failed).', ['result'])
+REPORT_RUNS = Counter('expense_report_runs_total', 'Finished monthly report runs by status (completed, failed).', ['status'])
+JOBS = Counter('background_jobs_total', 'Finished background job attempts by task and result (succeeded, retried, failed).', ['task', 'result'])
+JOB_DURATION = Histogram(
+    'background_job_duration_seconds', 'Background job attempt duration by task.', ['task'],
+    buckets=(1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0),
+)
+
+
+def _report_run_progress():
+    # Read from the checkpoint table, so runs in any process are visible
+    from expenses.models import MonthlyReportRun
+
+    latest = MonthlyReportRun.objects.order_by('-month').values_list('month', flat=True).first()
+    if latest is None:
+        return []
+    fields = ('users_processed', 'rows_processed', 'emails_sent', 'emails_failed')
+    return [
+        (
+            {
+                'month': run['month'].strftime('%Y-%m'), 'shard': run['shard_index'],
+                'shard_count': run['shard_count'], 'status': run['status'], 'field': field,
+            },
+            run[field],
+        )
+        for run in MonthlyReportRun.objects.filter(month=latest).values('month', 'shard_index', 'shard_count', 'status', *fields)
+        for field in fields
+    ]
+
+
+REPORT_RUN_PROGRESS = Gauge(
+    'expense_report_run_progress', 'Progress of the latest month\'s report runs, per shard.',
+    ['month', 'shard', 'shard_count', 'status', 'field'], collect=_report_run_progress,
+)
+
+
+def _jobs_by_status():
+    from jobs.models import Job
+
+    return [
+        ({'status': row['status']}, row['count'])
+        for row in Job.objects.order_by().values('status').annotate(count=Count('id'))
+    ]
+
+
+JOBS_BY_STATUS = Gauge('background_jobs', 'Stored background jobs by status.', ['status'], collect=_jobs_by_status)
+
+
+def observe_request(route, method, status, duration, queries, sql_time):
+    route = route or 'unmatched'
+    REQUESTS.inc(route=route, method=method, status=status)
+    REQUEST_LATENCY.observe(duration, route=route)
+    DB_QUERIES.inc(queries, route=route)
+    DB_QUERY_SECONDS.inc(sql_time, route=route)
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _family(sample_name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if sample_name.endswith(suffix) and isinstance(registry.get(sample_name[:-len(suffix)]), Histogram):
+            return sample_name[:-len(suffix)]
+    return sample_name
+
+
+def render_metrics():
+    """
+    Render all metrics, summed across processes, in the Prometheus text format.
+    """
+    samples = defaultdict(list)
+    for (name, labels), value in store.collect().items():
+        samples[_family(name)].append((name, labels, value))
+
+    for metric in registry.values():
+        if isinstance(metric, Gauge) and metric.collect is not None:
+            for labels, value in metric.collect():
+                samples[metric.name].append((metric.name, metric.label_pairs(labels), value))
+
+    lines = []
+    for family in sorted(set(registry) | set(samples)):
+        metric = registry.get(family)
+        if metric is not None:
+            lines.append(f'# HELP {family} {metric.documentation}')
+            lines.append(f'# TYPE {family} {metric.type}')
+        for name, labels, value in sorted(samples.get(family, ()), key=_sample_order):
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _sample_order(sample):
+    name, labels, _ = sample
+    # Histogram buckets in ascending bound order, +Inf last
+    return name, tuple((label, float(value) if label == 'le' else 0.0, value) for label, value in labels)
+
+
+def clear_metrics_dir():
+    """
+    Remove the samples of previous processes. Call once when the server
+    starts (e.g. from gunicorn's on_starting hook), before workers fork.
+    """
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory or not os.path.isdir(directory):
+        return
+    for file_name in os.listdir(directory):
+        if file_name.startswith('metrics-'):
+            os.remove(os.path.join(directory, file_name))
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint.
+    """
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
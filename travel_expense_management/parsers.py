@@ -0,0 +1,46 @@
+import io
+import json
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+UTF8_CHARSETS = ('utf-8', 'utf8')
+
+
+def json_loads(data):
+    """
+    Parse a JSON document (str or bytes), with orjson when it is installed.
+    Documents orjson rejects are re-parsed with json, which either accepts
+    them (e.g. integers over 64 bits) or raises its usual ValueError.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser that decodes UTF-8 bodies with orjson when it is installed.
+    Other encodings and bodies orjson rejects go through JSONParser, so
+    error messages and STRICT_JSON handling are unchanged.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        if orjson is None or encoding.lower() not in UTF8_CHARSETS:
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
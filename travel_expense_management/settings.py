@@ -45,11 +45,15 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',  # For JWT authentication
     'reports',  # Custom app for generating reports
     'users',  # Custom app for user management
+    'jobs',  # Database-backed background jobs and schedules
+    'trips',  # Trips with per-category budgets
     'django_extensions',  # For additional management commands and shell features
     
 ]
 
 MIDDLEWARE = [
+    # Outermost, so every query of the request is counted
+    'travel_expense_management.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,6 +94,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory per process; point this at Redis or Memcached in production
+# so every worker shares the expense response cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache used for expense list/summary responses and how long they are kept
+EXPENSE_RESPONSE_CACHE_ALIAS = 'default'
+EXPENSE_RESPONSE_CACHE_TIMEOUT = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -126,6 +146,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded and generated files (weekly report files)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -136,6 +160,16 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # orjson-backed when installed, stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': (
+        'travel_expense_management.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'travel_expense_management.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 # JWT settings
@@ -162,6 +196,11 @@ import os
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# Each process writes its metric samples here; /metrics sums all files.
+# Must be shared by every worker of one deployment and cleared on start.
+# Unset, /metrics only shows the samples of the process serving it.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -189,6 +228,14 @@ LOGGING = {
             'backupCount': 10,
             'formatter': 'verbose',
         },
+        'requests_file': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(LOGS_DIR, 'requests.log'),
+            'maxBytes': 10485760,  # 10MB
+            'backupCount': 10,
+            'formatter': 'verbose',
+        },
     },
     'loggers': {
         'django': {
@@ -201,5 +248,121 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'jobs': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'trips': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        # One line per request with query count and timings
+        'travel_expense_management.instrumentation': {
+            'handlers': ['requests_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
-}
\ No newline at end of file
+}
+
+# Maximum SQL queries per request, by URL name and HTTP method. Exceeding
+# one logs a warning, or raises when QUERY_BUDGET_RAISE is set (always
+# under the test runner below). expense-bulk and deleting a user have no
+# budget: the first runs a query per insert batch and per rollup row and
+# trip category the rows touch, the second cascades to every expense.
+QUERY_BUDGETS = {
+    # include_total adds the totals, a second aggregate when some expenses
+    # are in another currency than the totals, and one to load missing FX rates
+    'expense-list:GET': 4,
+    # Creates and updates also maintain the monthly rollup and, for
+    # expenses on a trip, the trip and trip category counters, in a savepoint
+    'expense-list:POST': 14,
+    'expense-detail:GET': 2,
+    # Moving an expense to another trip adjusts the counters of both trips
+    'expense-detail:PUT': 20,
+    'expense-detail:PATCH': 20,
+    'expense-detail:DELETE': 12,
+    # Every aggregate takes a second query when some expenses are in another
+    # currency than the totals, plus one to load missing FX rates
+    'expense-summary:GET': 8,
+    'expense-timeline:GET': 4,
+    'expense-receipt:GET': 2,
+    'expense-receipt:POST': 8,
+    'expense-receipt:DELETE': 2,
+    'weeklyreport-list:GET': 4,
+    'weeklyreport-list:POST': 4,
+    'weeklyreport-detail:GET': 2,
+    'weeklyreport-detail:PUT': 8,
+    'weeklyreport-detail:PATCH': 8,
+    'weeklyreport-detail:DELETE': 4,
+    'weeklyreport-approval-queue:GET': 3,
+    'weeklyreport-bulk-status:POST': 8,
+    'trip-list:GET': 3,
+    # The per-category budgets are written with the trip
+    'trip-list:POST': 6,
+    'trip-detail:GET': 3,
+    'trip-detail:PUT': 10,
+    'trip-detail:PATCH': 10,
+    'trip-detail:DELETE': 8,
+    'trip-summary:GET': 3,
+    'user-list:GET': 3,
+    # A new user is added to the hierarchy index under their manager
+    'user-list:POST': 8,
+    'user-detail:GET': 2,
+    # Changing a manager also moves the user's subtree in the hierarchy index
+    'user-detail:PUT': 12,
+    'user-detail:PATCH': 12,
+}
+QUERY_BUDGET_RAISE = False
+TEST_RUNNER = 'travel_expense_management.test_runner.ProjectTestRunner'
+
+# Background jobs, run by `manage.py run_jobs` workers.
+# Cron schedules by name: registered task, five-field cron expression in
+# TIME_ZONE, and optional kwargs. Synced to the database when a worker starts.
+JOB_SCHEDULES = {
+    'monthly-expense-reports': {'task': 'expenses.monthly_expense_report', 'cron': '0 6 1 * *'},
+    'weekly-report-files': {'task': 'reports.weekly_report_files', 'cron': '0 7 * * 1'},
+    'process-pending-receipts': {'task': 'expenses.process_pending_receipts', 'cron': '*/15 * * * *'},
+    'prune-receipts': {'task': 'expenses.prune_receipts', 'cron': '30 3 * * *'},
+}
+# Attempts before a job is marked failed; retries back off exponentially
+# from JOB_RETRY_BASE_DELAY up to JOB_RETRY_MAX_DELAY seconds
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_DELAY = 30
+JOB_RETRY_MAX_DELAY = 3600
+# Running jobs whose worker has not renewed the lease for this many
+# seconds are assumed lost and requeued
+JOB_LEASE_SECONDS = 300
+# Running monthly report runs without a checkpoint for this many seconds
+# are assumed lost and may be claimed by another worker
+REPORT_RUN_LEASE_SECONDS = 900
+
+# Currencies. Expenses and users default to DEFAULT_CURRENCY; totals are
+# converted into the user's base currency with the FX rate table, loaded
+# by `manage.py load_fx_rates`. Each rate is the units of a currency one
+# FX_RATE_BASE_CURRENCY buys on a date.
+DEFAULT_CURRENCY = 'USD'
+FX_RATE_BASE_CURRENCY = 'USD'
+# Dates without a published rate (weekends, holidays) use the latest
+# rate at most this many days older
+FX_RATE_MAX_AGE_DAYS = 7
+# In-process LRU cache of (currency, date) rates: maximum entries and
+# seconds before an entry is read again. load_fx_rates clears it in every
+# process sharing the EXPENSE_RESPONSE_CACHE_ALIAS cache; with a per-process
+# cache such as locmem, other processes only see new rates after the timeout
+FX_RATE_CACHE_SIZE = 20000
+FX_RATE_CACHE_TIMEOUT = 3600
+
+# Receipts. Stored once per distinct content under RECEIPT_ROOT, outside
+# MEDIA_ROOT, and only served through /expenses/{id}/receipt/.
+RECEIPT_ROOT = BASE_DIR / 'receipts'
+# Largest accepted upload in bytes; uploads stream to a temporary file
+RECEIPT_MAX_SIZE = 10 * 1024 * 1024
+# Threads per process reading metadata and rendering thumbnails of new receipts
+RECEIPT_PROCESSING_WORKERS = 2
+# Bounding box of thumbnails, rendered only when Pillow is installed
+RECEIPT_THUMBNAIL_SIZE = (320, 320)
+# Receipts no expense refers to are deleted once older than this many hours
+RECEIPT_PRUNE_AFTER_HOURS = 24
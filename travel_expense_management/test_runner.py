@@ -0,0 +1,25 @@
+import shutil
+import tempfile
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class ProjectTestRunner(DiscoverRunner):
+    """
+    Test runner that makes requests over their QUERY_BUDGETS entry raise
+    QueryBudgetExceeded, so query count regressions fail the suite, and
+    writes metric samples to a temporary METRICS_DIR.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._query_budget_raise = getattr(settings, 'QUERY_BUDGET_RAISE', False)
+        settings.QUERY_BUDGET_RAISE = True
+        self._metrics_dir = getattr(settings, 'METRICS_DIR', None)
+        settings.METRICS_DIR = tempfile.mkdtemp(prefix='metrics-')
+
+    def teardown_test_environment(self, **kwargs):
+        shutil.rmtree(settings.METRICS_DIR, ignore_errors=True)
+        settings.METRICS_DIR = self._metrics_dir
+        settings.QUERY_BUDGET_RAISE = self._query_budget_raise
+        super().teardown_test_environment(**kwargs)
@@ -17,13 +17,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),  # Include users URLs
     path('reports/', include('reports.urls')),  # Include reports URLs
     path('expenses/', include('expenses.urls')),  # Include expenses URLs
+    path('trips/', include('trips.urls')),  # Include trips URLs
     path('api-auth/', include('rest_framework.urls')),  # Include API auth URLs
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics', metrics_view, name='metrics'),  # Prometheus scrape endpoint
 ]
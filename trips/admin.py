@@ -0,0 +1,17 @@
+from django.contrib import admin
+
+from .models import Trip, TripBudget
+
+
+class TripBudgetInline(admin.TabularInline):
+    model = TripBudget
+    readonly_fields = ('spent_amount', 'expense_count')
+    extra = 0
+
+
+@admin.register(Trip)
+class TripAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'start_date', 'end_date', 'budget_amount', 'spent_amount', 'expense_count')
+    list_select_related = ('user',)
+    readonly_fields = ('spent_amount', 'expense_count')
+    inlines = [TripBudgetInline]
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class TripsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'trips'
+
+    def ready(self):
+        # Connect the budget counter receivers
+        from . import signals  # noqa: F401
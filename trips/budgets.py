@@ -0,0 +1,228 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Sum
+from django.dispatch import Signal
+from django.utils import timezone
+from expenses.counters import add_to_counter, aggregate_counters, compare_counters
+from expenses.fx import get_rate_cache
+from expenses.models import Expense
+from .models import Trip, TripBudget
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sent when an expense write takes a trip (category=None) or one of its
+# categories from within its budget to over it. Receivers get trip_id,
+# category, spent_amount and budget_amount. Sent inside the transaction of
+# the write; use transaction.on_commit for side effects.
+budget_exceeded = Signal()
+
+CENTS = Decimal('0.01')
+
+
+def trip_contributions(states, currencies=None):
+    """
+    Return (trip_id, category, amount) for each expense state tuple (see
+    expenses.counters), with the amount converted into the trip's currency
+    at the rate of the expense date and rounded to cents, or None for
+    missing states and expenses without a trip. One query reads the
+    currencies of trips missing from `currencies` and at most one loads
+    missing rates.
+    """
+    currencies = dict(currencies or {})
+    rows = []
+    for state in states:
+        if state is None:
+            rows.append((None,) * 5)
+            continue
+        _, trip_id, created_at, category, currency, amount = state
+        rows.append((trip_id, category, currency, created_at, amount))
+    trip_ids = {row[0] for row in rows if row[0] is not None} - set(currencies)
+    if trip_ids:
+        currencies.update(Trip.objects.filter(pk__in=trip_ids).values_list('pk', 'currency'))
+    return convert_to_trip_currency(
+        [row + (currencies.get(row[0]),) for row in rows]
+    )
+
+
+def convert_to_trip_currency(rows):
+    """
+    Convert (trip_id, category, currency, created_at, amount, trip_currency)
+    rows as trip_contributions() does.
+    """
+    rates = get_rate_cache()
+    days = [timezone.localtime(row[3]).date() if row[0] is not None else None for row in rows]
+    rates.preload_pairs(
+        pair for row, day in zip(rows, days) if row[0] is not None and row[5] is not None and row[2] != row[5]
+        for pair in ((row[2], day), (row[5], day))
+    )
+    contributions = []
+    for (trip_id, category, currency, created_at, amount, trip_currency), day in zip(rows, days):
+        if trip_id is None or trip_currency is None:
+            contributions.append(None)
+            continue
+        amount = rates.convert(Decimal(amount), currency, trip_currency, day)
+        contributions.append((trip_id, category, Decimal(amount).quantize(CENTS)))
+    return contributions
+
+
+def apply_delta(trip_id, category, count, amount):
+    """
+    Add count and amount to a trip's counters and to its category row,
+    creating the category row if needed. Two UPDATEs with F() expressions,
+    however many expenses the trip has.
+    """
+    amount = Decimal(amount)
+    if trip_id is None or (not count and not amount):
+        return
+
+    Trip.objects.filter(pk=trip_id).update(
+        spent_amount=F('spent_amount') + amount, expense_count=F('expense_count') + count,
+    )
+    add_to_counter(TripBudget, {'trip_id': trip_id, 'category': category}, spent_amount=amount, expense_count=count)
+
+    if amount > 0:
+        check_overspend(trip_id, category, amount)
+
+
+def check_overspend(trip_id, category, amount):
+    """
+    Send budget_exceeded if adding `amount` just took the trip or the
+    category over budget. Reads the two updated counter rows; under
+    concurrent writes only the write that crosses the budget sees it.
+    """
+    budget = (
+        TripBudget.objects.filter(trip_id=trip_id, category=category)
+        .values('spent_amount', 'budget_amount', 'trip__spent_amount', 'trip__budget_amount')
+        .first()
+    )
+    if budget is None:
+        return
+    for scope, spent, limit in (
+        (category, budget['spent_amount'], budget['budget_amount']),
+        (None, budget['trip__spent_amount'], budget['trip__budget_amount']),
+    ):
+        if limit is not None and spent - amount <= limit < spent:
+            logger.warning(f"Trip {trip_id} {scope or 'total'} is over budget: {spent} of {limit}")
+            budget_exceeded.send(
+                sender=Trip, trip_id=trip_id, category=scope, spent_amount=spent, budget_amount=limit,
+            )
+
+
+def record_changes(changes, expenses=()):
+    """
+    Move the contributions of changed expenses, given as (previous,
+    current, count) as sent with expenses_changed, with one update per
+    affected trip category. The trips already loaded on `expenses` save
+    reading their currencies.
+    """
+    # The serializer has usually loaded the trip already
+    known = {
+        expense.trip_id: expense.trip.currency for expense in expenses
+        if expense.trip_id is not None and Expense._meta.get_field('trip').is_cached(expense)
+    }
+    contributions = trip_contributions([state for previous, current, _ in changes for state in (previous, current)], known)
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    for index, contribution in enumerate(contributions):
+        if contribution is not None:
+            # Previous states are at even positions
+            count = changes[index // 2][2]
+            sign = count if index % 2 else -count
+            trip_id, category, amount = contribution
+            deltas[(trip_id, category)][0] += sign
+            deltas[(trip_id, category)][1] += sign * amount
+
+    for (trip_id, category), (count, amount) in deltas.items():
+        apply_delta(trip_id, category, count, amount)
+
+
+def budget_status(budget_amount, spent_amount):
+    remaining = None if budget_amount is None else budget_amount - spent_amount
+    return {
+        'budget_amount': budget_amount,
+        'spent_amount': spent_amount,
+        'remaining_amount': remaining,
+        'over_budget': remaining is not None and remaining < 0,
+    }
+
+
+def summarize_trip(trip):
+    """
+    Spent versus budget for a trip and each of its categories, from the
+    counters only. Uses prefetched budgets when available.
+    """
+    return {
+        'trip': trip.pk,
+        'name': trip.name,
+        'start_date': trip.start_date,
+        'end_date': trip.end_date,
+        'expense_count': trip.expense_count,
+        **budget_status(trip.budget_amount, trip.spent_amount),
+        'categories': [
+            {'category': budget.category, 'expense_count': budget.expense_count,
+             **budget_status(budget.budget_amount, budget.spent_amount)}
+            for budget in trip.budgets.all()
+        ],
+    }
+
+
+def compute_counters():
+    """
+    Aggregate the raw expense table into {(trip_id, category): (count, total)}.
+    Expenses in the trip's currency are summed in SQL; the others are
+    converted one by one, as the counters add them.
+    """
+    expenses = Expense.objects.filter(trip__isnull=False).order_by()
+    counters = aggregate_counters(expenses.filter(currency=F('trip__currency')), 'trip_id', 'category')
+    foreign = expenses.exclude(currency=F('trip__currency')).values_list(
+        'trip_id', 'category', 'currency', 'created_at', 'amount', 'trip__currency',
+    )
+    for trip_id, category, amount in convert_to_trip_currency(list(foreign)):
+        count, total_amount = counters.get((trip_id, category), (0, Decimal('0')))
+        counters[(trip_id, category)] = (count + 1, total_amount + amount)
+    return counters
+
+
+@transaction.atomic
+def rebuild_counters():
+    """
+    Recompute every trip and trip category counter from raw expenses,
+    keeping the budgets. Returns the number of category rows written.
+    """
+    counters = compute_counters()
+    trip_totals = defaultdict(lambda: [0, Decimal('0')])
+    for (trip_id, category), (count, total_amount) in counters.items():
+        trip_totals[trip_id][0] += count
+        trip_totals[trip_id][1] += Decimal(total_amount)
+
+    Trip.objects.update(spent_amount=0, expense_count=0)
+    for trip_id, (count, total_amount) in trip_totals.items():
+        Trip.objects.filter(pk=trip_id).update(spent_amount=total_amount, expense_count=count)
+
+    TripBudget.objects.update(spent_amount=0, expense_count=0)
+    # Drop rows that only existed to count expenses that are gone
+    TripBudget.objects.filter(budget_amount__isnull=True).delete()
+    for (trip_id, category), (count, total_amount) in counters.items():
+        TripBudget.objects.update_or_create(
+            trip_id=trip_id, category=category,
+            defaults={'spent_amount': total_amount, 'expense_count': count},
+        )
+    return len(counters)
+
+
+def verify_counters():
+    """
+    Compare the trip category counters with the raw expenses and return a
+    list of (key, expected, actual) mismatches, where values are (count, total).
+    """
+    expected = compute_counters()
+    actual = {
+        (row.trip_id, row.category): (row.expense_count, row.spent_amount)
+        for row in TripBudget.objects.exclude(expense_count=0, spent_amount=0)
+    }
+    for trip in Trip.objects.annotate(category_count=Sum('budgets__expense_count'), category_total=Sum('budgets__spent_amount')):
+        actual[(trip.pk, None)] = (trip.expense_count, trip.spent_amount)
+        expected[(trip.pk, None)] = (trip.category_count or 0, trip.category_total or Decimal('0'))
+
+    return compare_counters(expected, actual)
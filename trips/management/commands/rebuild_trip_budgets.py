@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from trips.budgets import rebuild_counters, verify_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuild the spent counters of trips and trip budgets from raw expenses and verify them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true', help='Only compare the counters with raw expenses')
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            count = rebuild_counters()
+            self.stdout.write(f'Rebuilt {count} trip category counters')
+
+        mismatches = verify_counters()
+        for key, expected, actual in mismatches[:20]:
+            self.stdout.write(self.style.WARNING(f'{key}: expected {expected}, found {actual}'))
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} trip counters do not match the expenses')
+        self.stdout.write(self.style.SUCCESS('Trip counters match the expenses'))
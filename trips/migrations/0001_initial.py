@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-18 20:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('users', '0002_userhierarchy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('destination', models.CharField(blank=True, max_length=200)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('budget_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('spent_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trips', to='users.customuser')),
+            ],
+            options={
+                'ordering': ['-start_date', '-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripBudget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.TextField()),
+                ('budget_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('spent_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense_count', models.PositiveIntegerField(default=0)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='budgets', to='trips.trip')),
+            ],
+            options={
+                'ordering': ['trip', 'category'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['user', 'start_date'], name='trip_user_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tripbudget',
+            constraint=models.UniqueConstraint(fields=('trip', 'category'), name='trip_budget_category_uniq'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import models
+from users.models import CustomUser
+
+
+class Trip(models.Model):
+    """
+    A trip that expenses can be filed under, with an optional overall budget.
+
+    spent_amount and expense_count are counters over the trip's expenses,
+    kept current by the receivers in trips.signals in the same transaction
+    as every expense write, and rebuilt by the rebuild_trip_budgets command.
+    Budgets and counters are in the trip's currency; expenses in other
+    currencies are converted at the rate of their date.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='trips')
+    name = models.CharField(max_length=200)
+    destination = models.CharField(max_length=200, blank=True)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    currency = models.CharField(max_length=3, default=settings.DEFAULT_CURRENCY)
+    budget_amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    spent_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'start_date'], name='trip_user_start_idx'),
+        ]
+        ordering = ['-start_date', '-id']
+
+    def __str__(self):
+        return f"{self.name} ({self.start_date} - {self.end_date})"
+
+
+class TripBudget(models.Model):
+    """
+    Budget and spending of one expense category on a trip.
+
+    A row exists for every category with a budget or with expenses;
+    budget_amount is null when the category is tracked but not capped.
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='budgets')
+    category = models.TextField()
+    budget_amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    spent_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'category'], name='trip_budget_category_uniq'),
+        ]
+        ordering = ['trip', 'category']
+
+    def __str__(self):
+        return f"{self.trip_id} {self.category}: {self.spent_amount} of {self.budget_amount}"
@@ -0,0 +1,65 @@
+from rest_framework import serializers
+from expenses.fx import is_currency_code
+from expenses.serializers import CATEGORY_CHOICES
+from .models import Trip, TripBudget
+
+
+class TripBudgetSerializer(serializers.ModelSerializer):
+    category = serializers.ChoiceField(choices=CATEGORY_CHOICES)
+
+    class Meta:
+        model = TripBudget
+        fields = ['category', 'budget_amount', 'spent_amount', 'expense_count']
+        # Counters are maintained from expense writes
+        read_only_fields = ['spent_amount', 'expense_count']
+
+
+class TripSerializer(serializers.ModelSerializer):
+    budgets = TripBudgetSerializer(many=True, required=False)
+
+    class Meta:
+        model = Trip
+        fields = ['id', 'user', 'name', 'destination', 'start_date', 'end_date', 'currency', 'budget_amount',
+                  'spent_amount', 'expense_count', 'budgets', 'created_at']
+        read_only_fields = ['user', 'spent_amount', 'expense_count', 'created_at']
+
+    def validate_currency(self, value):
+        value = value.upper()
+        if not is_currency_code(value):
+            raise serializers.ValidationError("Must be a three-letter ISO 4217 code.")
+        # The counters are kept in the trip's currency
+        if self.instance is not None and value != self.instance.currency:
+            raise serializers.ValidationError("The currency of a trip cannot be changed.")
+        return value
+
+    def validate(self, attrs):
+        start_date = attrs.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = attrs.get('end_date', getattr(self.instance, 'end_date', None))
+        if start_date and end_date and end_date < start_date:
+            raise serializers.ValidationError({'end_date': ["End date must not be before the start date."]})
+        categories = [budget['category'] for budget in attrs.get('budgets', [])]
+        if len(categories) != len(set(categories)):
+            raise serializers.ValidationError({'budgets': ["Each category can only have one budget."]})
+        return attrs
+
+    def create(self, validated_data):
+        budgets = validated_data.pop('budgets', [])
+        trip = Trip.objects.create(**validated_data)
+        TripBudget.objects.bulk_create([TripBudget(trip=trip, **budget) for budget in budgets])
+        return trip
+
+    def update(self, instance, validated_data):
+        """
+        Update the trip. When budgets are given they replace the category
+        budgets; the spent counters of every category are kept.
+        """
+        budgets = validated_data.pop('budgets', None)
+        trip = super().update(instance, validated_data)
+        if budgets is not None:
+            amounts = {budget['category']: budget.get('budget_amount') for budget in budgets}
+            TripBudget.objects.filter(trip=trip).exclude(category__in=amounts).update(budget_amount=None)
+            for category, budget_amount in amounts.items():
+                TripBudget.objects.update_or_create(trip=trip, category=category, defaults={'budget_amount': budget_amount})
+            # Drop the prefetched budgets so the response shows the new ones
+            trip._prefetched_objects_cache = {}
+        return trip
@@ -0,0 +1,9 @@
+from django.dispatch import receiver
+from expenses.models import Expense
+from expenses.signals import expenses_changed
+from . import budgets
+
+
+@receiver(expenses_changed, sender=Expense)
+def update_trip_counters(sender, changes, expenses=(), **kwargs):
+    budgets.record_changes(changes, expenses)
@@ -0,0 +1,160 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from django.test import TestCase
+from rest_framework.test import APIClient
+from expenses.cache import get_cache
+from expenses.fx import get_rate_cache
+from expenses.models import Expense, FxRate
+from expenses.signals import expenses_bulk_created
+from users.models import CustomUser
+from .budgets import budget_exceeded, rebuild_counters, verify_counters
+from .models import Trip, TripBudget
+
+
+class TripBudgetCounterTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = CustomUser.objects.create_user(username='traveller', email='traveller@example.com', employee_id='E1')
+        self.trip = Trip.objects.create(
+            user=self.user, name='Berlin', start_date=date(2025, 3, 1), end_date=date(2025, 3, 7),
+            budget_amount=Decimal('200.00'),
+        )
+        TripBudget.objects.create(trip=self.trip, category='food', budget_amount=Decimal('50.00'))
+        self.exceeded = []
+        receiver = lambda sender, **kwargs: self.exceeded.append((kwargs['category'], kwargs['spent_amount']))
+        budget_exceeded.connect(receiver, weak=False)
+        self.addCleanup(budget_exceeded.disconnect, receiver)
+
+    def expense(self, amount, category='food', trip=None):
+        return Expense.objects.create(
+            user=self.user, trip=trip or self.trip, category=category, description='Trip', amount=Decimal(amount),
+        )
+
+    def counters(self):
+        self.trip.refresh_from_db()
+        return (self.trip.expense_count, self.trip.spent_amount), {
+            budget.category: (budget.expense_count, budget.spent_amount) for budget in self.trip.budgets.all()
+        }
+
+    def test_counters_follow_expense_writes(self):
+        lunch = self.expense('20.00')
+        taxi = self.expense('35.50', category='transport')
+        self.assertEqual(self.counters(), ((2, Decimal('55.50')), {'food': (1, Decimal('20.00')), 'transport': (1, Decimal('35.50'))}))
+
+        lunch.amount = Decimal('25.00')
+        lunch.save()
+        taxi.category = 'misc'
+        taxi.save()
+        self.assertEqual(
+            self.counters(),
+            ((2, Decimal('60.50')), {'food': (1, Decimal('25.00')), 'transport': (0, Decimal('0.00')), 'misc': (1, Decimal('35.50'))}),
+        )
+
+        taxi.trip = None
+        taxi.save()
+        lunch.delete()
+        self.assertEqual(self.counters()[0], (0, Decimal('0.00')))
+        self.assertEqual(verify_counters(), [])
+
+    def test_bulk_created_expenses_are_counted(self):
+        expenses = [
+            Expense(user=self.user, trip=self.trip, category='food', description='Meal', amount=Decimal('10.00'))
+            for _ in range(3)
+        ]
+        Expense.objects.bulk_create(expenses)
+        expenses_bulk_created.send(sender=Expense, expenses=expenses)
+        self.assertEqual(self.counters()[1]['food'], (3, Decimal('30.00')))
+
+    def test_queryset_updates_move_the_counters(self):
+        other = Trip.objects.create(user=self.user, name='Munich', start_date=date(2025, 3, 8), end_date=date(2025, 3, 9))
+        self.expense('10.00')
+        self.expense('15.00')
+        self.expense('30.00', category='transport')
+
+        Expense.objects.filter(category='food').update(trip=other)
+        Expense.objects.filter(category='transport').update(amount=Decimal('40.00'), category='misc')
+        self.assertEqual(self.counters(), ((1, Decimal('40.00')), {'food': (0, Decimal('0.00')), 'transport': (0, Decimal('0.00')), 'misc': (1, Decimal('40.00'))}))
+        other.refresh_from_db()
+        self.assertEqual((other.expense_count, other.spent_amount), (2, Decimal('25.00')))
+        self.assertEqual(verify_counters(), [])
+
+    def test_overspend_is_reported_once_when_crossed(self):
+        self.expense('45.00')
+        self.assertEqual(self.exceeded, [])
+        with self.assertLogs('trips.budgets', 'WARNING') as logs:
+            self.expense('10.00')
+        self.assertEqual(logs.output, [f'WARNING:trips.budgets:Trip {self.trip.id} food is over budget: 55.00 of 50.00'])
+        self.expense('10.00')
+        self.assertEqual(self.exceeded, [('food', Decimal('55.00'))])
+
+        self.expense('150.00', category='accommodation')
+        self.assertEqual(self.exceeded[-1], (None, Decimal('215.00')))
+
+    def test_foreign_currency_expenses_are_converted(self):
+        FxRate.objects.create(currency='EUR', date=date(2025, 3, 1), rate=Decimal('0.8'))
+        get_rate_cache().clear()
+        self.addCleanup(get_rate_cache().clear)
+
+        dinner = Expense.objects.create(
+            user=self.user, category='food', description='Dinner', amount=Decimal('36.00'), currency='EUR',
+        )
+        Expense.objects.filter(pk=dinner.pk).update(created_at=datetime(2025, 3, 2, 20, tzinfo=dt_timezone.utc))
+        dinner.refresh_from_db()
+        dinner.trip = self.trip
+        dinner.save()
+        self.assertEqual(self.counters()[1]['food'], (1, Decimal('45.00')))
+
+        dinner.amount = Decimal('44.00')
+        dinner.save()
+        self.assertEqual(self.counters()[1]['food'], (1, Decimal('55.00')))
+        self.assertEqual(self.exceeded, [('food', Decimal('55.00'))])
+        self.assertEqual(verify_counters(), [])
+        rebuild_counters()
+        self.assertEqual(self.counters()[1]['food'], (1, Decimal('55.00')))
+
+    def test_rebuild_restores_counters(self):
+        self.expense('20.00')
+        Trip.objects.update(spent_amount=0, expense_count=0)
+        TripBudget.objects.update(spent_amount=0, expense_count=0)
+        self.assertNotEqual(verify_counters(), [])
+
+        rebuild_counters()
+        self.assertEqual(verify_counters(), [])
+        self.assertEqual(TripBudget.objects.get(category='food').budget_amount, Decimal('50.00'))
+
+
+class TripApiTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = CustomUser.objects.create_user(username='traveller', email='traveller@example.com', employee_id='E1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_create_trip_and_read_summary(self):
+        response = self.client.post('/trips/', {
+            'name': 'Lisbon', 'start_date': '2025-05-01', 'end_date': '2025-05-04', 'budget_amount': '300.00',
+            'budgets': [{'category': 'food', 'budget_amount': '40.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        trip_id = response.json()['id']
+
+        response = self.client.post('/expenses/', {
+            'user': self.user.id, 'trip': trip_id, 'category': 'food', 'description': 'Dinner', 'amount': '52.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['trip'], trip_id)
+
+        summary = self.client.get(f'/trips/{trip_id}/summary/').json()
+        self.assertEqual((summary['spent_amount'], summary['remaining_amount'], summary['over_budget']), (52.0, 248.0, False))
+        self.assertEqual(summary['categories'][0]['category'], 'food')
+        self.assertTrue(summary['categories'][0]['over_budget'])
+
+    def test_expense_cannot_use_another_users_trip(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', employee_id='E2')
+        trip = Trip.objects.create(user=other, name='Oslo', start_date=date(2025, 1, 1), end_date=date(2025, 1, 2))
+
+        response = self.client.post('/expenses/', {
+            'user': self.user.id, 'trip': trip.id, 'category': 'food', 'description': 'Lunch', 'amount': '10.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('trip', response.json())
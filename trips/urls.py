@@ -0,0 +1,12 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .views import TripViewSet
+
+# Create a router and register our viewset
+router = DefaultRouter()
+router.register(r'', TripViewSet, basename='trip')
+
+# The API URLs are now determined automatically by the router
+urlpatterns = [
+    path('', include(router.urls)),
+]
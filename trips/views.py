@@ -0,0 +1,33 @@
+from rest_framework import viewsets, permissions
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from .budgets import summarize_trip
+from .models import Trip
+from .serializers import TripSerializer
+
+
+class TripViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet for viewing and editing the authenticated user's trips.
+    """
+    serializer_class = TripSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        """
+        Restricts trips to those belonging to the authenticated user
+        """
+        return Trip.objects.filter(user=self.request.user).prefetch_related('budgets')
+
+    def perform_create(self, serializer):
+        # Budgets default to the user's base currency
+        currency = serializer.validated_data.get('currency', self.request.user.base_currency)
+        serializer.save(user=self.request.user, currency=currency)
+
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        """
+        Spent versus budget for the trip and each category, read from the
+        counters kept by expense writes rather than summed from expenses.
+        """
+        return Response(summarize_trip(self.get_object()))
@@ -0,0 +1,149 @@
+from collections import defaultdict
+from django.db import transaction
+from .models import CustomUser, UserHierarchy
+
+
+def build_closure(edges):
+    """
+    Compute closure rows (ancestor_id, descendant_id, depth) from
+    (user_id, manager_id) pairs. Users inside a manager cycle only get
+    their own row.
+    """
+    children = defaultdict(list)
+    user_ids = []
+    for user_id, manager_id in edges:
+        user_ids.append(user_id)
+        if manager_id is not None:
+            children[manager_id].append(user_id)
+
+    rows = []
+    for user_id in user_ids:
+        # Walk down from each user, recording it as ancestor of its subtree
+        stack = [(user_id, 0)]
+        seen = set()
+        while stack:
+            descendant_id, depth = stack.pop()
+            if descendant_id in seen:
+                continue
+            seen.add(descendant_id)
+            rows.append((user_id, descendant_id, depth))
+            stack.extend((child_id, depth + 1) for child_id in children.get(descendant_id, ()))
+    return rows
+
+
+@transaction.atomic
+def rebuild_hierarchy(batch_size=1000):
+    """
+    Recompute the whole closure table from CustomUser.manager.
+    Returns the number of rows written.
+    """
+    rows = build_closure(CustomUser.objects.values_list('id', 'manager_id'))
+    UserHierarchy.objects.all().delete()
+    UserHierarchy.objects.bulk_create(
+        [UserHierarchy(ancestor_id=a, descendant_id=d, depth=depth) for a, d, depth in rows],
+        batch_size=batch_size,
+    )
+    return len(rows)
+
+
+def is_indexed(user_id):
+    """
+    Return True if the user has its own row in the closure table.
+    """
+    return UserHierarchy.objects.filter(ancestor_id=user_id, descendant_id=user_id).exists()
+
+
+@transaction.atomic
+def ensure_indexed(user_id):
+    """
+    Index a user missing from the closure table (saved with a queryset
+    update, bulk_create or loaddata), indexing its missing managers first.
+    Returns True if any rows were added.
+    """
+    # (user_id, manager_id) pairs from the user up to the first indexed manager
+    missing = []
+    seen = set()
+    current = user_id
+    while current is not None and current not in seen and not is_indexed(current):
+        seen.add(current)
+        manager_id = CustomUser.objects.filter(pk=current).values_list('manager_id', flat=True).first()
+        missing.append((current, manager_id))
+        current = manager_id
+    if current is not None and current in seen:
+        # The managers form a cycle, index its top member as a root
+        missing[-1] = (missing[-1][0], None)
+    for missing_id, manager_id in reversed(missing):
+        _add_rows(missing_id, manager_id)
+    return bool(missing)
+
+
+def ancestor_depths(user_id):
+    """
+    Return (ancestor_id, depth) pairs of the user, itself included,
+    indexing it first if it has none.
+    """
+    ancestors = list(UserHierarchy.objects.filter(descendant_id=user_id).values_list('ancestor_id', 'depth'))
+    if not ancestors and ensure_indexed(user_id):
+        ancestors = list(UserHierarchy.objects.filter(descendant_id=user_id).values_list('ancestor_id', 'depth'))
+    return ancestors
+
+
+def is_in_subtree(user, candidate):
+    """
+    Return True if candidate is user or reports to user at any depth.
+    """
+    # An unindexed candidate is indexed with its whole manager chain, so
+    # its ancestors are complete even if user was unindexed as well
+    return any(ancestor_id == user.pk for ancestor_id, _ in ancestor_depths(candidate.pk))
+
+
+def _add_rows(user_id, manager_id):
+    rows = [UserHierarchy(ancestor_id=user_id, descendant_id=user_id, depth=0)]
+    if manager_id is not None:
+        rows.extend(
+            UserHierarchy(ancestor_id=ancestor_id, descendant_id=user_id, depth=depth + 1)
+            for ancestor_id, depth in ancestor_depths(manager_id)
+        )
+    UserHierarchy.objects.bulk_create(rows)
+
+
+@transaction.atomic
+def add_user(user):
+    """
+    Add closure rows for a newly created user under its manager.
+    """
+    _add_rows(user.pk, user.manager_id)
+
+
+@transaction.atomic
+def move_subtree(user, manager_id):
+    """
+    Re-parent a user, and everyone under them, below manager_id (or make
+    them a root when it is None). Raises ValueError if manager_id is in
+    the user's subtree.
+    """
+    subtree = list(UserHierarchy.objects.filter(ancestor_id=user.pk).values_list('descendant_id', 'depth'))
+    if not subtree:
+        # Never indexed, so nobody is indexed under them either; index
+        # them under their stored manager
+        ensure_indexed(user.pk)
+        return
+    subtree_ids = [descendant_id for descendant_id, _ in subtree]
+    if manager_id in subtree_ids:
+        raise ValueError(f'User {manager_id} reports to user {user.pk} and cannot be their manager')
+
+    # Detach the subtree from its current ancestors
+    UserHierarchy.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+    if manager_id is None:
+        return
+
+    # Attach it below every ancestor of the new manager
+    UserHierarchy.objects.bulk_create(
+        [
+            UserHierarchy(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + depth + 1)
+            for ancestor_id, ancestor_depth in ancestor_depths(manager_id)
+            for descendant_id, depth in subtree
+        ],
+        batch_size=1000,
+    )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from users.hierarchy import rebuild_hierarchy
+
+
+class Command(BaseCommand):
+    help = "Rebuild the manager hierarchy closure table from CustomUser.manager."
+
+    def handle(self, *args, **options):
+        count = rebuild_hierarchy()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} hierarchy rows'))
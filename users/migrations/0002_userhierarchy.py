@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18 20:17
+
+import django.db.models.deletion
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def populate_hierarchy(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    UserHierarchy = apps.get_model('users', 'UserHierarchy')
+
+    edges = list(CustomUser.objects.values_list('id', 'manager_id'))
+    children = defaultdict(list)
+    for user_id, manager_id in edges:
+        if manager_id is not None:
+            children[manager_id].append(user_id)
+
+    rows = []
+    for user_id, _ in edges:
+        stack = [(user_id, 0)]
+        seen = set()
+        while stack:
+            descendant_id, depth = stack.pop()
+            if descendant_id in seen:
+                continue
+            seen.add(descendant_id)
+            rows.append(UserHierarchy(ancestor_id=user_id, descendant_id=descendant_id, depth=depth))
+            stack.extend((child_id, depth + 1) for child_id in children.get(descendant_id, ()))
+    UserHierarchy.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserHierarchy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='users.customuser')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='users.customuser')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='hierarchy_ancestor_depth_idx'), models.Index(fields=['descendant', 'depth'], name='hierarchy_desc_depth_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='hierarchy_pair_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_hierarchy, migrations.RunPython.noop),
+    ]
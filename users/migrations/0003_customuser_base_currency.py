@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 21:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_userhierarchy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='base_currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+    ]
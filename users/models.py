@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
@@ -17,6 +18,8 @@ class CustomUser(AbstractUser):
     last_modified = models.DateTimeField(auto_now=True)
     # profile_image = models.ImageField(upload_to='profile_images/', null=True, blank=True)
     employee_id = models.CharField(max_length=50, unique=True)
+    # Currency totals and reports are converted into
+    base_currency = models.CharField(max_length=3, default=settings.DEFAULT_CURRENCY)
 
     # Add related_name to avoid clashes with auth.User
     groups = models.ManyToManyField(
@@ -42,3 +45,24 @@ class CustomUser(AbstractUser):
         ordering = ['-date_joined']
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+
+
+class UserHierarchy(models.Model):
+    """Closure table of the manager tree.
+
+    Holds one row per (ancestor, descendant) pair, including every user
+    paired with itself at depth 0, so all reports under a manager at any
+    depth are a single indexed lookup on ancestor.
+    """
+    ancestor = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='hierarchy_pair_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['ancestor', 'depth'], name='hierarchy_ancestor_depth_idx'),
+            models.Index(fields=['descendant', 'depth'], name='hierarchy_desc_depth_idx'),
+        ]
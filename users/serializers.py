@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from django.core.validators import RegexValidator
+from .hierarchy import is_in_subtree
 from .models import CustomUser
 
 DEPARTMENT_CHOICES = [
@@ -54,9 +55,11 @@ class CustomUserSerializer(serializers.ModelSerializer):
         return value
 
     def validate_manager(self, value):
-        """Validate manager is not self"""
+        """Validate manager is not self or someone reporting to the user"""
         if value and value == self.context.get('request').user:
             raise serializers.ValidationError("User cannot be their own manager")
+        if value and self.instance is not None and is_in_subtree(self.instance, value):
+            raise serializers.ValidationError("Manager cannot be someone who reports to this user")
         return value
 
     def validate_department(self, value):
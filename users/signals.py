@@ -0,0 +1,59 @@
+from django.db.models.signals import post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import hierarchy
+from .models import CustomUser
+
+# Marks a manager that was not loaded with the instance
+UNKNOWN = object()
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_manager(sender, instance, **kwargs):
+    """
+    Remember the loaded manager so saves can tell when it changed.
+    """
+    if instance.pk and 'manager' not in instance.get_deferred_fields():
+        instance._hierarchy_manager_id = instance.manager_id
+    else:
+        instance._hierarchy_manager_id = UNKNOWN
+
+
+@receiver(pre_save, sender=CustomUser)
+def check_manager(sender, instance, raw=False, **kwargs):
+    """
+    Read the stored manager for instances loaded with deferred fields or
+    built with an explicit primary key, and refuse a manager that reports
+    to the user.
+    """
+    if raw or not instance.pk:
+        return
+    if instance._hierarchy_manager_id is UNKNOWN:
+        instance._hierarchy_manager_id = CustomUser.objects.filter(pk=instance.pk).values_list('manager_id', flat=True).first()
+    if instance.manager_id is not None and instance.manager_id != instance._hierarchy_manager_id:
+        if hierarchy.is_in_subtree(instance, instance.manager):
+            raise ValueError(f'User {instance.manager_id} reports to user {instance.pk} and cannot be their manager')
+
+
+@receiver(post_save, sender=CustomUser)
+def update_hierarchy_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Index new users and move the subtree of users whose manager changed,
+    however they were saved (API, admin, createsuperuser, create_user).
+    """
+    if raw:
+        return
+    if created:
+        hierarchy.add_user(instance)
+    elif instance.manager_id != instance._hierarchy_manager_id:
+        hierarchy.move_subtree(instance, instance.manager_id)
+    instance._hierarchy_manager_id = instance.manager_id
+
+
+@receiver(pre_delete, sender=CustomUser)
+def detach_team_on_delete(sender, instance, **kwargs):
+    """
+    The manager FK is SET_NULL with a queryset update, so make the
+    direct reports roots of their own subtrees before the user goes.
+    """
+    for member in instance.team_members.all():
+        hierarchy.move_subtree(member, None)
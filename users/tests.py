@@ -1,3 +1,127 @@
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from reports.models import WeeklyReport
+from .hierarchy import rebuild_hierarchy
+from .models import CustomUser, UserHierarchy
 
-# Create your tests here.
+
+def create_user(name, manager=None):
+    return CustomUser.objects.create_user(
+        username=name, email=f'{name}@example.com',
+        employee_id=name, department='ENG', mobile='9999999999', manager=manager,
+    )
+
+
+def closure(user):
+    return set(UserHierarchy.objects.filter(descendant=user).values_list('ancestor__username', 'depth'))
+
+
+class UserHierarchyTests(TestCase):
+    def setUp(self):
+        # ceo > vp > lead > dev, and a second root ops
+        self.ceo = create_user('ceo')
+        self.vp = create_user('vp', self.ceo)
+        self.lead = create_user('lead', self.vp)
+        self.dev = create_user('dev', self.lead)
+        self.ops = create_user('ops')
+
+    def assertMatchesRebuild(self):
+        rows = set(UserHierarchy.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        rebuild_hierarchy()
+        self.assertEqual(rows, set(UserHierarchy.objects.values_list('ancestor_id', 'descendant_id', 'depth')))
+
+    def test_created_users_are_indexed_under_their_managers(self):
+        self.assertEqual(closure(self.dev), {('dev', 0), ('lead', 1), ('vp', 2), ('ceo', 3)})
+        self.assertEqual(closure(self.ops), {('ops', 0)})
+        self.assertMatchesRebuild()
+
+    def test_changing_the_manager_moves_the_subtree(self):
+        self.lead.manager = self.ops
+        self.lead.save()
+
+        self.assertEqual(closure(self.dev), {('dev', 0), ('lead', 1), ('ops', 2)})
+        self.assertMatchesRebuild()
+
+        self.lead.manager = None
+        self.lead.save()
+        self.assertEqual(closure(self.dev), {('dev', 0), ('lead', 1)})
+        self.assertMatchesRebuild()
+
+    def test_manager_change_through_the_api(self):
+        response = APIClient().patch(f'/users/{self.lead.id}/', {'manager': self.ops.id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(closure(self.dev), {('dev', 0), ('lead', 1), ('ops', 2)})
+
+    def test_manager_cannot_report_to_the_user(self):
+        response = APIClient().patch(f'/users/{self.vp.id}/', {'manager': self.dev.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('manager', response.json())
+
+        self.vp.manager = self.dev
+        with self.assertRaises(ValueError):
+            self.vp.save()
+        self.assertEqual(CustomUser.objects.get(pk=self.vp.pk).manager_id, self.ceo.id)
+
+    def test_users_saved_without_signals_are_indexed_when_needed(self):
+        # A queryset update bypasses the receivers and leaves temp unindexed
+        temp = create_user('temp')
+        UserHierarchy.objects.filter(descendant=temp).delete()
+        CustomUser.objects.filter(pk=temp.pk).update(manager=self.vp)
+
+        # Moving someone under temp indexes temp first instead of orphaning them
+        self.dev.manager = temp
+        self.dev.save()
+
+        self.assertEqual(closure(self.dev), {('dev', 0), ('temp', 1), ('vp', 2), ('ceo', 3)})
+        self.assertMatchesRebuild()
+
+        # The cycle check indexes the candidate manager as well
+        UserHierarchy.objects.filter(descendant=temp).delete()
+        temp.refresh_from_db()
+        self.vp.manager = temp
+        with self.assertRaises(ValueError):
+            self.vp.save()
+
+    def test_deleting_a_manager_makes_the_reports_roots(self):
+        self.vp.delete()
+
+        self.assertEqual(closure(self.dev), {('dev', 0), ('lead', 1)})
+        self.assertMatchesRebuild()
+
+
+class ApprovalQueueTests(TestCase):
+    def setUp(self):
+        self.manager = create_user('manager')
+        self.report = create_user('report', self.manager)
+        self.indirect = create_user('indirect', self.report)
+        self.outsider = create_user('outsider')
+        for user in (self.report, self.indirect, self.outsider):
+            WeeklyReport.objects.create(
+                user=user, week_start='2024-01-01', week_end='2024-01-07',
+                status='submitted', submitted_at=timezone.now(),
+            )
+        WeeklyReport.objects.create(user=self.report, week_start='2024-01-08', week_end='2024-01-14')
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def queue(self, **params):
+        response = self.client.get('/reports/approval_queue/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        results = data['results'] if isinstance(data, dict) else data
+        return {report['user'] for report in results}
+
+    def test_lists_submitted_reports_at_any_depth(self):
+        self.assertEqual(self.queue(), {self.report.id, self.indirect.id})
+
+    def test_depth_limits_the_levels(self):
+        self.assertEqual(self.queue(depth=1), {self.report.id})
+        self.assertEqual(self.queue(depth=2), {self.report.id, self.indirect.id})
+
+    def test_follows_manager_changes(self):
+        self.indirect.manager = self.outsider
+        self.indirect.save()
+
+        self.assertEqual(self.queue(), {self.report.id})